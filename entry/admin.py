@@ -1,22 +1,33 @@
 from django.contrib import admin
 
-from entry.models import Entry, Point, Lap
-from entry.services.entry_fit import EntryFit
+from entry.changelists import KeysetAdminMixin, autocomplete_filter
+from entry.models import Entry, EntryMetric, EntrySummary, ImportJob, Point, Lap
+
+
+class EntryMetricInline(admin.TabularInline):
+    model = EntryMetric
+    fields = ('stage', 'model', 'calls', 'seconds', 'rows', 'bytes', 'queries')
+    readonly_fields = fields
+    extra = 0
+
+    def has_add_permission(self, request, obj=None): return False
 
 
 @admin.register(Entry)
 class EntryAdmin(admin.ModelAdmin):
     list_display = ('id', 'customer', 'created', 'modified')
     list_filter = ('created', 'modified')
-    search_fields = ('customer',)
+    search_fields = ('customer__username',)
     ordering = ('-created',)
     raw_id_fields = ('customer',)
+    list_select_related = ('customer',)
+    inlines = (EntryMetricInline,)
 
     def has_change_permission(self, request, obj=None): return False
 
 
 @admin.register(Point)
-class PointAdmin(admin.ModelAdmin):
+class PointAdmin(KeysetAdminMixin, admin.ModelAdmin):
     list_display = (
         'id',
         'user',
@@ -29,9 +40,11 @@ class PointAdmin(admin.ModelAdmin):
         'cadence',
         'speed'
     )
-    list_filter = ('user', 'entry', 'timestamp')
-    search_fields = ('user',)
+    list_filter = (autocomplete_filter('user'), autocomplete_filter('entry'), 'timestamp')
+    search_fields = ('user__username',)
     ordering = ('-timestamp',)
+    keyset_field = 'timestamp'
+    list_select_related = ('user',)
     fieldsets = (
         ('Point', {
             'fields': (
@@ -47,7 +60,7 @@ class PointAdmin(admin.ModelAdmin):
 
 
 @admin.register(Lap)
-class LapAdmin(admin.ModelAdmin):
+class LapAdmin(KeysetAdminMixin, admin.ModelAdmin):
     list_display = (
         'id',
         'user',
@@ -59,9 +72,11 @@ class LapAdmin(admin.ModelAdmin):
         'max_heart_rate',
         'avg_heart_rate'
     )
-    list_filter = ('user', 'number')
-    search_fields = ('user',)
+    list_filter = (autocomplete_filter('user'), autocomplete_filter('entry'), 'start_time')
+    search_fields = ('user__username',)
     ordering = ('-start_time',)
+    keyset_field = 'start_time'
+    list_select_related = ('user', 'entry')
     fieldsets = (
         ('Lap', {
             'fields': (
@@ -74,3 +89,48 @@ class LapAdmin(admin.ModelAdmin):
         }),
     )
     raw_id_fields = ('user',)
+
+
+@admin.register(EntrySummary)
+class EntrySummaryAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'user',
+        'entry',
+        'start_time',
+        'duration',
+        'total_distance',
+        'elevation_gain',
+        'avg_heart_rate',
+        'max_heart_rate',
+        'points_count'
+    )
+    list_filter = ('start_time',)
+    ordering = ('-start_time',)
+    raw_id_fields = ('user', 'entry')
+    list_select_related = ('user', 'entry')
+
+    def has_change_permission(self, request, obj=None): return False
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'entry',
+        'status',
+        'stage',
+        'chunks_committed',
+        'points_committed',
+        'laps_committed',
+        'attempts',
+        'started',
+        'finished',
+        'modified'
+    )
+    list_filter = ('status', 'modified')
+    ordering = ('-modified',)
+    raw_id_fields = ('entry',)
+    list_select_related = ('entry',)
+
+    def has_change_permission(self, request, obj=None): return False
@@ -0,0 +1,103 @@
+"""Export archives and compressed entry files
+
+A `.zip` entry is an archive: each supported member becomes a child entry (`parent`, `member`) sharing the archive
+file, and members are read straight from the archive, never extracted to disk. `.gz` files and members (e.g.
+`activity.fit.gz`) are decompressed while they are read.
+"""
+import gzip
+import hashlib
+import logging
+import os
+import zipfile
+from contextlib import ExitStack, contextmanager
+from typing import IO, Iterator, List, Tuple, Union
+
+from entry.models import Entry
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = ('zip',)
+COMPRESSED_EXTENSION = 'gz'
+
+
+def get_name_extension(name: str) -> str:
+    """Lower-cased extension of the format of a file name, ignoring a `.gz` suffix"""
+    parts = name.lower().rsplit('/', 1)[-1].split('.')
+    if len(parts) > 2 and parts[-1] == COMPRESSED_EXTENSION:
+        parts.pop()
+    return parts[-1]
+
+
+def is_compressed(name: str) -> bool:
+    return name.lower().endswith('.' + COMPRESSED_EXTENSION)
+
+
+@contextmanager
+def open_entry_file(entry: Entry) -> Iterator[Union[str, IO[bytes]]]:
+    """Open the data of the entry for its service
+    a plain file is given as its path, archive members and compressed files as binary file objects
+    """
+    if not entry.member and not is_compressed(entry.file.name):
+        yield entry.file.path
+        return
+    with ExitStack() as stack:
+        if entry.member:
+            archive = stack.enter_context(zipfile.ZipFile(stack.enter_context(entry.file.open('rb'))))
+            source = stack.enter_context(archive.open(entry.member))
+            name = entry.member
+        else:
+            source = stack.enter_context(entry.file.open('rb'))
+            name = entry.file.name
+        if is_compressed(name):
+            source = stack.enter_context(gzip.GzipFile(fileobj=source))
+        yield source
+
+
+def get_source_size(source: Union[str, IO[bytes]]) -> int:
+    """Bytes of an entry source, read so far for file objects (decompressed bytes of compressed files)"""
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    try:
+        return source.tell()
+    except (OSError, ValueError):
+        return 0
+
+
+def iter_members(archive: zipfile.ZipFile, extensions) -> Iterator[zipfile.ZipInfo]:
+    """Archive members of the supported formats, skipping directories and metadata files"""
+    for info in archive.infolist():
+        base_name = info.filename.rsplit('/', 1)[-1]
+        if info.is_dir() or info.filename.startswith('__MACOSX/') or base_name.startswith('.'):
+            continue
+        if get_name_extension(info.filename) in extensions:
+            yield info
+
+
+def member_sha256(archive: zipfile.ZipFile, info: zipfile.ZipInfo, chunk_size: int = 2 ** 20) -> str:
+    """Content hash of an archive member, as stored in the archive (compressed members are not decompressed)"""
+    digest = hashlib.sha256()
+    with archive.open(info) as member:
+        for chunk in iter(lambda: member.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def create_member_entries(entry: Entry, extensions) -> List[Tuple[Entry, bool]]:
+    """Create a child entry for each supported member of the archive entry, if not created yet
+    returns (child, created) pairs. Children are not sent to the queue, the archive is processed as one batch.
+    """
+    existing = {child.member: child for child in entry.members.all()}
+    children = []
+    with entry.file.open('rb') as f, zipfile.ZipFile(f) as archive:
+        for info in iter_members(archive, extensions):
+            if info.filename in existing:
+                children.append((existing[info.filename], False))
+                continue
+            child = Entry(
+                customer_id=entry.customer_id, file=entry.file.name, parent=entry, member=info.filename,
+                sha256=member_sha256(archive, info))
+            child.skip_enqueue = True
+            child.save()
+            children.append((child, True))
+    logger.info('Archive %s has %s members to import', entry.file.name, len(children))
+    return children
@@ -0,0 +1,6 @@
+"""Ingestion benchmarks
+
+`generators` writes synthetic FIT, GPX, TCX and CSV files of any size, modeled on the files of `docs/dataset`,
+`runner` times the stages of the entry services on them against the configured database and compares results
+with a stored baseline. Run them with the `benchmark_entries` management command.
+"""
@@ -0,0 +1,274 @@
+"""Synthetic entry files
+
+A track is a deterministic random walk around the start of the `docs/dataset` trail run: one point a second,
+elevation, heart rate, cadence and speed, and a lap every `lap_size` points. Text writers render points in chunks, so
+documents of millions of points are never built as one string.
+"""
+import csv
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, TextIO
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6371008.8
+START_TIME = datetime(2020, 10, 10, 18, 27, 23, tzinfo=timezone.utc)
+START_POSITION = (37.252210, -122.217937)
+LAP_SIZE = 1000
+CHUNK_SIZE = 10000
+
+# fit timestamps are seconds since 1989-12-31 00:00:00 UTC
+FIT_EPOCH = 631065600
+FIT_ENUM, FIT_UINT8, FIT_UINT16, FIT_SINT32, FIT_UINT32 = 0x00, 0x02, 0x84, 0x85, 0x86
+FIT_DTYPES = {FIT_ENUM: '<u1', FIT_UINT8: '<u1', FIT_UINT16: '<u2', FIT_SINT32: '<i4', FIT_UINT32: '<u4'}
+# global message number, local message type, (field number, base type, column) of written fields
+FIT_MESSAGES = {
+    'file_id': (0, 0, [(0, FIT_ENUM, 'type'), (1, FIT_UINT16, 'manufacturer'), (4, FIT_UINT32, 'time_created')]),
+    'record': (20, 1, [
+        (253, FIT_UINT32, 'timestamp'), (0, FIT_SINT32, 'latitude'), (1, FIT_SINT32, 'longitude'),
+        (2, FIT_UINT16, 'altitude'), (3, FIT_UINT8, 'heart_rate'), (4, FIT_UINT8, 'cadence'),
+        (6, FIT_UINT16, 'speed'),
+    ]),
+    'lap': (19, 2, [
+        (253, FIT_UINT32, 'timestamp'), (2, FIT_UINT32, 'start_time'), (7, FIT_UINT32, 'total_elapsed_time'),
+        (9, FIT_UINT32, 'total_distance'), (14, FIT_UINT16, 'max_speed'), (15, FIT_UINT8, 'avg_heart_rate'),
+        (16, FIT_UINT8, 'max_heart_rate'),
+    ]),
+}
+
+
+def get_crc_table() -> list:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+FIT_CRC_TABLE = get_crc_table()
+
+
+def fit_crc(data: bytes, crc: int = 0) -> int:
+    """FIT checksum (CRC-16/ARC), a byte at a time"""
+    table = FIT_CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def generate_track(points: int, lap_size: int = LAP_SIZE, seed: int = 0) -> pd.DataFrame:
+    """Points dataframe, columns are Point field names"""
+    rng = np.random.default_rng(seed)
+    index = np.arange(points)
+    speed = np.clip(2.8 + 0.6 * np.sin(index / 600) + rng.normal(0, 0.2, points), 0.5, 6.0)
+    bearing = np.cumsum(rng.normal(0, 0.08, points))
+    latitude = START_POSITION[0] + np.degrees(np.cumsum(speed * np.cos(bearing)) / EARTH_RADIUS)
+    longitude = START_POSITION[1] + np.degrees(
+        np.cumsum(speed * np.sin(bearing)) / (EARTH_RADIUS * np.cos(np.radians(START_POSITION[0]))))
+    return pd.DataFrame({
+        'latitude': latitude,
+        'longitude': longitude,
+        'lap_number': index // lap_size + 1,
+        'altitude': 129 + 150 * (1 - np.cos(index / 900)) + rng.normal(0, 0.5, points),
+        'timestamp': pd.date_range(START_TIME, periods=points, freq='s'),
+        'heart_rate': np.clip(140 + 25 * np.sin(index / 700) + rng.normal(0, 3, points), 60, 200).round(),
+        'cadence': np.clip(80 + rng.normal(0, 4, points), 50, 110).round(),
+        'speed': speed,
+    })
+
+
+def get_laps(track: pd.DataFrame) -> pd.DataFrame:
+    """Laps dataframe of a track, columns are Lap field names"""
+    step = np.hypot(
+        np.radians(track['latitude'].diff().fillna(0)),
+        np.radians(track['longitude'].diff().fillna(0)) * np.cos(np.radians(START_POSITION[0]))) * EARTH_RADIUS
+    climb = track['altitude'].diff().fillna(0)
+    grouped = track.assign(step=step, gain=climb.clip(lower=0), loss=-climb.clip(upper=0)).groupby('lap_number')
+    return pd.DataFrame({
+        'number': grouped['lap_number'].first(),
+        'start_time': grouped['timestamp'].first(),
+        'total_elapsed_time': grouped['timestamp'].count().astype(float),
+        'total_distance': grouped['step'].sum(),
+        'max_speed': grouped['speed'].max(),
+        'avg_heart_rate': grouped['heart_rate'].mean().round(),
+        'max_heart_rate': grouped['heart_rate'].max(),
+        'elevation_gain': grouped['gain'].sum(),
+        'elevation_loss': grouped['loss'].sum(),
+    }).reset_index(drop=True)
+
+
+def iter_chunks(track: pd.DataFrame) -> Iterator[pd.DataFrame]:
+    for start in range(0, len(track), CHUNK_SIZE):
+        yield track.iloc[start:start + CHUNK_SIZE]
+
+
+def iso(series: pd.Series) -> pd.Series:
+    return series.dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def write_gpx(track: pd.DataFrame, f: TextIO):
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<gpx version="1.1" creator="entry.benchmarks" xmlns="http://www.topografix.com/GPX/1/1" '
+            'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">\n'
+            '  <metadata><time>{}</time></metadata>\n'
+            '  <trk><name>Synthetic Trail Run</name>\n'.format(START_TIME.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    for lap_number, lap in track.groupby('lap_number', sort=True):
+        f.write('    <trkseg>\n')
+        for chunk in iter_chunks(lap):
+            f.write(''.join(
+                '      <trkpt lat="{:.6f}" lon="{:.6f}"><ele>{:.1f}</ele><time>{}</time><extensions>'
+                '<gpxtpx:TrackPointExtension><gpxtpx:hr>{:.0f}</gpxtpx:hr><gpxtpx:cad>{:.0f}</gpxtpx:cad>'
+                '</gpxtpx:TrackPointExtension></extensions></trkpt>\n'.format(*row)
+                for row in zip(chunk['latitude'], chunk['longitude'], chunk['altitude'], iso(chunk['timestamp']),
+                               chunk['heart_rate'], chunk['cadence'])))
+        f.write('    </trkseg>\n')
+    f.write('  </trk>\n</gpx>\n')
+
+
+def write_tcx(track: pd.DataFrame, f: TextIO):
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2" '
+            'xmlns:ns3="http://www.garmin.com/xmlschemas/ActivityExtension/v2">\n'
+            '  <Activities><Activity Sport="Running"><Id>{}</Id>\n'.format(START_TIME.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    laps = get_laps(track).set_index('number')
+    for lap_number, lap in track.groupby('lap_number', sort=True):
+        summary = laps.loc[lap_number]
+        f.write('    <Lap StartTime="{}"><TotalTimeSeconds>{:.1f}</TotalTimeSeconds>'
+                '<DistanceMeters>{:.2f}</DistanceMeters><MaximumSpeed>{:.3f}</MaximumSpeed>'
+                '<AverageHeartRateBpm><Value>{:.0f}</Value></AverageHeartRateBpm>'
+                '<MaximumHeartRateBpm><Value>{:.0f}</Value></MaximumHeartRateBpm><Track>\n'.format(
+                    summary['start_time'].strftime('%Y-%m-%dT%H:%M:%SZ'), summary['total_elapsed_time'],
+                    summary['total_distance'], summary['max_speed'], summary['avg_heart_rate'],
+                    summary['max_heart_rate']))
+        for chunk in iter_chunks(lap):
+            f.write(''.join(
+                '      <Trackpoint><Time>{}</Time><Position><LatitudeDegrees>{:.6f}</LatitudeDegrees>'
+                '<LongitudeDegrees>{:.6f}</LongitudeDegrees></Position><AltitudeMeters>{:.1f}</AltitudeMeters>'
+                '<HeartRateBpm><Value>{:.0f}</Value></HeartRateBpm><Cadence>{:.0f}</Cadence>'
+                '<Extensions><ns3:TPX><ns3:Speed>{:.3f}</ns3:Speed></ns3:TPX></Extensions></Trackpoint>\n'.format(*row)
+                for row in zip(iso(chunk['timestamp']), chunk['latitude'], chunk['longitude'], chunk['altitude'],
+                               chunk['heart_rate'], chunk['cadence'], chunk['speed'])))
+        f.write('    </Track></Lap>\n')
+    f.write('  </Activity></Activities>\n</TrainingCenterDatabase>\n')
+
+
+def write_csv(track: pd.DataFrame, f: TextIO):
+    """Splits export, a split (row) per lap and a summary row"""
+    laps = get_laps(track)
+    totals = laps.sum(numeric_only=True)
+    totals['avg_heart_rate'] = laps['avg_heart_rate'].mean()
+    totals['max_heart_rate'] = laps['max_heart_rate'].max()
+    laps = pd.concat([laps, totals.to_frame().T], ignore_index=True)
+
+    def duration(seconds: pd.Series) -> pd.Series:
+        return seconds.fillna(0).round().astype(int).map(
+            lambda value: '{:02d}:{:02d}:{:02d}'.format(value // 3600, value % 3600 // 60, value % 60))
+
+    distance = laps['total_distance'] / 1000
+    pace = duration(laps['total_elapsed_time'] / distance.where(distance > 0))
+    splits = pd.DataFrame({
+        'Split': [str(number) for number in range(1, len(laps))] + ['Summary'],
+        'Time': duration(laps['total_elapsed_time']),
+        'Moving Time': duration(laps['total_elapsed_time']),
+        'Distance': distance.round(3),
+        'Elevation Gain': laps['elevation_gain'].round().astype(int),
+        'Elev Loss': laps['elevation_loss'].round().astype(int),
+        'Avg Pace': pace,
+        'Avg Moving Paces': pace,
+        'Best Pace': '00:00:00',
+        'Avg Run Cadence': 81,
+        'Max Run Cadence': 105,
+        'Avg Stride Length': 92,
+        'Avg HR': laps['avg_heart_rate'].round().astype(int),
+        'Max HR': laps['max_heart_rate'].round().astype(int),
+        'Avg Temperature': 21,
+        'Calories': 113,
+    })
+    splits.to_csv(f, index=False, quoting=csv.QUOTE_ALL)
+
+
+def fit_message(name: str, values: Dict[str, np.ndarray]) -> bytes:
+    """Data messages of `name` as packed little-endian records, a column of values per field"""
+    global_number, local_type, fields = FIT_MESSAGES[name]
+    dtype = np.dtype([('header', '<u1')] + [(column, FIT_DTYPES[base_type]) for _, base_type, column in fields])
+    size = len(next(iter(values.values())))
+    records = np.zeros(size, dtype=dtype)
+    records['header'] = local_type
+    for _, _, column in fields:
+        records[column] = values[column]
+    return records.tobytes()
+
+
+def fit_definition(name: str) -> bytes:
+    global_number, local_type, fields = FIT_MESSAGES[name]
+    data = struct.pack('<BBBHB', 0x40 | local_type, 0, 0, global_number, len(fields))
+    for number, base_type, _ in fields:
+        data += struct.pack('<BBB', number, np.dtype(FIT_DTYPES[base_type]).itemsize, base_type)
+    return data
+
+
+def fit_time(series: pd.Series) -> np.ndarray:
+    return series.astype('int64').to_numpy() // 10 ** 9 - FIT_EPOCH
+
+
+def write_fit(track: pd.DataFrame, f):
+    """Activity file, records followed by the lap message of each lap"""
+    laps = get_laps(track).set_index('number')
+    data = [fit_definition(name) for name in FIT_MESSAGES]
+    data.append(fit_message('file_id', {
+        'type': np.array([4]), 'manufacturer': np.array([255]),
+        'time_created': fit_time(pd.Series([pd.Timestamp(START_TIME)]))}))
+    for lap_number, lap in track.groupby('lap_number', sort=True):
+        data.append(fit_message('record', {
+            'timestamp': fit_time(lap['timestamp']),
+            'latitude': (lap['latitude'] * (2 ** 31 / 180)).round().to_numpy(),
+            'longitude': (lap['longitude'] * (2 ** 31 / 180)).round().to_numpy(),
+            'altitude': ((lap['altitude'] + 500) * 5).round().to_numpy(),
+            'heart_rate': lap['heart_rate'].to_numpy(),
+            'cadence': lap['cadence'].to_numpy(),
+            'speed': (lap['speed'] * 1000).round().to_numpy(),
+        }))
+        summary = laps.loc[[lap_number]]
+        data.append(fit_message('lap', {
+            'timestamp': fit_time(lap['timestamp'].iloc[-1:]),
+            'start_time': fit_time(summary['start_time']),
+            'total_elapsed_time': (summary['total_elapsed_time'] * 1000).round().to_numpy(),
+            'total_distance': (summary['total_distance'] * 100).round().to_numpy(),
+            'max_speed': (summary['max_speed'] * 1000).round().to_numpy(),
+            'avg_heart_rate': summary['avg_heart_rate'].to_numpy(),
+            'max_heart_rate': summary['max_heart_rate'].to_numpy(),
+        }))
+    data = b''.join(data)
+    header = struct.pack('<BBHI4s', 14, 0x20, 2132, len(data), b'.FIT')
+    header += struct.pack('<H', fit_crc(header))
+    f.write(header)
+    f.write(data)
+    f.write(struct.pack('<H', fit_crc(data, fit_crc(header))))
+
+
+WRITERS: Dict[str, Callable] = {
+    'csv': write_csv,
+    'fit': write_fit,
+    'gpx': write_gpx,
+    'tcx': write_tcx,
+}
+
+
+def generate_file(extension: str, points: int, directory: str, seed: int = 0) -> str:
+    """Path of a synthetic file of the format, written if it does not exist yet
+    csv files are splits exports, `points` is their number of splits
+    """
+    path = os.path.join(directory, 'synthetic-{}-{}.{}'.format(points, seed, extension))
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    track = generate_track(points, lap_size=1 if extension == 'csv' else LAP_SIZE, seed=seed)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb' if extension == 'fit' else 'w') as f:
+        WRITERS[extension](track, f)
+    os.replace(temp_path, path)
+    return path
@@ -0,0 +1,171 @@
+"""Entry service benchmarks
+
+Each synthetic file is run through the stages of its service against the configured database:
+`parse` (file to dataframes), `convert` (dataframes to model objs), `store` (dataframes to db, including the summary)
+and `run` (the whole import, as a worker does it). Db stages run in transactions that are rolled back, so nothing
+is left behind and every repeat inserts the same rows. Results are plain dicts, stored as json.
+"""
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+
+from entry.benchmarks.generators import generate_file
+from entry.formats import get_formats
+from entry.models import Entry
+
+STAGES = ('parse', 'convert', 'store', 'run')
+
+
+class Rollback(Exception):
+    pass
+
+
+def get_environment() -> Dict:
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': connection.vendor,
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'chunk_size': settings.ENTRY_CHUNK_SIZE,
+        'point_storage': settings.ENTRY_POINT_STORAGE,
+    }
+
+
+def get_max_rss() -> int:
+    """Peak resident set size of the process in bytes"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def rolled_back(function: Callable) -> Callable:
+    """Run the function in a transaction that is rolled back"""
+    def wrapper():
+        try:
+            with transaction.atomic():
+                function()
+                raise Rollback
+        except Rollback:
+            pass
+    return wrapper
+
+
+def measure(function: Callable, repeat: int = 1, trace_memory: bool = True) -> Dict:
+    """Best wall time of `repeat` calls and the statements run by a call
+    the peak of python allocations is traced in one more call, tracing slows it down too much to time it.
+    COPY streams are not statements run through django and are not counted.
+    """
+    queries = []
+
+    def count(execute, sql, params, many, context):
+        queries[-1] += 1
+        return execute(sql, params, many, context)
+
+    timings = []
+    with connection.execute_wrapper(count):
+        for _ in range(max(repeat, 1)):
+            queries.append(0)
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+    result = {'seconds': min(timings), 'queries': queries[-1]}
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            function()
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    result['max_rss'] = get_max_rss()
+    return result
+
+
+def benchmark_file(extension: str, path: str, repeat: int = 1, trace_memory: bool = True) -> List[Dict]:
+    """Results of each stage of the service of the format on the file
+    the file has to be in MEDIA_ROOT, the entry of the `run` stage reads it from the storage
+    """
+    service_class = get_formats()[extension].get_service()
+    results = []
+    try:
+        with transaction.atomic():
+            user, _ = get_user_model().objects.get_or_create(username='benchmark')
+            entry = Entry(customer=user, file=os.path.relpath(path, settings.MEDIA_ROOT))
+            entry.skip_enqueue = True
+            entry.save()
+            service = service_class(entry)
+            frames = list(service.get_model_dataframes(path))
+            rows = sum(len(df) for model, df in frames)
+
+            stages = {
+                'parse': lambda: list(service_class(entry).get_model_dataframes(path)),
+                'convert': lambda: [service.dataframe_to_model_objs(df, model) for model, df in frames],
+                'store': rolled_back(lambda: service_class(entry).store(frames)),
+                'run': rolled_back(lambda: service_class(entry).run()),
+            }
+            for stage in STAGES:
+                result = measure(stages[stage], repeat=repeat, trace_memory=trace_memory)
+                result.update({
+                    'format': extension, 'stage': stage, 'rows': rows,
+                    'rows_per_second': rows / result['seconds'] if result['seconds'] else None,
+                })
+                results.append(result)
+            raise Rollback
+    except Rollback:
+        pass
+    return results
+
+
+def run_benchmarks(extensions: List[str], sizes: List[int], directory: str, repeat: int = 1,
+                   trace_memory: bool = True, seed: int = 0, callback: Callable = None) -> Dict:
+    """Benchmark every format and size, files are generated in the directory if they do not exist yet"""
+    results = []
+    for extension in extensions:
+        for points in sizes:
+            path = generate_file(extension, points, directory, seed=seed)
+            for result in benchmark_file(extension, path, repeat=repeat, trace_memory=trace_memory):
+                result['points'] = points
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+    return {'environment': get_environment(), 'results': results}
+
+
+def get_key(result: Dict) -> str:
+    return '{format}-{points}-{stage}'.format(**result)
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float = 0.25, min_seconds: float = 0.05) -> List[str]:
+    """Regressions of the results against the baseline
+    slower or more memory hungry by more than the tolerance (timings also by more than min_seconds, under that
+    it is noise), or running more statements. Results missing from the baseline are not compared.
+    """
+    baseline_results = {get_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        key = get_key(result)
+        base: Optional[Dict] = baseline_results.get(key)
+        if base is None:
+            continue
+        seconds, base_seconds = result['seconds'], base['seconds']
+        if seconds > base_seconds * (1 + tolerance) and seconds - base_seconds > min_seconds:
+            regressions.append('{}: {:.3f} s, baseline {:.3f} s'.format(key, seconds, base_seconds))
+        if result['queries'] > base['queries']:
+            regressions.append('{}: {} queries, baseline {}'.format(key, result['queries'], base['queries']))
+        memory, base_memory = result.get('peak_memory'), base.get('peak_memory')
+        if memory is not None and base_memory is not None and memory > base_memory * (1 + tolerance):
+            regressions.append('{}: {:.1f} MiB peak memory, baseline {:.1f} MiB'.format(
+                key, memory / 2 ** 20, base_memory / 2 ** 20))
+    return regressions
@@ -0,0 +1,80 @@
+"""Cache of entry reads
+
+Summaries, simplified tracks and pages of points and laps are cached in redis as zlib compressed json (pages as
+their gzipped response body) under keys of the version of their entry, e.g. `entry:42:<version>:summary`. An entry
+gets a new version when it is imported again or deleted, which leaves its old keys unread until they expire
+(CACHE_TTL). Keys are of the entry holding the data, so duplicates of an upload share the cache of its source.
+"""
+import gzip
+import hashlib
+import json
+import uuid
+import zlib
+from typing import Callable, Iterable, Iterator, Optional
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+# bump when cached values change shape
+CACHE_FORMAT_VERSION = 1
+
+
+def pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':')).encode())
+
+
+def unpack(data: bytes):
+    return json.loads(zlib.decompress(data))
+
+
+def get_version_key(entry_id: int) -> str:
+    return 'entry:{}:version'.format(entry_id)
+
+
+def get_entry_version(entry_id: int) -> str:
+    """Current version of the entry, a new one if it has none (never cached, invalidated or evicted)"""
+    key = get_version_key(entry_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex[:12], timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def make_key(entry_id: int, kind: str, *parts) -> str:
+    """Key of a cached read of the entry, parameters of the read are hashed"""
+    key = 'entry:{}:{}:{}:{}'.format(entry_id, get_entry_version(entry_id), CACHE_FORMAT_VERSION, kind)
+    if parts:
+        key += ':' + hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+    return key
+
+
+def invalidate_entry(entry_id: int):
+    """Give the entry a new version once the current transaction commits"""
+    transaction.on_commit(lambda: cache.delete(get_version_key(entry_id)))
+
+
+def get_or_set(key: str, compute: Callable[[], object]):
+    """Cached value of the key, computed and cached on a miss, None values are not cached"""
+    data = cache.get(key)
+    if data is not None:
+        return unpack(data)
+    value = compute()
+    if value is not None:
+        cache.set(key, pack(value))
+    return value
+
+
+def get_page(key: str) -> Optional[bytes]:
+    """Gzipped body of a cached page"""
+    return cache.get(key)
+
+
+def cache_page_chunks(key: str, chunks: Iterable[str]) -> Iterator[str]:
+    """Pass chunks of a page body through, the body is cached once all of them were sent"""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    cache.set(key, gzip.compress(''.join(parts).encode()))
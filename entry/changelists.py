@@ -0,0 +1,174 @@
+"""Admin changelists of large tables
+
+Point and lap changelists must not scan their tables to render a page: the result count is estimated by
+PostgreSQL (table statistics without filters, the query plan with them), pages are fetched by the (keyset field,
+id) of the last row shown instead of an offset, and related objs are filtered with the autocomplete widget instead
+of a lookup of all of them.
+"""
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+
+CURSOR_VAR = 'after'
+# estimates under this are counted exactly, statistics of small or new tables may be missing or off
+EXACT_COUNT_LIMIT = 10000
+
+
+def estimate_count(queryset) -> int:
+    """Number of rows of the queryset, estimated by PostgreSQL
+    tables without filters from the `reltuples` statistics of the table (or the sum of its partitions),
+    filtered querysets from the row estimate of their plan
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            table = connection.ops.quote_name(queryset.model._meta.db_table)
+            # statistics of partitioned tables are counted by their partitions, analyzed ones have totals too
+            cursor.execute(
+                'SELECT COALESCE((SELECT SUM(GREATEST(c.reltuples, 0)) FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = %s::regclass), '
+                '(SELECT GREATEST(reltuples, 0) FROM pg_class WHERE oid = %s::regclass))::bigint', [table, table])
+            estimate = cursor.fetchone()[0]
+        else:
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            estimate = cursor.fetchone()[0][0]['Plan']['Plan Rows']
+    return estimate if estimate >= EXACT_COUNT_LIMIT else queryset.count()
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """Filter by a related obj picked with the autocomplete widget
+    the admin of the related model has to define search_fields
+    """
+    template = 'admin/entry/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        field = model._meta.get_field(self.field_name)
+        self.title = field.verbose_name
+        super().__init__(request, params, model, model_admin)
+        choices = forms.ModelChoiceField(
+            field.remote_field.model._default_manager.all(), required=False,
+            widget=AutocompleteSelect(field, model_admin.admin_site))
+        self.widget = choices.widget
+        self.rendered_widget = self.widget.render(
+            self.parameter_name, self.value(), attrs={'id': 'id_filter_{}'.format(self.field_name)})
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        yield {
+            'hidden_params': [(name, value) for name, value in sorted(changelist.params.items())
+                              if name not in (self.parameter_name, CURSOR_VAR)],
+        }
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+
+def autocomplete_filter(field_name: str) -> type:
+    """Autocomplete filter of the foreign key, e.g. `list_filter = (autocomplete_filter('user'),)`"""
+    return type('{}AutocompleteFilter'.format(field_name.title().replace('_', '')), (AutocompleteFilter,), {
+        'field_name': field_name, 'parameter_name': '{}__id__exact'.format(field_name),
+    })
+
+
+def get_keyset_condition(field_name: str, value, pk) -> Q:
+    """Rows after (value, pk) in the (field DESC NULLS FIRST, id DESC) order, the PostgreSQL default
+    the redundant `<=` bound lets a (field, id) index scan start at the cursor
+    """
+    if value is None:
+        return Q(**{field_name + '__isnull': True, 'pk__lt': pk}) | Q(**{field_name + '__isnull': False})
+    after = Q(**{field_name + '__lt': value}) | Q(**{field_name: value, 'pk__lt': pk})
+    return Q(**{field_name + '__lte': value}) & after
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist paged by the (keyset field, id) of the last row shown, newest first
+    the `after` parameter holds the cursor, pages are never counted or skipped with an offset
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR) or None
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+        # links of filters, search and sorting start from the first page
+        self.params.pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        field_name = self.model_admin.keyset_field
+        field = self.model._meta.get_field(field_name)
+        queryset = self.queryset.order_by(F(field_name).desc(nulls_first=True), '-pk')
+        if self.cursor:
+            pk, _, value = self.cursor.partition(':')
+            try:
+                queryset = queryset.filter(get_keyset_condition(field_name, field.to_python(value or None), int(pk)))
+            except (ValueError, ValidationError):
+                raise IncorrectLookupParameters
+        rows = list(queryset[:self.list_per_page + 1])
+        if len(rows) > self.list_per_page:
+            last = rows[self.list_per_page - 1]
+            self.next_cursor = '{}:{}'.format(last.pk, field.value_to_string(last))
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = rows[:self.list_per_page]
+        self.can_show_all = False
+        self.multi_page = bool(self.cursor or self.next_cursor)
+
+    def get_next_page_url(self) -> str:
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
+
+    def get_first_page_url(self) -> str:
+        return self.get_query_string(remove=[CURSOR_VAR])
+
+
+class KeysetAdminMixin:
+    """Admin of a large table, paged by `keyset_field` (has to be indexed with id) with an estimated count"""
+    keyset_field = None
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # the keyset order is fixed
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    @property
+    def media(self):
+        media = super().media
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, type) and issubclass(list_filter, AutocompleteFilter):
+                field = self.model._meta.get_field(list_filter.field_name)
+                return media + AutocompleteSelect(field, self.admin_site).media
+        return media
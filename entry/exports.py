@@ -0,0 +1,119 @@
+"""Streaming exports of entry points and laps
+
+Rows are read through a server-side cursor in ENTRY_API_CHUNK_SIZE batches and written as NDJSON or CSV as they
+arrive, so an export of any size is sent with constant memory and its first rows go out before the last are read.
+Points stored as a track blob are read from the blob instead, which is unpacked in memory.
+"""
+import csv
+import io
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+
+from entry.models import Entry, Lap, Point, TrackBlob
+
+POINT_FIELDS = ('id', 'timestamp', 'latitude', 'longitude', 'altitude', 'lap_number', 'heart_rate', 'cadence', 'speed')
+LAP_FIELDS = ('id', 'number', 'start_time', 'total_distance', 'total_elapsed_time', 'max_speed', 'max_heart_rate',
+              'avg_heart_rate')
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+
+
+def get_cursor_condition(value: Optional[datetime], pk: int) -> Q:
+    """Points after (value, pk) in the (timestamp, id) order, points without timestamp last"""
+    if value is None:
+        return Q(timestamp__isnull=True, pk__gt=pk)
+    return Q(timestamp__gt=value) | Q(timestamp=value, pk__gt=pk) | Q(timestamp__isnull=True)
+
+
+def get_point_rows(entry: Entry, fields: Sequence[str], after: Optional[Tuple[Optional[datetime], int]] = None,
+                   limit: Optional[int] = None) -> Iterable[tuple]:
+    """Points of the entry in (timestamp, id) order as tuples of the fields, after the (timestamp, id) cursor if given
+    the timestamp and id of the last row read are the cursor of the next page, points without timestamp come last
+    """
+    entry = entry.data_entry
+    try:
+        track = entry.track
+    except TrackBlob.DoesNotExist:
+        track = None
+    if track is not None:
+        return get_track_rows(track, fields, after, limit)
+    queryset = Point.objects.filter(entry=entry).order_by(F('timestamp').asc(nulls_last=True), 'id')
+    if after is not None:
+        queryset = queryset.filter(get_cursor_condition(*after))
+    if limit is not None:
+        queryset = queryset[:limit]
+    return queryset.values_list(*fields).iterator(chunk_size=settings.ENTRY_API_CHUNK_SIZE)
+
+
+def get_track_rows(track: TrackBlob, fields: Sequence[str], after: Optional[Tuple[Optional[datetime], int]] = None,
+                   limit: Optional[int] = None) -> Iterator[tuple]:
+    """Points of the track blob, in the order and with the cursor of point rows
+    blob points have no ids, their position in the track is their id
+    """
+    import pandas as pd  # web processes only load pandas for entries in the blob storage mode
+
+    df = track.to_dataframe()
+    df['id'] = range(len(df))
+    df = df.sort_values(['timestamp', 'id'], na_position='last', kind='stable')
+    if after is not None:
+        value, pk = after
+        if value is None:
+            df = df[df['timestamp'].isna() & (df['id'] > pk)]
+        else:
+            value = pd.Timestamp(value)
+            df = df[(df['timestamp'] > value) | ((df['timestamp'] == value) & (df['id'] > pk)) | df['timestamp'].isna()]
+    if limit is not None:
+        df = df.iloc[:limit]
+    df = df.reindex(columns=list(fields))
+    df = df.astype(object).where(df.notna(), None)
+    for row in df.itertuples(index=False, name=None):
+        yield tuple(value.to_pydatetime() if isinstance(value, pd.Timestamp) else value for value in row)
+
+
+def get_lap_rows(entry: Entry, fields: Sequence[str], after: Optional[int] = None,
+                 limit: Optional[int] = None) -> Iterable[tuple]:
+    """Laps of the entry by number as tuples of the fields, after the lap number if given"""
+    queryset = Lap.objects.filter(entry=entry.data_entry).order_by('number')
+    if after is not None:
+        queryset = queryset.filter(number__gt=after)
+    if limit is not None:
+        queryset = queryset[:limit]
+    return queryset.values_list(*fields).iterator(chunk_size=settings.ENTRY_API_CHUNK_SIZE)
+
+
+def iter_batches(rows: Iterable[tuple], size: int) -> Iterator[List[tuple]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_ndjson(fields: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    """One json object per line, a chunk of lines per batch of rows"""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for batch in iter_batches(rows, settings.ENTRY_API_CHUNK_SIZE):
+        yield ''.join(encoder.encode(dict(zip(fields, row))) + '\n' for row in batch)
+
+
+def iter_csv(fields: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    """Header line and rows, a chunk of lines per batch of rows, times in ISO 8601"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    yield buffer.getvalue()
+    for batch in iter_batches(rows, settings.ENTRY_API_CHUNK_SIZE):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([value.isoformat() if isinstance(value, datetime) else value for value in row]
+                         for row in batch)
+        yield buffer.getvalue()
+
+
+WRITERS = {'ndjson': iter_ndjson, 'csv': iter_csv}
@@ -0,0 +1,136 @@
+"""Entry file formats
+
+A format is detected from the content of the file (magic bytes, the root element of xml documents), the name
+extension only decides between formats the content matches. Format services are imported when a file of the
+format is first processed, so processes that only load the app (web workers) do not import the parsers.
+More formats are registered with `register_format` or listed as dotted paths of `Format` objs in the
+ENTRY_FORMATS setting.
+"""
+import codecs
+import re
+import zipfile
+from typing import Callable, Dict, Optional, Set, Union
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# bytes read from the start of a file to detect its format
+HEAD_SIZE = 4096
+
+XML_PROLOG = re.compile(rb'\s*(?:<\?.*?\?>|<!--.*?-->|<!.*?>)', re.S)
+XML_ELEMENT = re.compile(rb'\s*<(?:[\w.-]+:)?([\w.-]+)')
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+def is_fit(head: bytes) -> bool:
+    """FIT header: header size, protocol and profile versions, data size, then `.FIT`"""
+    return len(head) >= 12 and head[0] in (12, 14) and head[8:12] == b'.FIT'
+
+
+def is_zip(head: bytes) -> bool:
+    return head[:4] == b'PK\x03\x04'
+
+
+def get_xml_root(head: bytes) -> Optional[str]:
+    """Local name of the root element of an xml document, skipping the declaration, comments and doctype"""
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8):]
+    position = 0
+    while True:
+        match = XML_PROLOG.match(head, position)
+        if match is None:
+            break
+        position = match.end()
+    match = XML_ELEMENT.match(head, position)
+    return match.group(1).decode() if match else None
+
+
+def xml_root(*names: str) -> Callable[[bytes], bool]:
+    return lambda head: get_xml_root(head) in names
+
+
+def is_text(head: bytes) -> bool:
+    """Delimited text, not binary and not markup"""
+    text = head.lstrip(codecs.BOM_UTF8).lstrip()
+    return bool(text) and b'\0' not in head and not text.startswith(b'<')
+
+
+class Format:
+    """File format
+    the service is a class or its dotted path, imported on first use
+    """
+
+    def __init__(self, name: str, service: Union[str, type], extensions, sniff: Callable[[bytes], bool]):
+        self.name = name
+        self.service = service
+        self.extensions = tuple(extensions)
+        self.sniff = sniff
+
+    def __repr__(self):
+        return '<Format {}>'.format(self.name)
+
+    def get_service(self) -> type:
+        if isinstance(self.service, str):
+            self.service = import_string(self.service)
+        return self.service
+
+
+FORMATS: Dict[str, Format] = {}
+__plugins_loaded = False
+
+
+def register_format(entry_format: Format) -> Format:
+    FORMATS[entry_format.name] = entry_format
+    return entry_format
+
+
+register_format(Format('csv', 'entry.services.entry_csv.EntryCsv', ('csv',), is_text))
+register_format(Format('fit', 'entry.services.entry_fit.EntryFit', ('fit',), is_fit))
+register_format(Format('gpx', 'entry.services.entry_gpx.EntryGpx', ('gpx',), xml_root('gpx')))
+register_format(Format('kml', 'entry.services.entry_kml.EntryKml', ('kml',), xml_root('kml')))
+register_format(Format('kmz', 'entry.services.entry_kml.EntryKml', ('kmz',), is_zip))
+register_format(Format('tcx', 'entry.services.entry_tcx.EntryTcx', ('tcx',), xml_root('TrainingCenterDatabase')))
+
+
+def get_formats() -> Dict[str, Format]:
+    """Registered formats, including the ones of the ENTRY_FORMATS setting"""
+    global __plugins_loaded
+    if not __plugins_loaded:
+        for path in settings.ENTRY_FORMATS:
+            register_format(import_string(path))
+        __plugins_loaded = True
+    return FORMATS
+
+
+def get_extensions() -> Set[str]:
+    return {extension for entry_format in get_formats().values() for extension in entry_format.extensions}
+
+
+def sniff_format(extension: str, head: bytes) -> Format:
+    """Format of the file content, the one of the extension if the content matches several formats"""
+    matches = [entry_format for entry_format in get_formats().values() if entry_format.sniff(head)]
+    for entry_format in matches:
+        if extension in entry_format.extensions:
+            return entry_format
+    if matches:
+        return matches[0]
+    raise UnsupportedFormat('File format not supported')
+
+
+def detect_format(entry) -> Format:
+    """Format of the entry file (or archive member), read from the start of its data"""
+    from entry.archives import get_name_extension, open_entry_file
+
+    try:
+        with open_entry_file(entry) as source:
+            if isinstance(source, str):
+                with open(source, 'rb') as f:
+                    head = f.read(HEAD_SIZE)
+            else:
+                head = source.read(HEAD_SIZE)
+    except (OSError, EOFError, zipfile.BadZipFile) as e:
+        raise UnsupportedFormat('File can not be read: {}'.format(e)) from e
+    return sniff_format(get_name_extension(entry.member or entry.file.name), head)
@@ -0,0 +1,37 @@
+"""Advisory locks of entries on PostgreSQL
+
+An entry is processed under a session level advisory lock keyed by its id, so two workers never import the same
+entry at once. Session locks are held across the chunk transactions of an import and released when the
+connection closes, so a crashed worker does not keep its entries locked. Other databases have no advisory locks,
+the lock is always acquired there.
+"""
+from contextlib import contextmanager
+from typing import Iterator
+
+from django.db import DatabaseError, connection
+
+# first key of the two key lock functions, keeps entry locks apart from other advisory locks of the database
+LOCK_NAMESPACE = 0x656e7472  # 'entr'
+
+
+@contextmanager
+def entry_lock(entry_id: int) -> Iterator[bool]:
+    """Try to lock the entry without waiting, yields whether the lock was acquired"""
+    if connection.vendor != 'postgresql':
+        yield True
+        return
+    # the second key is an int4, ids past it wrap around and may share a lock, which only serializes their imports
+    key = (entry_id + 2 ** 31) % 2 ** 32 - 2 ** 31
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [LOCK_NAMESPACE, key])
+        locked = cursor.fetchone()[0]
+    try:
+        yield locked
+    finally:
+        if locked:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [LOCK_NAMESPACE, key])
+            except DatabaseError:
+                # the connection is broken, and its locks are released with it
+                pass
@@ -0,0 +1,71 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from entry.benchmarks.generators import WRITERS
+from entry.benchmarks.runner import compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the entry services on synthetic files, optionally failing on regressions against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formats', nargs='+', default=sorted(WRITERS), choices=sorted(WRITERS))
+        parser.add_argument(
+            '--points', nargs='+', type=int, default=[1000, 10000, 100000],
+            help='Points of the generated files (splits of csv files), e.g. 1000 10000 100000 1000000')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed calls of each stage, the best one counts')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--data-dir', default=os.path.join(settings.MEDIA_ROOT, 'benchmarks'),
+            help='Directory in MEDIA_ROOT the generated files are kept in')
+        parser.add_argument('--no-memory', action='store_true', help='Do not trace peak memory of the stages')
+        parser.add_argument('--output', help='Write results as json')
+        parser.add_argument('--baseline', help='Baseline json to compare results with')
+        parser.add_argument('--save-baseline', action='store_true', help='Write results to --baseline instead')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25, help='Allowed slowdown and memory growth, 0.25 is 25%%')
+
+    def handle(self, *args, **options):
+        data_dir = os.path.abspath(options['data_dir'])
+        if os.path.commonpath([data_dir, os.path.abspath(settings.MEDIA_ROOT)]) != os.path.abspath(settings.MEDIA_ROOT):
+            raise CommandError('--data-dir has to be in MEDIA_ROOT, entries read their files from the storage')
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline needs --baseline')
+        baseline = None
+        if options['baseline'] and not options['save_baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except FileNotFoundError:
+                raise CommandError('Baseline {} does not exist, create it with --save-baseline'.format(
+                    options['baseline']))
+
+        self.stdout.write('{:<5} {:>9} {:<8} {:>10} {:>12} {:>8} {:>11} {:>9}'.format(
+            'file', 'points', 'stage', 'seconds', 'rows/s', 'queries', 'peak MiB', 'RSS MiB'))
+        results = run_benchmarks(
+            options['formats'], options['points'], data_dir, repeat=options['repeat'],
+            trace_memory=not options['no_memory'], seed=options['seed'], callback=self.write_result)
+
+        for path in (options['output'], options['baseline'] if options['save_baseline'] else None):
+            if path:
+                with open(path, 'w') as f:
+                    json.dump(results, f, indent=2)
+                self.stdout.write('Results written to {}'.format(path))
+
+        if baseline is not None:
+            regressions = compare(results, baseline, tolerance=options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(regression)
+                raise CommandError('{} regressions against {}'.format(len(regressions), options['baseline']))
+            self.stdout.write(self.style.SUCCESS('No regressions against {}'.format(options['baseline'])))
+
+    def write_result(self, result: dict):
+        peak_memory = result.get('peak_memory')
+        self.stdout.write('{:<5} {:>9} {:<8} {:>10.3f} {:>12.0f} {:>8} {:>11} {:>9.1f}'.format(
+            result['format'], result['points'], result['stage'], result['seconds'], result['rows_per_second'] or 0,
+            result['queries'], '-' if peak_memory is None else '{:.1f}'.format(peak_memory / 2 ** 20),
+            result['max_rss'] / 2 ** 20))
@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from entry.partitions import ensure_partitions
+
+
+class Command(BaseCommand):
+    help = 'Create missing monthly point partitions up to some months ahead (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=settings.ENTRY_POINT_PARTITIONS_AHEAD,
+            help='Number of future monthly partitions to keep created')
+        parser.add_argument(
+            '--since', type=lambda value: datetime.strptime(value, '%Y-%m').replace(tzinfo=timezone.utc),
+            help='First month (YYYY-MM) to create partitions for, rows of these months are moved out of the '
+                 'default partition. Defaults to the current month')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning is only supported on PostgreSQL')
+        for month in ensure_partitions(options['months_ahead'], start=options['since']):
+            self.stdout.write('Created partition for {:%Y-%m}'.format(month))
@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Tuple
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from entry.archives import (
+    ARCHIVE_EXTENSIONS, create_member_entries, get_name_extension, get_source_size, open_entry_file,
+)
+from entry.formats import detect_format, get_extensions, get_formats
+from entry.locks import entry_lock
+from entry.metrics import EntryMetrics
+from entry.models import Entry, ImportJob, Point
+from entry.tasks import get_file_extension, save_failure
+
+
+class ParseError(Exception):
+    pass
+
+
+def parse_entry(entry: Entry, chunk_size: int = None) -> Tuple[str, list, EntryMetrics]:
+    """Parse the entry file into its format name, (model, dataframe) pairs and parse metrics
+    runs in a worker process
+    """
+    try:
+        entry_format = detect_format(entry)
+        with open_entry_file(entry) as source:
+            service = entry_format.get_service()(entry, chunk_size=chunk_size, format_name=entry_format.name)
+            frames = list(service.iter_model_dataframes(source))
+            service.metrics.record('parse', calls=0, bytes=get_source_size(source))
+            return entry_format.name, frames, service.metrics
+    except Exception as e:
+        # parser exceptions are not always picklable, and one that can not be sent back breaks the whole pool
+        raise ParseError('{}: {}'.format(type(e).__name__, e)) from None
+
+
+class Command(BaseCommand):
+    help = 'Import files of a user in bulk, parsing them in a process pool and storing them with a few db writers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files or directories (searched recursively) to import')
+        parser.add_argument('--user', required=True, help='Username (or id) of the customer the entries belong to')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Parser processes, defaults to the number of cores')
+        parser.add_argument('--writers', type=int, default=2, help='Threads storing parsed files in db')
+        parser.add_argument('--chunk-size', type=int, help='Points per dataframe, defaults to ENTRY_CHUNK_SIZE')
+
+    def get_user(self, value: str):
+        user_model = get_user_model()
+        lookups = [{user_model.USERNAME_FIELD: value}]
+        if value.isdigit():
+            lookups.append({'pk': int(value)})
+        for lookup in lookups:
+            try:
+                return user_model.objects.get(**lookup)
+            except user_model.DoesNotExist:
+                pass
+        raise CommandError('User {} does not exist'.format(value))
+
+    @staticmethod
+    def get_files(paths: List[str]) -> List[str]:
+        """Files of the paths with a supported extension (or archives), directories are walked in name order"""
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    dirs.sort()
+                    files.extend(os.path.join(root, name) for name in sorted(names))
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                raise CommandError('{} does not exist'.format(path))
+        extensions = get_extensions()
+        return [path for path in files
+                if get_name_extension(path) in extensions or get_name_extension(path) in ARCHIVE_EXTENSIONS]
+
+    @staticmethod
+    def create_entry(user, path: str) -> Entry:
+        """Create the entry of the file without sending it to the processing queue
+        it gets its pending import job at once, so an entry the command does not get to store (e.g. it was killed)
+        is imported by `resume_import_jobs`
+        """
+        with open(path, 'rb') as f:
+            entry = Entry(customer=user, file=File(f, name=os.path.basename(path)))
+            entry.skip_enqueue = True
+            entry.save()
+        if not entry.source_id:
+            ImportJob.objects.create(entry=entry)
+        return entry
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        files = self.get_files(options['paths'])
+        workers = max(options['workers'] or 1, 1)
+        writers = max(options['writers'], 1)
+        self.stdout.write('Importing {} files with {} parsers and {} writers'.format(len(files), workers, writers))
+
+        self.chunk_size = options['chunk_size'] or settings.ENTRY_CHUNK_SIZE
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stats = {'files': 0, 'points': 0, 'duplicates': 0, 'errors': 0}
+        # parsed files waiting for a writer are held in memory, so the number of files in flight is bounded
+        self.in_flight = threading.BoundedSemaphore(workers + 2 * writers)
+
+        with ThreadPoolExecutor(writers) as db_writers:
+            # workers are spawned, forking a process that runs db writer threads is not safe
+            with ProcessPoolExecutor(
+                    workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup) as parsers:
+                for path in files:
+                    entry = self.create_entry(user, path)
+                    if entry.source_id:
+                        self.count(path, duplicates=1)
+                        continue
+                    if get_file_extension(entry) in ARCHIVE_EXTENSIONS:
+                        members = [(child, '{}/{}'.format(path, child.member))
+                                   for child, created in create_member_entries(entry, get_extensions())]
+                        for member, name in members:
+                            if not member.source_id:
+                                ImportJob.objects.get_or_create(entry=member)
+                        # the archive is done once its members have jobs of their own
+                        entry.job.finish()
+                    else:
+                        members = [(entry, path)]
+                    for member, name in members:
+                        if member.source_id:
+                            self.count(name, duplicates=1)
+                            continue
+                        self.in_flight.acquire()
+                        parsed = parsers.submit(parse_entry, member, options['chunk_size'])
+                        parsed.add_done_callback(
+                            lambda future, entry=member, path=name: db_writers.submit(self.store, entry, path, future))
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {files} files ({points} points), {duplicates} duplicates, {errors} errors in {elapsed:.1f} s'
+            .format(elapsed=elapsed, **self.stats)))
+
+    def store(self, entry: Entry, path: str, parsed: Future):
+        """Store a parsed file under the entry lock, runs in a writer thread
+        the job of the entry fails if the file could not be parsed or stored
+        """
+        try:
+            with entry_lock(entry.pk) as locked:
+                if not locked:
+                    raise CommandError('Entry {} is imported by a worker'.format(entry.pk))
+                job = ImportJob.objects.get(entry=entry)
+                job.start(self.chunk_size)
+                try:
+                    format_name, frames, metrics = parsed.result()
+                    service = get_formats()[format_name].get_service()(entry, format_name=format_name)
+                    service.metrics.merge(metrics)
+                    service.store(frames, job=job)
+                except Exception as e:
+                    save_failure(job, e)
+                    raise
+        except Exception as e:
+            self.stderr.write('{}: {}'.format(path, e))
+            self.count(path, errors=1)
+        else:
+            self.count(path, files=1, points=sum(len(df) for model, df in frames if model is Point))
+        finally:
+            # connections of writer threads are not closed by anything else
+            connection.close()
+            self.in_flight.release()
+
+    def count(self, path: str, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+            done = self.stats['files'] + self.stats['duplicates'] + self.stats['errors']
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            self.stdout.write('[{}] {} - {:.1f} files/s, {:.0f} points/s'.format(
+                done, os.path.basename(path), done / elapsed, self.stats['points'] / elapsed))
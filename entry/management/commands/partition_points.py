@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from entry.partitions import partition_table
+
+
+class Command(BaseCommand):
+    help = 'Convert the point table into a table partitioned by month of timestamp (PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int, default=settings.ENTRY_POINT_PARTITIONS_AHEAD,
+            help='Number of future monthly partitions to create')
+        parser.add_argument(
+            '--batch-size', type=int, default=100000, help='Rows copied per statement')
+        parser.add_argument(
+            '--drop-old', action='store_true', help='Drop the previous table instead of keeping it as entry_point_old')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning is only supported on PostgreSQL')
+        partition_table(
+            months_ahead=options['months_ahead'],
+            batch_size=options['batch_size'],
+            drop_old=options['drop_old'],
+            stdout=self.stdout,
+        )
@@ -0,0 +1,145 @@
+"""Ingestion metrics
+
+Services record the stages of an entry import (`parse`, `summary`, `convert`, `submit`) by model: calls, seconds,
+rows, bytes read and statements run through django (COPY streams are not statements). The totals of an entry
+are stored as its `EntryMetric` rows, replaced when it is processed again, and rendered as histograms over entries
+in the Prometheus text format, labeled by format, stage and model.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+
+from entry.models import EntryMetric
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+VALUES = ('calls', 'seconds', 'rows', 'bytes', 'queries')
+# bytes read are recorded on the parse stage without model, which has no calls
+CALLS = Q(calls__gt=0)
+BYTES = Q(stage='parse', model='')
+# name, help, EntryMetric field, bucket upper bounds, EntryMetric rows
+HISTOGRAMS = (
+    ('entry_stage_duration_seconds', 'Time an entry import spent in a stage', 'seconds',
+     (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), CALLS),
+    ('entry_stage_rows', 'Rows of an entry import handled by a stage', 'rows',
+     (10, 100, 1000, 5000, 10000, 50000, 100000, 500000, 1000000), CALLS),
+    ('entry_stage_bytes', 'Bytes of the entry file read by the parser', 'bytes',
+     (10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8, 10 ** 9), BYTES),
+    ('entry_stage_queries', 'Statements an entry import ran in a stage', 'queries',
+     (0, 1, 5, 10, 50, 100, 1000, 10000), CALLS),
+)
+
+
+def get_model_label(model) -> str:
+    return model._meta.model_name if model is not None else ''
+
+
+@contextmanager
+def count_queries() -> Iterator[List[int]]:
+    """Count the statements run through django in the block"""
+    queries = [0]
+
+    def count(execute, sql, params, many, context):
+        queries[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        yield queries
+
+
+class EntryMetrics:
+    """Entry import metrics
+    stage totals keyed by (stage, model name), picklable so parser processes can send them with their frames
+    """
+
+    def __init__(self, format_name: str):
+        self.format_name = format_name
+        self.stages: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def record(self, stage: str, model=None, calls: int = 1, **values):
+        totals = self.stages.setdefault((stage, get_model_label(model)), dict.fromkeys(VALUES, 0))
+        totals['calls'] += calls
+        for name, value in values.items():
+            totals[name] += value
+
+    @contextmanager
+    def measure(self, stage: str, model=None, rows: int = 0):
+        """Record the time and statements of the block as a call of the stage"""
+        started = time.perf_counter()
+        with count_queries() as queries:
+            try:
+                yield
+            finally:
+                self.record(stage, model, seconds=time.perf_counter() - started, rows=rows, queries=queries[0])
+
+    def iter_frames(self, frames: Iterable[Tuple[type, object]]) -> Iterator[Tuple[type, object]]:
+        """Pass (model, dataframe) pairs through, producing each one is recorded as parsing of its model"""
+        frames = iter(frames)
+        while True:
+            started = time.perf_counter()
+            with count_queries() as queries:
+                pair = next(frames, None)
+            if pair is None:
+                return
+            model, df = pair
+            self.record('parse', model, seconds=time.perf_counter() - started, rows=len(df), queries=queries[0])
+            yield pair
+
+    def merge(self, other: 'EntryMetrics'):
+        for (stage, model_label), values in other.stages.items():
+            totals = self.stages.setdefault((stage, model_label), dict.fromkeys(VALUES, 0))
+            for name, value in values.items():
+                totals[name] += value
+
+    def __str__(self):
+        return ', '.join('{} {}{:.3f} s {} rows'.format(
+            stage, model_label + ' ' if model_label else '', values['seconds'], int(values['rows']))
+            for (stage, model_label), values in self.stages.items() if values['calls'])
+
+    def save(self, entry) -> List[EntryMetric]:
+        """Replace the metrics of the entry"""
+        logger.info('Entry %s (%s): %s', entry.pk, self.format_name, self)
+        with transaction.atomic():
+            EntryMetric.objects.filter(entry=entry).delete()
+            return EntryMetric.objects.bulk_create([
+                EntryMetric(entry=entry, format=self.format_name, stage=stage, model=model_label, **values)
+                for (stage, model_label), values in self.stages.items()
+            ])
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_histogram(name: str, help_text: str, field: str, buckets: Sequence[float], condition: Q) -> str:
+    """A histogram of the field over entries, one aggregate query grouped by labels"""
+    aggregates = {'count': Count('id'), 'sum': Sum(field)}
+    for index, bound in enumerate(buckets):
+        aggregates['le{}'.format(index)] = Count('id', filter=Q(**{field + '__lte': bound}))
+    labels = ('format', 'stage', 'model')
+    rows = EntryMetric.objects.filter(condition).values(*labels).annotate(**aggregates).order_by(*labels)
+
+    lines = ['# HELP {} {}'.format(name, help_text), '# TYPE {} histogram'.format(name)]
+    for row in rows:
+        label_values = ','.join('{}="{}"'.format(label, escape(row[label])) for label in labels)
+        for index, bound in enumerate(buckets):
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                name, label_values, format_value(float(bound)), row['le{}'.format(index)]))
+        lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, label_values, row['count']))
+        lines.append('{}_sum{{{}}} {}'.format(name, label_values, format_value(row['sum'] or 0)))
+        lines.append('{}_count{{{}}} {}'.format(name, label_values, row['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def render_metrics() -> str:
+    """Metrics of all entries in the Prometheus text exposition format"""
+    return ''.join(render_histogram(*histogram) for histogram in HISTOGRAMS)
@@ -0,0 +1,32 @@
+# Generated by Django 3.2 on 2026-10-17 03:31
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import entry.models
+import entry.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0004_auto_20220724_1935'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='source',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Earlier entry of the customer with the same file, its points and laps are used', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='duplicates', to='entry.entry', verbose_name='Source'),
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='file',
+            field=models.FileField(storage=entry.storage.HashedFileSystemStorage(), upload_to=entry.models.entry_file_upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['csv', 'fit', 'gpx', 'kml', 'tcx'])], verbose_name='File'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2 on 2026-10-17 03:32
+
+from django.db import migrations, models
+
+
+def delete_duplicates(apps, schema_editor):
+    """Keep the first of rows sharing the new unique keys"""
+    quote_name = schema_editor.connection.ops.quote_name
+    for table, column in (('entry_point', 'timestamp'), ('entry_lap', 'number')):
+        if schema_editor.connection.vendor == 'postgresql':
+            sql = (
+                'DELETE FROM {table} a USING {table} b '
+                'WHERE a.entry_id = b.entry_id AND a.{column} = b.{column} AND a.id > b.id'
+            )
+        else:
+            sql = (
+                'DELETE FROM {table} WHERE {column} IS NOT NULL AND id NOT IN ('
+                'SELECT MIN(id) FROM {table} WHERE {column} IS NOT NULL GROUP BY entry_id, {column})'
+            )
+        schema_editor.execute(sql.format(table=table, column=quote_name(column)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0005_auto_20261017_0331'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='lap',
+            constraint=models.UniqueConstraint(fields=('entry', 'number'), name='entry_lap_entry_number_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='point',
+            constraint=models.UniqueConstraint(fields=('entry', 'timestamp'), name='entry_point_entry_timestamp_uniq'),
+        ),
+    ]
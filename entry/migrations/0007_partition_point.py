@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def partition_point(apps, schema_editor):
+    """Partition the point table by month on new PostgreSQL databases
+    existing tables with rows are converted with the `partition_points` command instead
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from entry.partitions import partition_table
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM entry_point)')
+        if cursor.fetchone()[0]:
+            return
+    partition_table(months_ahead=settings.ENTRY_POINT_PARTITIONS_AHEAD, drop_old=True, table='entry_point')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0006_auto_20261017_0332'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_point, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2 on 2026-10-17 03:36
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0007_partition_point'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='point',
+            name='entry',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='entry.entry', verbose_name='Entry'),
+        ),
+        migrations.AddIndex(
+            model_name='lap',
+            index=models.Index(fields=['user', 'start_time'], name='entry_lap_user_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['timestamp'], name='entry_point_timestamp_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['entry', 'lap_number', 'timestamp'], name='entry_point_entry_lap_ts_idx'),
+        ),
+    ]
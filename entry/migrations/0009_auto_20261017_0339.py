@@ -0,0 +1,48 @@
+# Generated by Django 3.2 on 2026-10-17 03:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('entry', '0008_auto_20261017_0336'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntrySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_time', models.DateTimeField(blank=True, null=True, verbose_name='Start time')),
+                ('end_time', models.DateTimeField(blank=True, null=True, verbose_name='End time')),
+                ('duration', models.FloatField(blank=True, null=True, verbose_name='Duration')),
+                ('total_distance', models.FloatField(blank=True, null=True, verbose_name='Total distance')),
+                ('elevation_gain', models.FloatField(blank=True, null=True, verbose_name='Elevation gain')),
+                ('avg_heart_rate', models.FloatField(blank=True, null=True, verbose_name='Avg heart rate')),
+                ('max_heart_rate', models.FloatField(blank=True, null=True, verbose_name='Max heart rate')),
+                ('min_latitude', models.FloatField(blank=True, null=True, verbose_name='Min latitude')),
+                ('max_latitude', models.FloatField(blank=True, null=True, verbose_name='Max latitude')),
+                ('min_longitude', models.FloatField(blank=True, null=True, verbose_name='Min longitude')),
+                ('max_longitude', models.FloatField(blank=True, null=True, verbose_name='Max longitude')),
+                ('points_count', models.IntegerField(default=0, verbose_name='Points count')),
+                ('laps_count', models.IntegerField(default=0, verbose_name='Laps count')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name='Modified')),
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='entry.entry', verbose_name='Entry')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Entry summary',
+                'verbose_name_plural': 'Entry summaries',
+                'ordering': ('-start_time',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='entrysummary',
+            index=models.Index(fields=['user', 'start_time'], name='entry_summary_user_start_idx'),
+        ),
+    ]
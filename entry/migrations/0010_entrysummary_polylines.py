@@ -0,0 +1,18 @@
+# Generated by Django 3.2 on 2026-10-17 03:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0009_auto_20261017_0339'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entrysummary',
+            name='polylines',
+            field=models.JSONField(blank=True, default=dict, help_text='Simplified track as encoded polylines, keyed by the min map zoom they are drawn at', verbose_name='Polylines'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2 on 2026-10-17 03:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('entry', '0010_entrysummary_polylines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField(verbose_name='Data')),
+                ('points_count', models.IntegerField(default=0, verbose_name='Points count')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name='Modified')),
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='track', to='entry.entry', verbose_name='Entry')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Track blob',
+                'verbose_name_plural': 'Track blobs',
+                'ordering': ('-created',),
+            },
+        ),
+    ]
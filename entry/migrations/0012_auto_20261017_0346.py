@@ -0,0 +1,32 @@
+# Generated by Django 3.2 on 2026-10-17 03:46
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import entry.models
+import entry.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0011_trackblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='member',
+            field=models.CharField(blank=True, editable=False, help_text='Name of the file in the archive', max_length=1024, verbose_name='Archive member'),
+        ),
+        migrations.AddField(
+            model_name='entry',
+            name='parent',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Archive entry the file of this entry is a member of', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='members', to='entry.entry', verbose_name='Archive'),
+        ),
+        migrations.AlterField(
+            model_name='entry',
+            name='file',
+            field=models.FileField(storage=entry.storage.HashedFileSystemStorage(), upload_to=entry.models.entry_file_upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['csv', 'fit', 'gpx', 'kml', 'tcx', 'zip', 'gz'])], verbose_name='File'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-17 03:49
+
+import django.core.validators
+from django.db import migrations, models
+import entry.models
+import entry.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0012_auto_20261017_0346'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entry',
+            name='file',
+            field=models.FileField(storage=entry.storage.HashedFileSystemStorage(), upload_to=entry.models.entry_file_upload_to, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['csv', 'fit', 'gpx', 'kml', 'kmz', 'tcx', 'zip', 'gz'])], verbose_name='File'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2 on 2026-10-17 03:51
+
+from django.db import migrations, models
+import entry.models
+import entry.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0013_kml_kmz'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entry',
+            name='file',
+            field=models.FileField(storage=entry.storage.HashedFileSystemStorage(), upload_to=entry.models.entry_file_upload_to, validators=[entry.models.validate_entry_file_extension], verbose_name='File'),
+        ),
+    ]
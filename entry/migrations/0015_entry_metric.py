@@ -0,0 +1,39 @@
+# Generated by Django 3.2 on 2026-10-17 04:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0014_entry_file_formats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(max_length=16, verbose_name='Format')),
+                ('stage', models.CharField(max_length=16, verbose_name='Stage')),
+                ('model', models.CharField(blank=True, max_length=32, verbose_name='Model')),
+                ('calls', models.IntegerField(default=0, verbose_name='Calls')),
+                ('seconds', models.FloatField(default=0, verbose_name='Seconds')),
+                ('rows', models.BigIntegerField(default=0, verbose_name='Rows')),
+                ('bytes', models.BigIntegerField(default=0, verbose_name='Bytes')),
+                ('queries', models.IntegerField(default=0, verbose_name='Queries')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metrics', to='entry.entry', verbose_name='Entry')),
+            ],
+            options={
+                'verbose_name': 'Entry metric',
+                'verbose_name_plural': 'Entry metrics',
+                'ordering': ('entry', 'stage', 'model'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='entrymetric',
+            constraint=models.UniqueConstraint(fields=('entry', 'stage', 'model'), name='entry_metric_entry_stage_model_uniq'),
+        ),
+    ]
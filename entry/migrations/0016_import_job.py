@@ -0,0 +1,55 @@
+# Generated by Django 3.2 on 2026-10-17 04:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_jobs(apps, schema_editor):
+    """Jobs of entries imported before jobs existed
+    done if the entry has a summary, is a duplicate or an expanded archive, otherwise pending so it is resumed
+    """
+    Entry = apps.get_model('entry', 'Entry')
+    ImportJob = apps.get_model('entry', 'ImportJob')
+    entries = Entry.objects.values_list('id', 'source_id', 'summary__id').annotate(members_count=models.Count('members'))
+    ImportJob.objects.bulk_create([
+        ImportJob(entry_id=entry_id, status='done' if source_id or summary_id or members_count else 'pending')
+        for entry_id, source_id, summary_id, members_count in entries.iterator()
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0015_entry_metric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16, verbose_name='Status')),
+                ('stage', models.CharField(blank=True, max_length=16, verbose_name='Stage')),
+                ('chunk_size', models.IntegerField(blank=True, help_text='Kept for resuming, chunks have to be parsed the same way', null=True, verbose_name='Chunk size')),
+                ('chunks_committed', models.IntegerField(default=0, help_text='Parsed dataframes committed to db, in parse order', verbose_name='Chunks committed')),
+                ('rows_committed', models.BigIntegerField(default=0, verbose_name='Rows committed')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Attempts')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Errors')),
+                ('started', models.DateTimeField(blank=True, null=True, verbose_name='Started')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('modified', models.DateTimeField(auto_now=True, verbose_name='Modified')),
+                ('entry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='entry.entry', verbose_name='Entry')),
+            ],
+            options={
+                'verbose_name': 'Import job',
+                'verbose_name_plural': 'Import jobs',
+                'ordering': ('-created',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='importjob',
+            index=models.Index(fields=['status', 'modified'], name='entry_import_job_status_idx'),
+        ),
+        migrations.RunPython(create_jobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-17 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0017_entry_file_format_validator'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lap',
+            index=models.Index(fields=['start_time', 'id'], name='entry_lap_start_time_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='point',
+            index=models.Index(fields=['timestamp', 'id'], name='entry_point_timestamp_id_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2 on 2026-10-17 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0018_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='laps_committed',
+            field=models.BigIntegerField(default=0, help_text='First laps of the file committed to db, skipped on resume', verbose_name='Laps committed'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='points_committed',
+            field=models.BigIntegerField(default=0, help_text='First points of the file committed to db, skipped on resume', verbose_name='Points committed'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='chunk_size',
+            field=models.IntegerField(blank=True, help_text='Kept for resuming, so dataframes cached by an earlier attempt are read again', null=True, verbose_name='Chunk size'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='chunks_committed',
+            field=models.IntegerField(default=0, help_text='Dataframes committed to db', verbose_name='Chunks committed'),
+        ),
+    ]
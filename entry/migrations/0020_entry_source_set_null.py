@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-17 04:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('entry', '0019_import_job_rows_committed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='entry',
+            name='source',
+            field=models.ForeignKey(blank=True, editable=False, help_text='Earlier entry of the customer with the same file, its points and laps are used', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='entry.entry', verbose_name='Source'),
+        ),
+    ]
@@ -1,8 +1,52 @@
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from entry.storage import HashedFileSystemStorage, file_sha256
+
+
+def entry_file_upload_to(instance, filename):
+    """Store entry files under their content hash, sharded by its first characters
+    e.g. entry/files/9f/86/9f86d08...15b0.fit
+    """
+    if not instance.sha256:
+        # upload handlers may already have hashed the file while writing it
+        instance.sha256 = getattr(instance.file.file, 'sha256', None) or file_sha256(instance.file)
+    parts = filename.lower().split('.')
+    # compressed files keep their format, e.g. .fit.gz
+    extension = '.'.join(parts[-2:]) if len(parts) > 2 and parts[-1] == 'gz' else parts[-1]
+    return 'entry/files/{}/{}/{}.{}'.format(instance.sha256[:2], instance.sha256[2:4], instance.sha256, extension)
+
+
+def validate_entry_file_extension(value):
+    """Extensions of the registered formats and zip archives, and of the formats gz compressed (e.g. .fit.gz)"""
+    from entry.archives import ARCHIVE_EXTENSIONS, COMPRESSED_EXTENSION, get_name_extension, is_compressed
+    from entry.formats import get_extensions  # the registry reads plugin formats from the settings
+
+    formats = sorted(get_extensions())
+    extension = get_name_extension(value.name)
+    allowed = formats if is_compressed(value.name) else formats + list(ARCHIVE_EXTENSIONS)
+    if extension not in allowed:
+        if is_compressed(value.name) and extension != COMPRESSED_EXTENSION:
+            extension += '.' + COMPRESSED_EXTENSION
+        raise ValidationError(
+            FileExtensionValidator.message, code=FileExtensionValidator.code, params={
+                'extension': extension,
+                'allowed_extensions': ', '.join(formats + list(ARCHIVE_EXTENSIONS) + [
+                    '{}.{}'.format(name, COMPRESSED_EXTENSION) for name in formats]),
+            })
+
+
+def validate_entry_file_format(value):
+    """Content of new uploads, detected by the upload handler while the file was written"""
+    upload = value.file if not value._committed else None
+    if getattr(upload, 'format', '') is None:
+        raise ValidationError(_('File format not supported'), code='invalid_format')
+
 
 class Entry(models.Model):
     """Entry model
@@ -10,17 +54,34 @@ class Entry(models.Model):
     """
     file = models.FileField(
         _('File'),
-        upload_to='entry/files/',
-        validators=[
-            FileExtensionValidator(allowed_extensions=['csv', 'fit', 'gpx', 'kml', 'tcx'])
-        ]
+        upload_to=entry_file_upload_to,
+        storage=HashedFileSystemStorage(),
+        validators=[validate_entry_file_extension, validate_entry_file_format]
     )
+    sha256 = models.CharField(_('SHA-256'), max_length=64, blank=True, db_index=True, editable=False)
+    # duplicates of a deleted entry are linked to the earliest of them, which is imported (see signals)
+    source = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name='duplicates', verbose_name=_('Source'),
+        help_text=_('Earlier entry of the customer with the same file, its points and laps are used'))
+    parent = models.ForeignKey(
+        'self', on_delete=models.CASCADE, null=True, blank=True, editable=False,
+        related_name='members', verbose_name=_('Archive'),
+        help_text=_('Archive entry the file of this entry is a member of'))
+    member = models.CharField(
+        _('Archive member'), max_length=1024, blank=True, editable=False,
+        help_text=_('Name of the file in the archive'))
     customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('Customer'))
     created = models.DateTimeField(_('Created'), auto_now_add=True)
     modified = models.DateTimeField(_('Modified'), auto_now=True)
 
     def __str__(self):
-        return 'Entry {}'.format(self.file.name)
+        return 'Entry {}'.format(self.member or self.file.name)
+
+    @property
+    def data_entry(self):
+        """Entry which points and laps of this upload belong to"""
+        return self.source or self
 
     class Meta:
         verbose_name = _('Entry')
@@ -33,7 +94,8 @@ class Point(models.Model):
     fitness tracker each point record data
     """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('User'))
-    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, verbose_name=_('Entry'))
+    # covered by the (entry, lap_number, timestamp) index
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, db_index=False, verbose_name=_('Entry'))
     latitude = models.FloatField(_('Latitude'), null=True, blank=True)
     longitude = models.FloatField(_('Longitude'), null=True, blank=True)
     lap_number = models.IntegerField(
@@ -54,6 +116,16 @@ class Point(models.Model):
         verbose_name = _('Point')
         verbose_name_plural = _('Points')
         ordering = ('-created',)
+        constraints = [
+            models.UniqueConstraint(fields=('entry', 'timestamp'), name='entry_point_entry_timestamp_uniq'),
+        ]
+        indexes = [
+            # points are appended in time order, a BRIN index is a tiny fraction of a B-tree for time range filters
+            BrinIndex(fields=('timestamp',), name='entry_point_timestamp_brin'),
+            models.Index(fields=('entry', 'lap_number', 'timestamp'), name='entry_point_entry_lap_ts_idx'),
+            # keyset pages of the admin changelist, newest first
+            models.Index(fields=('timestamp', 'id'), name='entry_point_timestamp_id_idx'),
+        ]
 
 
 class Lap(models.Model):
@@ -81,3 +153,202 @@ class Lap(models.Model):
         verbose_name = _('Lap')
         verbose_name_plural = _('Laps')
         ordering = ('-created',)
+        constraints = [
+            models.UniqueConstraint(fields=('entry', 'number'), name='entry_lap_entry_number_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=('user', 'start_time'), name='entry_lap_user_start_idx'),
+            # keyset pages of the admin changelist, newest first
+            models.Index(fields=('start_time', 'id'), name='entry_lap_start_time_id_idx'),
+        ]
+
+
+class EntrySummary(models.Model):
+    """Entry summary model
+    activity totals computed while the entry file is processed, so they are read without scanning its points
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('User'))
+    entry = models.OneToOneField(Entry, on_delete=models.CASCADE, related_name='summary', verbose_name=_('Entry'))
+    start_time = models.DateTimeField(_('Start time'), null=True, blank=True)
+    end_time = models.DateTimeField(_('End time'), null=True, blank=True)
+    duration = models.FloatField(_('Duration'), null=True, blank=True)
+    total_distance = models.FloatField(_('Total distance'), null=True, blank=True)
+    elevation_gain = models.FloatField(_('Elevation gain'), null=True, blank=True)
+    avg_heart_rate = models.FloatField(_('Avg heart rate'), null=True, blank=True)
+    max_heart_rate = models.FloatField(_('Max heart rate'), null=True, blank=True)
+    min_latitude = models.FloatField(_('Min latitude'), null=True, blank=True)
+    max_latitude = models.FloatField(_('Max latitude'), null=True, blank=True)
+    min_longitude = models.FloatField(_('Min longitude'), null=True, blank=True)
+    max_longitude = models.FloatField(_('Max longitude'), null=True, blank=True)
+    polylines = models.JSONField(
+        _('Polylines'), default=dict, blank=True,
+        help_text=_('Simplified track as encoded polylines, keyed by the min map zoom they are drawn at'))
+    points_count = models.IntegerField(_('Points count'), default=0)
+    laps_count = models.IntegerField(_('Laps count'), default=0)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+    modified = models.DateTimeField(_('Modified'), auto_now=True)
+
+    def __str__(self):
+        return 'Summary {}'.format(self.entry.file.name)
+
+    def polyline_for_zoom(self, zoom: int) -> str:
+        """Encoded polyline with the detail of the map zoom level"""
+        from entry.services.entry_polyline import get_level  # numpy is only imported where tracks are used
+
+        return get_level(self.polylines, zoom)[1]
+
+    class Meta:
+        verbose_name = _('Entry summary')
+        verbose_name_plural = _('Entry summaries')
+        ordering = ('-start_time',)
+        indexes = [
+            models.Index(fields=('user', 'start_time'), name='entry_summary_user_start_idx'),
+        ]
+
+
+class TrackBlob(models.Model):
+    """Track blob model
+    all points of an entry as compressed columnar arrays, stored instead of point rows in the blob storage mode
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('User'))
+    entry = models.OneToOneField(Entry, on_delete=models.CASCADE, related_name='track', verbose_name=_('Entry'))
+    data = models.BinaryField(_('Data'))
+    points_count = models.IntegerField(_('Points count'), default=0)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+    modified = models.DateTimeField(_('Modified'), auto_now=True)
+
+    def __str__(self):
+        return 'Track {}'.format(self.entry.file.name)
+
+    def to_dataframe(self):
+        """Points dataframe, columns are Point field names"""
+        from entry.services.entry_track import unpack
+
+        return unpack(self.data)
+
+    class Meta:
+        verbose_name = _('Track blob')
+        verbose_name_plural = _('Track blobs')
+        ordering = ('-created',)
+
+
+class EntryMetric(models.Model):
+    """Entry metric model
+    totals of an import stage of an entry by model, replaced when the entry is processed again
+    """
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name='metrics', verbose_name=_('Entry'))
+    format = models.CharField(_('Format'), max_length=16)
+    stage = models.CharField(_('Stage'), max_length=16)
+    model = models.CharField(_('Model'), max_length=32, blank=True)
+    calls = models.IntegerField(_('Calls'), default=0)
+    seconds = models.FloatField(_('Seconds'), default=0)
+    rows = models.BigIntegerField(_('Rows'), default=0)
+    bytes = models.BigIntegerField(_('Bytes'), default=0)
+    queries = models.IntegerField(_('Queries'), default=0)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+
+    def __str__(self):
+        return '{} {} {}'.format(self.entry_id, self.stage, self.model)
+
+    class Meta:
+        verbose_name = _('Entry metric')
+        verbose_name_plural = _('Entry metrics')
+        ordering = ('entry', 'stage', 'model')
+        constraints = [
+            models.UniqueConstraint(fields=('entry', 'stage', 'model'), name='entry_metric_entry_stage_model_uniq'),
+        ]
+
+
+class ImportJob(models.Model):
+    """Import job model
+    processing state of an entry. Rows are committed a chunk at a time, each chunk together with its checkpoint,
+    so an interrupted import resumes after the last committed rows of each model, however the file is chunked.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_DONE, _('Done')),
+        (STATUS_FAILED, _('Failed')),
+    )
+    # errors kept on the job, older ones are dropped
+    MAX_ERRORS = 10
+
+    entry = models.OneToOneField(Entry, on_delete=models.CASCADE, related_name='job', verbose_name=_('Entry'))
+    status = models.CharField(_('Status'), max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    stage = models.CharField(_('Stage'), max_length=16, blank=True)
+    chunk_size = models.IntegerField(
+        _('Chunk size'), null=True, blank=True,
+        help_text=_('Kept for resuming, so dataframes cached by an earlier attempt are read again'))
+    chunks_committed = models.IntegerField(_('Chunks committed'), default=0, help_text=_('Dataframes committed to db'))
+    points_committed = models.BigIntegerField(
+        _('Points committed'), default=0, help_text=_('First points of the file committed to db, skipped on resume'))
+    laps_committed = models.BigIntegerField(
+        _('Laps committed'), default=0, help_text=_('First laps of the file committed to db, skipped on resume'))
+    rows_committed = models.BigIntegerField(_('Rows committed'), default=0)
+    attempts = models.IntegerField(_('Attempts'), default=0)
+    errors = models.JSONField(_('Errors'), default=list, blank=True)
+    started = models.DateTimeField(_('Started'), null=True, blank=True)
+    finished = models.DateTimeField(_('Finished'), null=True, blank=True)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+    modified = models.DateTimeField(_('Modified'), auto_now=True)
+
+    def __str__(self):
+        return 'Job {} {}'.format(self.entry_id, self.status)
+
+    def start(self, chunk_size: int):
+        self.status = self.STATUS_RUNNING
+        self.attempts += 1
+        self.started = timezone.now()
+        self.finished = None
+        if self.chunk_size is None:
+            self.chunk_size = chunk_size
+        self.save()
+
+    def get_committed(self, model) -> int:
+        """Rows of the model committed to db, the first ones of the file in parse order"""
+        return {Point: self.points_committed, Lap: self.laps_committed}[model]
+
+    def checkpoint(self, model, rows: int, stage: str):
+        """Record a committed chunk of rows of the model, in the transaction of its rows"""
+        field = {Point: 'points_committed', Lap: 'laps_committed'}[model]
+        setattr(self, field, getattr(self, field) + rows)
+        self.chunks_committed += 1
+        self.rows_committed += rows
+        self.stage = stage
+        ImportJob.objects.filter(pk=self.pk).update(**{
+            field: models.F(field) + rows, 'chunks_committed': models.F('chunks_committed') + 1,
+            'rows_committed': models.F('rows_committed') + rows, 'stage': stage, 'modified': timezone.now(),
+        })
+
+    def reset(self):
+        """Forget the committed rows, once they are deleted"""
+        self.chunks_committed = self.points_committed = self.laps_committed = self.rows_committed = 0
+        self.stage = ''
+        self.save()
+
+    def finish(self):
+        self.status = self.STATUS_DONE
+        self.stage = ''
+        self.finished = timezone.now()
+        self.save()
+
+    def fail(self, error: BaseException):
+        self.status = self.STATUS_FAILED
+        self.finished = timezone.now()
+        self.errors = (self.errors + [{
+            'time': self.finished.isoformat(), 'attempt': self.attempts, 'stage': self.stage,
+            'error': '{}: {}'.format(type(error).__name__, error),
+        }])[-self.MAX_ERRORS:]
+        self.save()
+
+    class Meta:
+        verbose_name = _('Import job')
+        verbose_name_plural = _('Import jobs')
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=('status', 'modified'), name='entry_import_job_status_idx'),
+        ]
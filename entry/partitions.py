@@ -0,0 +1,333 @@
+"""Monthly range partitioning of the point table on PostgreSQL
+
+`entry_point` is partitioned by month of `timestamp` into `entry_point_yYYYYmMM` tables,
+points without timestamp (and outside created months) go to `entry_point_default`. Partitions are kept created
+ahead of the current month, and partitions of past months are created when points of them are imported.
+Django does not know about partitioning, the model and its queries do not change.
+Unique constraints of a partitioned table must include the partition key, and `timestamp` may be null, so the
+table has no primary key: `id` has a plain index and its values are unique only as they come from its sequence.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+
+from django.db import connection, transaction
+
+from entry.models import Point
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION_SUFFIX = 'default'
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def iter_months(start: datetime, end: datetime) -> Iterator[datetime]:
+    """Month starts from the month of start to the month of end, inclusive"""
+    month = month_start(start)
+    while month <= end:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(month: Optional[datetime], table: str = None) -> str:
+    table = table or Point._meta.db_table
+    if month is None:
+        return '{}_{}'.format(table, DEFAULT_PARTITION_SUFFIX)
+    return '{}_y{:04d}m{:02d}'.format(table, month.year, month.month)
+
+
+def is_partitioned(cursor, table: str = None) -> bool:
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace)",
+        [table or Point._meta.db_table])
+    return cursor.fetchone()[0]
+
+
+def get_partition_months(cursor, table: str = None) -> List[datetime]:
+    """Months of existing partitions"""
+    table = table or Point._meta.db_table
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s", [table])
+    months = []
+    prefix = '{}_y'.format(table)
+    for (name,) in cursor.fetchall():
+        if name.startswith(prefix):
+            year, month = name[len(prefix):].split('m')
+            months.append(datetime(int(year), int(month), 1, tzinfo=timezone.utc))
+    return sorted(months)
+
+
+def create_partition(cursor, month: datetime, table: str = None) -> bool:
+    """Create the partition of the month, unless it exists
+    rows of the month already in the default partition are moved into it before it is attached. The default
+    partition is locked first, so rows of the month can not be added to it meanwhile and a concurrent creator of the
+    same partition waits and finds it created. Returns whether it was created.
+    """
+    table = table or Point._meta.db_table
+    quote_name = connection.ops.quote_name
+    name = quote_name(partition_name(month, table))
+    default = quote_name(partition_name(None, table))
+    bounds = (month.isoformat(), add_months(month, 1).isoformat())
+    with transaction.atomic():
+        cursor.execute('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(default))
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(name, quote_name(table)))
+        cursor.execute(
+            'WITH moved AS (DELETE FROM {default} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            'INSERT INTO {name} SELECT * FROM moved'.format(default=default, name=name), bounds)
+        cursor.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)'.format(
+            quote_name(table), name), bounds)
+    logger.info('Created partition %s', name)
+    return True
+
+
+def ensure_month_partitions(first: datetime, last: datetime, table: str = None) -> List[datetime]:
+    """Create missing monthly partitions of the months from first to last, e.g. of the points of an imported file
+    Returns months of created partitions.
+    """
+    created = []
+    with connection.cursor() as cursor:
+        if not is_partitioned(cursor, table):
+            return created
+        existing = set(get_partition_months(cursor, table))
+        for month in iter_months(first, last):
+            if month not in existing and create_partition(cursor, month, table):
+                created.append(month)
+    return created
+
+
+def ensure_partitions(months_ahead: int, start: datetime = None, table: str = None) -> List[datetime]:
+    """Create missing monthly partitions from start (default: current month) to months_ahead months later
+    Returns months of created partitions.
+    """
+    now = datetime.now(timezone.utc)
+    return ensure_month_partitions(start or now, add_months(month_start(now), months_ahead), table)
+
+
+
+
+def get_partitions(cursor, table: str) -> List[str]:
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass", [table])
+    return [name for (name,) in cursor.fetchall()]
+
+
+def get_table_definitions(cursor, table: str) -> Tuple[List[Tuple[str, str, str, str]], List[Tuple[str, str]]]:
+    """Constraints (except primary key) as (name, type, definition, definition of their index) and indexes not
+    backing a constraint as (name, definition)
+    """
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid), "
+        "CASE WHEN contype = 'u' THEN pg_get_indexdef(conindid) END FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype <> 'p'", [table])
+    constraints = cursor.fetchall()
+    cursor.execute(
+        "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = %s::regclass AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)",
+        [table])
+    indexes = cursor.fetchall()
+    return constraints, indexes
+
+
+def get_child_name(name: str, table: str, partition: str) -> str:
+    """Name of the index or constraint of the table on the partition, e.g. entry_point_y2020m10_entry_lap_ts_idx"""
+    suffix = name[len(table) + 1:] if name.startswith(table + '_') else name
+    return '{}_{}'.format(partition, suffix)[:63]
+
+
+def log_changes(cursor, table: str, log_table: str):
+    """Record the ids of rows inserted, updated or deleted in the table from now on in the log table"""
+    quote_name = connection.ops.quote_name
+    function = quote_name('{}_log_change'.format(table))
+    with transaction.atomic():
+        cursor.execute('CREATE TABLE {} (position bigserial PRIMARY KEY, id bigint NOT NULL)'.format(
+            quote_name(log_table)))
+        cursor.execute(
+            "CREATE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+            "IF TG_OP <> 'INSERT' THEN INSERT INTO {log} (id) VALUES (OLD.id); END IF; "
+            "IF TG_OP <> 'DELETE' THEN INSERT INTO {log} (id) VALUES (NEW.id); END IF; "
+            "RETURN NULL; END $$".format(function=function, log=quote_name(log_table)))
+        cursor.execute('CREATE TRIGGER {} AFTER INSERT OR UPDATE OR DELETE ON {} FOR EACH ROW EXECUTE FUNCTION {}()'
+                       .format(quote_name(log_table), quote_name(table), function))
+
+
+def stop_logging_changes(cursor, table: str, log_table: str):
+    quote_name = connection.ops.quote_name
+    cursor.execute('DROP TRIGGER {} ON {}'.format(quote_name(log_table), quote_name(table)))
+    cursor.execute('DROP FUNCTION {}()'.format(quote_name('{}_log_change'.format(table))))
+    cursor.execute('DROP TABLE {}'.format(quote_name(log_table)))
+
+
+def replay_changes(cursor, table: str, new_table: str, log_table: str, batch_size: int) -> int:
+    """Copy the current rows of the ids in the log table to the new table, in log order, and empty the log
+    changes committed meanwhile stay in the log for the next replay. Returns the number of replayed ids.
+    """
+    quote_name = connection.ops.quote_name
+    replayed = 0
+    while True:
+        with transaction.atomic():
+            cursor.execute(
+                'DELETE FROM {log} WHERE position IN (SELECT position FROM {log} ORDER BY position LIMIT %s) '
+                'RETURNING id'.format(log=quote_name(log_table)), [batch_size])
+            logged = [id for (id,) in cursor.fetchall()]
+            ids = list(set(logged))
+            cursor.execute('DELETE FROM {} WHERE id = ANY(%s)'.format(quote_name(new_table)), [ids])
+            cursor.execute('INSERT INTO {} SELECT * FROM {} WHERE id = ANY(%s)'.format(
+                quote_name(new_table), quote_name(table)), [ids])
+        replayed += len(ids)
+        if len(logged) < batch_size:
+            return replayed
+
+
+def get_new_name(name: str) -> str:
+    """Name of an index of the new table until the table is swapped, index names are unique in the schema"""
+    return name[:59] + '_new'
+
+
+def create_index(cursor, table: str, new_table: str, name: str, definition: str, constraint: str = None):
+    """Create the index of the table's index definition on every partition of the new table, then on the new table
+    partition indexes are built concurrently unless in a transaction, and attached to the index of the new table.
+    Indexes backing a constraint are added as the constraint, on the partitions first.
+    """
+    quote_name = connection.ops.quote_name
+    concurrently = ' CONCURRENTLY' if not connection.in_atomic_block else ''
+    unique = 'UNIQUE ' if definition.startswith('CREATE UNIQUE ') else ''
+    using = definition.split(' USING ', 1)[1]
+    children = []
+    for partition in get_partitions(cursor, new_table):
+        child = get_child_name(name, table, table + partition[len(new_table):])
+        cursor.execute('CREATE {}INDEX{} {} ON {} USING {}'.format(
+            unique, concurrently, quote_name(child), quote_name(partition), using))
+        if constraint:
+            cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {} USING INDEX {}'.format(
+                quote_name(partition), quote_name(child), constraint.split(' (', 1)[0], quote_name(child)))
+        children.append(child)
+    if constraint:
+        # constraints of the partitions matching the definition are attached, not built again
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(
+            quote_name(new_table), quote_name(get_new_name(name)), constraint))
+        return
+    cursor.execute('CREATE {}INDEX {} ON ONLY {} USING {}'.format(
+        unique, quote_name(get_new_name(name)), quote_name(new_table), using))
+    for child in children:
+        cursor.execute('ALTER INDEX {} ATTACH PARTITION {}'.format(quote_name(get_new_name(name)), quote_name(child)))
+
+
+def add_constraint(cursor, new_table: str, name: str, definition: str):
+    """Add the constraint to every partition of the new table as NOT VALID and validate it there, which does not
+    block writes, then to the new table, which attaches the validated constraints of the partitions
+    """
+    quote_name = connection.ops.quote_name
+    for partition in get_partitions(cursor, new_table):
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID'.format(
+            quote_name(partition), quote_name(name), definition))
+        cursor.execute('ALTER TABLE {} VALIDATE CONSTRAINT {}'.format(quote_name(partition), quote_name(name)))
+    cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(quote_name(new_table), quote_name(name), definition))
+
+
+def partition_table(months_ahead: int, batch_size: int = 100000, drop_old: bool = False, table: str = None,
+                    stdout=None):
+    """Convert the point table into a partitioned table
+    a trigger logs the ids of rows changed from the start, rows are copied in id batches up to the max id while the
+    table is in use, then the logged changes are replayed. Indexes are built concurrently and constraints validated
+    on the partitions of the new table, all while the table is in use, so under the exclusive lock only the changes
+    logged since the last replay are applied and the tables, partitions and indexes are renamed.
+    The new table has a (non unique) index on `id`, nothing enforces unique ids but the sequence.
+    The previous table is kept as `<table>_old` unless drop_old is set.
+    """
+    table = table or Point._meta.db_table
+    quote_name = connection.ops.quote_name
+    new_table = '{}_partitioned'.format(table)
+    old_table = '{}_old'.format(table)
+    log_table = '{}_changes'.format(table)
+    id_index = '{}_id_idx'.format(table)
+    write = stdout.write if stdout else logger.info
+
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            write('{} is already partitioned'.format(table))
+            return
+
+        cursor.execute('SELECT MIN("timestamp"), MAX("timestamp") FROM {}'.format(quote_name(table)))
+        first, last = cursor.fetchone()
+        now = datetime.now(timezone.utc)
+        with transaction.atomic():
+            cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")'.format(
+                quote_name(new_table), quote_name(table)))
+            cursor.execute('CREATE TABLE {} PARTITION OF {} DEFAULT'.format(
+                quote_name(partition_name(None, new_table)), quote_name(new_table)))
+            for month in iter_months(min(first or now, now), add_months(month_start(max(last or now, now)),
+                                                                        months_ahead)):
+                create_partition(cursor, month, new_table)
+
+        # rows of ids up to the max id committed before the trigger are copied, later changes are logged
+        log_changes(cursor, table, log_table)
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM {}'.format(quote_name(table)))
+        max_id = cursor.fetchone()[0]
+        copied = 0
+        while copied < max_id:
+            cursor.execute('INSERT INTO {} SELECT * FROM {} WHERE id > %s AND id <= %s'.format(
+                quote_name(new_table), quote_name(table)), [copied, copied + batch_size])
+            copied += batch_size
+            write('Copied rows up to id {} of {}'.format(min(copied, max_id), max_id))
+
+        create_index(cursor, table, new_table, id_index, 'CREATE INDEX USING btree (id)')
+        # batches copied at different times may conflict, unique constraints are built on replayed rows
+        write('Replayed {} changed rows'.format(replay_changes(cursor, table, new_table, log_table, batch_size)))
+        constraints, indexes = get_table_definitions(cursor, table)
+        for name, definition in indexes:
+            create_index(cursor, table, new_table, name, definition)
+        for name, kind, definition, index_definition in constraints:
+            if index_definition:
+                create_index(cursor, table, new_table, name, index_definition, constraint=definition)
+        write('Built indexes of {}'.format(new_table))
+        # rows of deleted entries are gone once replayed, foreign keys are validated on replayed rows
+        write('Replayed {} changed rows'.format(replay_changes(cursor, table, new_table, log_table, batch_size)))
+        for name, kind, definition, index_definition in constraints:
+            if not index_definition:
+                add_constraint(cursor, new_table, name, definition)
+        write('Validated constraints of {}'.format(new_table))
+        write('Replayed {} changed rows'.format(replay_changes(cursor, table, new_table, log_table, batch_size)))
+
+        with transaction.atomic():
+            cursor.execute('LOCK TABLE {} IN ACCESS EXCLUSIVE MODE'.format(quote_name(table)))
+            replay_changes(cursor, table, new_table, log_table, batch_size)
+            stop_logging_changes(cursor, table, log_table)
+
+            cursor.execute('ALTER TABLE {} RENAME TO {}'.format(quote_name(table), quote_name(old_table)))
+            cursor.execute('ALTER TABLE {} RENAME TO {}'.format(quote_name(new_table), quote_name(table)))
+            for name in get_partitions(cursor, table):
+                cursor.execute('ALTER TABLE {} RENAME TO {}'.format(
+                    quote_name(name), quote_name(table + name[len(new_table):])))
+            for name, kind, definition, index_definition in constraints:
+                cursor.execute('ALTER TABLE {} RENAME CONSTRAINT {} TO {}'.format(
+                    quote_name(old_table), quote_name(name), quote_name(name + '_old')))
+                if index_definition:
+                    cursor.execute('ALTER TABLE {} RENAME CONSTRAINT {} TO {}'.format(
+                        quote_name(table), quote_name(get_new_name(name)), quote_name(name)))
+            for name, definition in indexes:
+                cursor.execute('ALTER INDEX {} RENAME TO {}'.format(quote_name(name), quote_name(name + '_old')))
+            for name in [id_index] + [name for name, definition in indexes]:
+                cursor.execute('ALTER INDEX {} RENAME TO {}'.format(quote_name(get_new_name(name)), quote_name(name)))
+            cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(
+                quote_name('{}_id_seq'.format(table)), quote_name(table)))
+            if drop_old:
+                cursor.execute('DROP TABLE {}'.format(quote_name(old_table)))
+
+    if drop_old:
+        write('{} is partitioned by month'.format(table))
+    else:
+        write('{} is partitioned by month, the previous table is kept as {}'.format(table, old_table))
@@ -1,28 +1,258 @@
+import logging
 from abc import ABC, abstractmethod
+from typing import IO, Dict, Iterable, Tuple, Union
+
+import numpy as np
 import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+
+from entry.archives import get_source_size, open_entry_file
+from entry.cache import invalidate_entry
+from entry.metrics import EntryMetrics
+from entry.models import ImportJob, Point, Lap, TrackBlob
+from entry.partitions import ensure_month_partitions, iter_months
+from entry.services.entry_cache import get_frame_cache
+from entry.services.entry_copy import ON_CONFLICT_IGNORE, copy_dataframe_to_db
+from entry.services.entry_summary import SummaryAccumulator
+from entry.services.entry_track import TrackWriter
+
+logger = logging.getLogger(__name__)
+
+POINT_STORAGE_ROWS = 'rows'
+POINT_STORAGE_BLOB = 'blob'
+
+
+class MalformedFile(Exception):
+    """The file is broken past the dataframes already parsed, an import of it can not be completed or resumed"""
 
 
 class Entry(ABC):
-    """Entry base class"""
-    def __init__(self, entry, *args, **kwargs):
+    """Entry base class
+    subclasses parse the file into dataframes and declare how dataframe columns map to model fields,
+    converting and storing them in db is shared
+    """
+    # dataframe column name -> model field name
+    points_fields: Dict[str, str] = {}
+    laps_fields: Dict[str, str] = {}
+    # opt in to stream dataframes into db with COPY instead of creating model objs
+    copy_loader = False
+    # rows already stored for the entry (by Point/Lap unique constraints) are skipped, so re-running is idempotent;
+    # ON_CONFLICT_UPDATE overwrites them with COPY, None inserts blindly. Rows without timestamp or lap number never
+    # conflict, store() deletes rows of an earlier import for them
+    on_conflict = ON_CONFLICT_IGNORE
+    bulk_create_batch_size = 5000
+    # bump when parsed dataframes change, so frames cached by the previous parser are not used
+    parser_version = 1
+
+    def __init__(self, entry, *args, chunk_size: int = None, point_storage: str = None, format_name: str = None,
+                 **kwargs):
         self.entry = entry
+        # rows per dataframe for services that stream the file in chunks
+        self.chunk_size = chunk_size or settings.ENTRY_CHUNK_SIZE
+        self.point_storage = point_storage or settings.ENTRY_POINT_STORAGE
+        if self.point_storage not in (POINT_STORAGE_ROWS, POINT_STORAGE_BLOB):
+            raise ValueError('point_storage must be {!r} or {!r}'.format(POINT_STORAGE_ROWS, POINT_STORAGE_BLOB))
+        # metrics are labeled with the detected format, e.g. kml and kmz share a service
+        self.metrics = EntryMetrics(format_name or type(self).__name__[len('Entry'):].lower())
+        # months of point partitions known to exist
+        self.partition_months = set()
         super(Entry, self).__init__(*args, **kwargs)
 
+    # file_path is a path, or a binary file object for archive members and compressed files
     @abstractmethod
-    def get_dataframe_from_file(self, file_path: str):
+    def get_dataframe_from_file(self, file_path: Union[str, IO[bytes]]):
         """Get dataframe from file"""
         raise NotImplementedError("get_dataframe() is not implemented")
 
     @abstractmethod
-    def dataframe_to_model_objs(self, df: pd.DataFrame):
+    def get_model_dataframes(self, file_path: Union[str, IO[bytes]]) -> Iterable[Tuple[type, pd.DataFrame]]:
+        """Get (model, dataframe) pairs from file"""
+        raise NotImplementedError("get_model_dataframes() is not implemented")
+
+    def get_cache_key(self) -> str:
+        """Frame cache key, the file content hash, the parser that read it and the rows per dataframe"""
+        return '{}-{}-v{}-c{}'.format(
+            self.entry.sha256, type(self).__name__.lower(), self.parser_version, self.chunk_size)
+
+    def iter_model_dataframes(self, file_path: Union[str, IO[bytes]]) -> Iterable[Tuple[type, pd.DataFrame]]:
+        """Get (model, dataframe) pairs, from the frame cache if the file was parsed before
+        producing them is recorded as the parse stage
+        """
+        cache = get_frame_cache()
+        if cache is None or not self.entry.sha256:
+            return self.metrics.iter_frames(self.get_model_dataframes(file_path))
+        key = self.get_cache_key()
+        frames = cache.read(key)
+        if frames is None:
+            frames = cache.write(key, self.get_model_dataframes(file_path))
+        return self.metrics.iter_frames(frames)
+
+    def get_model_fields(self, model) -> Dict[str, str]:
+        """Get dataframe column to model field mapping of the model"""
+        return {Point: self.points_fields, Lap: self.laps_fields}[model]
+
+    @staticmethod
+    def column_to_python(series: pd.Series) -> np.ndarray:
+        """Convert a whole dataframe column to python values
+        timedelta to seconds, datetime64 to datetime and NaN/NaT to None
+        """
+        if pd.api.types.is_timedelta64_dtype(series):
+            series = series.dt.total_seconds()
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = series.dt.to_pydatetime()
+        else:
+            values = series.to_numpy(dtype=object)
+        values[series.isna().to_numpy()] = None
+        return values
+
+    def dataframe_to_model_objs(self, df: pd.DataFrame, model) -> list:
         """Dataframe to model objs"""
-        raise NotImplementedError("dataframe_to_model_objs() is not implemented")
+        with self.metrics.measure('convert', model, rows=len(df)):
+            fields = self.get_model_fields(model)
+            names = list(fields.values())
+            columns = [self.column_to_python(df[column]) for column in fields]
+            user_id = self.entry.customer.id
+            entry_id = self.entry.id
+            return [
+                model(user_id=user_id, entry_id=entry_id, **dict(zip(names, values)))
+                for values in zip(*columns)
+            ]
 
-    @abstractmethod
     def submit_model_objs_to_db(self, model_objs: list):
         """Submit model objs to db"""
-        raise NotImplementedError("submit_model_objs_to_db() is not implemented")
+        if not model_objs:
+            return
+        model = type(model_objs[0])
+        if model not in (Point, Lap):
+            raise TypeError('model_objs must be a list of Point or Lap objects')
+        with self.metrics.measure('submit', model, rows=len(model_objs)):
+            model.objects.bulk_create(
+                model_objs, batch_size=self.bulk_create_batch_size, ignore_conflicts=self.on_conflict is not None)
 
-    @abstractmethod
-    def run(self):
-        raise NotImplementedError("run() is not implemented")
+    def submit_dataframe_to_db(self, df: pd.DataFrame, model) -> int:
+        """Submit dataframe to db with COPY
+        rows skipped as conflicting with stored rows (e.g. samples of the same time) are logged
+        """
+        with self.metrics.measure('submit', model, rows=len(df)):
+            fields = self.get_model_fields(model)
+            stored = copy_dataframe_to_db(
+                model, df[list(fields)].rename(columns=fields),
+                on_conflict=self.on_conflict,
+                batch_size=self.bulk_create_batch_size,
+                user_id=self.entry.customer.id,
+                entry_id=self.entry.id,
+            )
+        if stored < len(df):
+            logger.warning('Entry %s: %s of %s %s rows conflict with stored rows and were skipped',
+                           self.entry.id, len(df) - stored, len(df), model._meta.model_name)
+        return stored
+
+    def delete_rows(self):
+        """Delete points, laps and the track blob stored for the entry by an earlier import"""
+        for model in (Point, Lap, TrackBlob):
+            model.objects.filter(entry=self.entry).delete()
+
+    def ensure_point_partitions(self, df: pd.DataFrame):
+        """Create the monthly point partitions of the times of the dataframe, its points would go to the default
+        partition otherwise, e.g. of files recorded before the partitions kept created ahead of time
+        """
+        if connection.vendor != 'postgresql':
+            return
+        columns = [column for column, field in self.get_model_fields(Point).items() if field == 'timestamp']
+        if not columns:
+            return
+        times = pd.to_datetime(df[columns[0]], utc=True)
+        first, last = times.min(), times.max()
+        if pd.isna(first):
+            return
+        first, last = first.to_pydatetime(), last.to_pydatetime()
+        months = set(iter_months(first, last))
+        if not months <= self.partition_months:
+            ensure_month_partitions(first, last)
+            self.partition_months |= months
+
+    def get_summary_dataframe(self, df: pd.DataFrame, model) -> pd.DataFrame:
+        """Get dataframe with model field columns the entry summary is computed from"""
+        fields = self.get_model_fields(model)
+        return df[list(fields)].rename(columns=fields)
+
+    def submit_track_to_db(self, track: TrackWriter):
+        """Submit packed points of the entry to db, replacing a previous track"""
+        with self.metrics.measure('submit', TrackBlob, rows=track.size):
+            TrackBlob.objects.update_or_create(entry=self.entry, defaults={
+                'user_id': self.entry.customer.id, 'data': track.pack(), 'points_count': track.size,
+            })
+
+    def run(self, job: ImportJob = None):
+        """Run
+        each dataframe is converted and stored as soon as it is parsed,
+        archive members and compressed files are read as streams
+        """
+        with open_entry_file(self.entry) as source:
+            self.store(self.iter_model_dataframes(source), source, job=job)
+
+    def store(self, frames: Iterable[Tuple[type, pd.DataFrame]], source: Union[str, IO[bytes]] = None,
+              job: ImportJob = None):
+        """Store parsed (model, dataframe) pairs
+        each dataframe is reduced into the entry summary, which is replaced when the entry is processed again.
+        In the blob point storage mode points are collected and stored once as a TrackBlob instead of rows.
+        Metrics of the stages are stored with the entry, with the bytes read from the source if it is given.
+        Each dataframe is committed in its own transaction, with the checkpoint of the job if there is one. Rows the job
+        already committed (the first ones of each model, counted over the dataframes whatever their size) are still
+        reduced into the summary, but not stored again. Rows of an earlier import are deleted first when the job has
+        none committed (or there is no job): rows without timestamp never conflict, they would be stored twice.
+        The rows of the entry are deleted again if the parser raises MalformedFile.
+        """
+        if job is None or not job.rows_committed:
+            self.delete_rows()
+        summary = SummaryAccumulator()
+        track = TrackWriter() if self.point_storage == POINT_STORAGE_BLOB else None
+        # rows of each model parsed before the dataframe
+        parsed = {Point: 0, Lap: 0}
+        try:
+            for model, df in frames:
+                if df.empty:
+                    continue
+                with self.metrics.measure('summary', model, rows=len(df)):
+                    summary.add(model, self.get_summary_dataframe(df, model))
+                if model is Point and track is not None:
+                    with self.metrics.measure('convert', model, rows=len(df)):
+                        fields = self.get_model_fields(model)
+                        track.add(df[list(fields)].rename(columns=fields))
+                    continue
+                skip = job.get_committed(model) - parsed[model] if job is not None else 0
+                parsed[model] += len(df)
+                if skip >= len(df):
+                    continue
+                if skip > 0:
+                    df = df.iloc[skip:]
+                if model is Point:
+                    self.ensure_point_partitions(df)
+                with transaction.atomic():
+                    if self.copy_loader:
+                        self.submit_dataframe_to_db(df, model)
+                    else:
+                        model_objs = self.dataframe_to_model_objs(df, model)
+                        self.submit_model_objs_to_db(model_objs)
+                    if job is not None:
+                        job.checkpoint(model, len(df), 'submit')
+        except MalformedFile:
+            # retries would fail the same way, the rows committed so far are deleted rather than left half-imported
+            with transaction.atomic():
+                self.delete_rows()
+                if job is not None:
+                    job.reset()
+            raise
+        with transaction.atomic():
+            if track is not None and track.size:
+                self.submit_track_to_db(track)
+            with self.metrics.measure('summary'):
+                summary.save(self.entry)
+            if source is not None:
+                self.metrics.record('parse', calls=0, bytes=get_source_size(source))
+            self.metrics.save(self.entry)
+            if job is not None:
+                job.finish()
+            # cached reads of the entry (and of its duplicates) are stale once this commits
+            invalidate_entry(self.entry.pk)
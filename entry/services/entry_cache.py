@@ -0,0 +1,94 @@
+import logging
+import os
+import shutil
+import tempfile
+from typing import Iterable, Iterator, Optional, Tuple
+
+import pandas as pd
+from django.conf import settings
+
+from entry.models import Lap, Point
+
+try:
+    import pyarrow  # noqa: F401, parquet engine of pandas
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODELS = {model._meta.model_name: model for model in (Point, Lap)}
+
+
+class FrameCache:
+    """Parsed dataframes cache
+    the (model, dataframe) pairs of a parsed file are stored as numbered parquet files in a directory per key.
+    A directory is only visible once all pairs are written, reading touches it, and the least recently used
+    directories are removed when the cache grows over max_size bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def read(self, key: str) -> Optional[Iterator[Tuple[type, pd.DataFrame]]]:
+        """Cached pairs of the key, None on a miss"""
+        path = self.get_path(key)
+        try:
+            names = sorted(os.listdir(path))
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        logger.info('Frame cache hit %s', key)
+        return self.__read(path, names)
+
+    @staticmethod
+    def __read(path: str, names) -> Iterator[Tuple[type, pd.DataFrame]]:
+        for name in names:
+            model_name = name.split('.')[0].split('-')[1]
+            yield CACHE_MODELS[model_name], pd.read_parquet(os.path.join(path, name))
+
+    def write(self, key: str, frames: Iterable[Tuple[type, pd.DataFrame]]) -> Iterator[Tuple[type, pd.DataFrame]]:
+        """Pass pairs through, storing them under the key once all of them went through"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = tempfile.mkdtemp(prefix='.{}-'.format(key), dir=self.directory)
+        try:
+            for index, (model, df) in enumerate(frames):
+                df.to_parquet(os.path.join(path, '{:06d}-{}.parquet'.format(index, model._meta.model_name)))
+                yield model, df
+            try:
+                os.rename(path, self.get_path(key))
+            except OSError:
+                # stored meanwhile by another worker
+                pass
+            else:
+                self.evict()
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def get_size(path: str) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def evict(self):
+        """Remove least recently used keys until the cache fits in max_size"""
+        keys = []
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and not entry.name.startswith('.'):
+                keys.append((entry.stat().st_mtime, entry.path, self.get_size(entry.path)))
+        size = sum(key_size for _, _, key_size in keys)
+        for _, path, key_size in sorted(keys):
+            if size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            size -= key_size
+            logger.info('Frame cache evicted %s', os.path.basename(path))
+
+
+def get_frame_cache() -> Optional[FrameCache]:
+    """Frame cache of the settings, None if it is disabled or pyarrow is not installed"""
+    if pyarrow is None or not settings.ENTRY_FRAME_CACHE_DIR:
+        return None
+    return FrameCache(settings.ENTRY_FRAME_CACHE_DIR, settings.ENTRY_FRAME_CACHE_SIZE)
@@ -0,0 +1,132 @@
+import io
+from typing import Iterator, List, Optional
+
+import pandas as pd
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+ON_CONFLICT_IGNORE = 'ignore'
+ON_CONFLICT_UPDATE = 'update'
+# marker of missing values, so empty strings are not loaded as NULL; a `\N` string is loaded as NULL too
+NULL = '\\N'
+COPY_OPTIONS = "(FORMAT csv, NULL '{}')".format(NULL)
+
+
+class CsvStream(io.TextIOBase):
+    """File-like object rendering dataframe rows as csv lazily, missing values as NULL
+    so COPY can read it in pieces without building the whole payload in memory
+    """
+
+    def __init__(self, df: pd.DataFrame, chunk_size: int = 10000):
+        self.__chunks = self.__render(df, chunk_size)
+        self.__buffer = ''
+
+    @staticmethod
+    def __render(df: pd.DataFrame, chunk_size: int) -> Iterator[str]:
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size].to_csv(header=False, index=False, na_rep=NULL)
+
+    def readable(self):
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.__buffer) < size:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                break
+            self.__buffer += chunk
+        if size < 0:
+            data, self.__buffer = self.__buffer, ''
+        else:
+            data, self.__buffer = self.__buffer[:size], self.__buffer[size:]
+        return data
+
+    def readline(self, size: int = -1) -> str:
+        return self.read(size)
+
+
+def column_to_db(series: pd.Series, field: models.Field) -> pd.Series:
+    """Convert dataframe column to values accepted by the model field column"""
+    if pd.api.types.is_timedelta64_dtype(series):
+        series = series.dt.total_seconds()
+    if isinstance(field, models.IntegerField):
+        # integers with missing values are floats in pandas, and COPY does not accept `1.0` for an integer column
+        series = pd.to_numeric(series).round().astype('Int64')
+    elif isinstance(field, models.DateTimeField):
+        series = pd.to_datetime(series, utc=True)
+    return series
+
+
+def get_unique_fields(model) -> List[models.Field]:
+    """Fields of the first unique constraint of the model, used as conflict target"""
+    for constraint in model._meta.constraints:
+        if isinstance(constraint, models.UniqueConstraint) and constraint.condition is None:
+            return [model._meta.get_field(name) for name in constraint.fields]
+    raise ValueError('{} has no unique constraint'.format(model.__name__))
+
+
+def copy_dataframe_to_db(model, df: pd.DataFrame, on_conflict: Optional[str] = None, batch_size: Optional[int] = None,
+                         **constants) -> int:
+    """Stream dataframe into model table with PostgreSQL COPY, skipping model objs
+    df columns are model field names, constants (e.g. user_id, entry_id) are set on every row,
+    auto_now and auto_now_add fields are filled with current time, other fields with their default.
+    With on_conflict rows are copied into a staging table first and merged with `INSERT ... ON CONFLICT`,
+    so rows already stored (by the model unique constraint) are skipped (`ignore`) or overwritten (`update`).
+    Falls back to bulk_create (of batch_size objs per query) on other databases, where `update` behaves like `ignore`.
+    Returns the number of stored rows, without rows skipped on conflict (counted on PostgreSQL only).
+    """
+    if df.empty:
+        return 0
+
+    now = timezone.now()
+    fields = []
+    data = {}
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        if field.attname in constants:
+            data[field.attname] = constants[field.attname]
+        elif field.name in df.columns:
+            data[field.attname] = column_to_db(df[field.name], field).reset_index(drop=True)
+        elif getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            data[field.attname] = now
+        else:
+            # as bulk_create does, e.g. an empty string for a CharField
+            data[field.attname] = field.get_default()
+        fields.append(field)
+    frame = pd.DataFrame(data, index=range(len(df)))
+
+    if connection.vendor != 'postgresql':
+        objs = [model(**row) for row in frame.astype(object).where(frame.notna(), None).to_dict('records')]
+        model.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=on_conflict is not None)
+        return len(objs)
+
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    columns = ', '.join(quote_name(field.column) for field in fields)
+    if on_conflict is None:
+        with connection.cursor() as cursor:
+            cursor.copy_expert('COPY {} ({}) FROM STDIN WITH {}'.format(table, columns, COPY_OPTIONS), CsvStream(frame))
+        return len(frame)
+
+    if on_conflict == ON_CONFLICT_IGNORE:
+        conflict = 'DO NOTHING'
+    elif on_conflict == ON_CONFLICT_UPDATE:
+        target = [field.column for field in get_unique_fields(model)]
+        conflict = '({}) DO UPDATE SET {}'.format(
+            ', '.join(quote_name(column) for column in target),
+            ', '.join('{0} = EXCLUDED.{0}'.format(quote_name(field.column)) for field in fields
+                      if field.column not in target and not getattr(field, 'auto_now_add', False)),
+        )
+    else:
+        raise ValueError('on_conflict must be one of None, {!r}, {!r}'.format(ON_CONFLICT_IGNORE, ON_CONFLICT_UPDATE))
+
+    staging = quote_name('{}_staging'.format(model._meta.db_table))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS {}'.format(staging))
+        cursor.execute('CREATE TEMPORARY TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA'.format(
+            staging, columns, table))
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH {}'.format(staging, columns, COPY_OPTIONS), CsvStream(frame))
+        cursor.execute('INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} ON CONFLICT {conflict}'.format(
+            table=table, columns=columns, staging=staging, conflict=conflict))
+        return cursor.rowcount
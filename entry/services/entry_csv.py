@@ -2,46 +2,38 @@ from entry.models import Lap
 from entry.services.entry_base import Entry
 
 import pandas as pd
-from funcy import log_durations
-import logging
 
 
 class EntryCsv(Entry):
     """Entry csv class
     process .csv files and store data in db
     """
+    laps_fields = {'number': 'number', 'Distance': 'total_distance', 'Moving Time': 'total_elapsed_time'}
+    # columns only used in the entry summary
+    summary_fields = {'Elevation Gain': 'elevation_gain', 'Avg HR': 'avg_heart_rate', 'Max HR': 'max_heart_rate'}
+    parser_version = 2
 
     def __init__(self, *args, **kwargs):
         super(EntryCsv, self).__init__(*args, **kwargs)
 
-    @log_durations(logging.info)
     def get_dataframe_from_file(self, file_path: str):
         """Get dataframe from file"""
         df = pd.read_csv(file_path)
         df['Time'] = pd.to_timedelta(df['Time']).dt.total_seconds()
         df['Moving Time'] = pd.to_timedelta(df['Moving Time']).dt.total_seconds()
+        # split distances are in kilometers, stored in meters as the distances of the other formats
+        df['Distance'] = pd.to_numeric(df['Distance'], errors='coerce') * 1000
+        # splits and the summary row are numbered by position
+        df['number'] = range(1, len(df) + 1)
         return df
 
-    @log_durations(logging.info)
-    def dataframe_to_model_objs(self, df: pd.DataFrame):
-        """Dataframe to model objs"""
-        return [
-            Lap(
-                user_id=self.entry.customer.id,
-                entry_id=self.entry.id,
-                total_distance=row['Distance'],
-                total_elapsed_time=row['Moving Time'],
-            ) for index, row in df.iterrows()
-        ]
+    def get_model_dataframes(self, file_path: str):
+        """Get (model, dataframe) pairs from file"""
+        return [(Lap, self.get_dataframe_from_file(file_path))]
 
-    @log_durations(logging.info)
-    def submit_model_objs_to_db(self, model_objs: list):
-        """Submit model objs to db"""
-        Lap.objects.bulk_create(model_objs)
-
-    def run(self):
-        """Run"""
-        file_path = self.entry.file.path
-        df = self.get_dataframe_from_file(file_path)
-        model_objs = self.dataframe_to_model_objs(df)
-        self.submit_model_objs_to_db(model_objs)
+    def get_summary_dataframe(self, df: pd.DataFrame, model) -> pd.DataFrame:
+        """Get dataframe the entry summary is computed from
+        splits only, the summary row repeats their totals
+        """
+        fields = {**self.laps_fields, **self.summary_fields}
+        return df.loc[df['Split'].astype(str) != 'Summary', list(fields)].rename(columns=fields)
@@ -1,9 +1,12 @@
 from entry.models import Point
-from entry.services.entry_base import Entry
+from entry.services.entry_base import Entry, MalformedFile
+
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
 
 import pandas as pd
 import gpxpy
-from funcy import log_durations
+import lxml.etree
 import logging
 
 
@@ -12,7 +15,18 @@ class EntryGpx(Entry):
     process .gpx files and store data in db
     """
     __namespaces = {'garmin_tpe': 'http://www.garmin.com/xmlschemas/TrackPointExtension/v1'}
-    __column_names = ['latitude', 'longitude', 'elevation', 'time', 'heart_rate', 'cadence']
+    __column_names = ['latitude', 'longitude', 'elevation', 'time', 'heart_rate', 'cadence', 'segment']
+    # there are no laps in gpx, segment index (counted over all tracks) is stored as lap number
+    points_fields = {
+        'latitude': 'latitude', 'longitude': 'longitude', 'elevation': 'altitude',
+        'time': 'timestamp', 'heart_rate': 'heart_rate', 'cadence': 'cadence', 'segment': 'lap_number'
+    }
+    # TrackPointExtension hr and cad, v1 and v2
+    __hr_tags = ('{http://www.garmin.com/xmlschemas/TrackPointExtension/v1}hr',
+                 '{http://www.garmin.com/xmlschemas/TrackPointExtension/v2}hr')
+    __cad_tags = ('{http://www.garmin.com/xmlschemas/TrackPointExtension/v1}cad',
+                  '{http://www.garmin.com/xmlschemas/TrackPointExtension/v2}cad')
+    copy_loader = True
 
     def __init__(self, *args, **kwargs):
         super(EntryGpx, self).__init__(*args, **kwargs)
@@ -42,38 +56,98 @@ class EntryGpx(Entry):
 
         return data
 
-    @log_durations(logging.info)
+    def __get_gpxpy_dataframes(self, file_path: str) -> Iterator[pd.DataFrame]:
+        """Get points dataframes with gpxpy, slow but tolerant of odd files"""
+        if isinstance(file_path, str):
+            with open(file_path) as f:
+                gpx = gpxpy.parse(f)
+        else:
+            file_path.seek(0)
+            gpx = gpxpy.parse(file_path)
+        segment_no = 0
+        for track in gpx.tracks:
+            for segment in track.segments:
+                segment_no += 1
+                for start in range(0, len(segment.points), self.chunk_size):
+                    data = [self.__get_gpx_point_data(point) for point in segment.points[start:start + self.chunk_size]]
+                    df = pd.DataFrame(data, columns=self.__column_names)
+                    df['segment'] = segment_no
+                    yield df
+
+    def __points_dataframe(self, points_data: Dict[str, List]) -> pd.DataFrame:
+        """Convert collected raw point strings to a dataframe, one vectorized conversion per column"""
+        df = pd.DataFrame({
+            column: pd.to_numeric(pd.Series(points_data[column], dtype=object))
+            for column in ('latitude', 'longitude', 'elevation', 'heart_rate', 'cadence', 'segment')
+        })
+        df['time'] = pd.to_datetime(pd.Series(points_data['time'], dtype=object), utc=True)
+        return df[self.__column_names]
+
+    def __get_fast_dataframes(self, file_path: str) -> Iterator[pd.DataFrame]:
+        """Get points dataframes by reading the document incrementally
+        track points of every track and segment are collected as raw strings into per-column lists,
+        processed elements are freed
+        """
+        points_data = defaultdict(list)
+        points_count = 0
+        segment_no = 0
+        ns = None
+        for event, elem in lxml.etree.iterparse(file_path, events=('start', 'end'), tag=('{*}trkseg', '{*}trkpt')):
+            if ns is None:
+                # GPX 1.0 and 1.1 differ only in namespace
+                ns = elem.tag[:elem.tag.index('}') + 1] if elem.tag.startswith('{') else ''
+            if elem.tag == ns + 'trkseg':
+                if event == 'start':
+                    segment_no += 1
+                continue
+            if event == 'start':
+                continue
+
+            points_data['latitude'].append(elem.get('lat'))
+            points_data['longitude'].append(elem.get('lon'))
+            points_data['segment'].append(segment_no)
+            point = dict.fromkeys(('elevation', 'time', 'heart_rate', 'cadence'))
+            for child in elem:
+                if child.tag == ns + 'ele':
+                    point['elevation'] = child.text
+                elif child.tag == ns + 'time':
+                    point['time'] = child.text
+                elif child.tag == ns + 'extensions':
+                    for extension in child.iter(*self.__hr_tags, *self.__cad_tags):
+                        point['heart_rate' if extension.tag in self.__hr_tags else 'cadence'] = extension.text
+            for column, value in point.items():
+                points_data[column].append(value)
+
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+            points_count += 1
+            if points_count >= self.chunk_size:
+                yield self.__points_dataframe(points_data)
+                points_data = defaultdict(list)
+                points_count = 0
+
+        yield self.__points_dataframe(points_data)
+
     def get_dataframe_from_file(self, file_path: str):
         """Get dataframe from file"""
-        with open(file_path) as f:
-            gpx = gpxpy.parse(f)
-        segment = gpx.tracks[0].segments[0]  # Assuming we know that there is only one track and one segment
-        data = [self.__get_gpx_point_data(point) for point in segment.points]
-        return pd.DataFrame(data, columns=self.__column_names)
-
-    @log_durations(logging.info)
-    def dataframe_to_model_objs(self, df: pd.DataFrame):
-        """Dataframe to model objs"""
-        return [
-            Point(
-                user_id=self.entry.customer.id,
-                entry_id=self.entry.id,
-                latitude=row['latitude'],
-                longitude=row['longitude'],
-                altitude=row['elevation'],
-                timestamp=row['time'],
-                heart_rate=row['heart_rate'],
-                cadence=row['cadence']
-            ) for index, row in df.iterrows()
-        ]
-
-    @log_durations(logging.info)
-    def submit_model_objs_to_db(self, model_objs: list):
-        """Submit model objs to db"""
-        Point.objects.bulk_create(model_objs)
-
-    def run(self):
-        """Run"""
-        df = self.get_dataframe_from_file(self.entry.file.path)
-        model_objs = self.dataframe_to_model_objs(df)
-        self.submit_model_objs_to_db(model_objs)
+        return pd.concat([df for model, df in self.get_model_dataframes(file_path)], ignore_index=True)
+
+    def get_model_dataframes(self, file_path: str) -> Iterator[Tuple[type, pd.DataFrame]]:
+        """Get (model, dataframe) pairs from file
+        points are emitted in chunks of `chunk_size`, falling back to gpxpy if the fast reader can not handle the file.
+        The file is not validated ahead, it is read once: if the fast reader fails after the first chunk was emitted
+        MalformedFile is raised instead, the entry rows stored from the earlier chunks are deleted
+        """
+        emitted = False
+        try:
+            for df in self.__get_fast_dataframes(file_path):
+                emitted = True
+                yield Point, df
+        except (lxml.etree.XMLSyntaxError, ValueError, TypeError) as e:
+            if emitted:
+                raise MalformedFile('Malformed GPX file: {}'.format(e)) from e
+            logging.warning('Fast GPX reader failed on %s, falling back to gpxpy', file_path, exc_info=True)
+            for df in self.__get_gpxpy_dataframes(file_path):
+                yield Point, df
@@ -0,0 +1,126 @@
+from entry.models import Point
+from entry.services.entry_base import Entry
+
+import zipfile
+from collections import defaultdict
+from contextlib import ExitStack
+from typing import Dict, Iterator, List, Tuple
+
+import lxml.etree
+import pandas as pd
+
+
+class EntryKml(Entry):
+    """Entry kml class
+    process .kml and .kmz files and store data in db
+    """
+    __column_names = ['latitude', 'longitude', 'elevation', 'time', 'track']
+    # there are no laps in kml, track index (gx:Track and LineString, counted over the document) is stored as lap number
+    points_fields = {
+        'latitude': 'latitude', 'longitude': 'longitude', 'elevation': 'altitude',
+        'time': 'timestamp', 'track': 'lap_number'
+    }
+    copy_loader = True
+
+    __track_tags = ('{*}Track', '{*}LineString')
+    __value_tags = ('{*}when', '{*}coord', '{*}coordinates')
+
+    def __init__(self, *args, **kwargs):
+        super(EntryKml, self).__init__(*args, **kwargs)
+
+    @staticmethod
+    def __local_name(tag: str) -> str:
+        return tag.rsplit('}', 1)[-1]
+
+    @staticmethod
+    def __release(elem: lxml.etree._Element):
+        """Free a processed element and its already processed siblings"""
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    def __points_dataframe(self, points_data: Dict[str, List]) -> pd.DataFrame:
+        """Convert collected raw point strings to a dataframe, one vectorized conversion per column"""
+        df = pd.DataFrame({
+            column: pd.to_numeric(pd.Series(points_data[column], dtype=object))
+            for column in ('latitude', 'longitude', 'elevation', 'track')
+        })
+        df['time'] = pd.to_datetime(pd.Series(points_data['time'], dtype=object), utc=True)
+        return df[self.__column_names]
+
+    def __get_kml_dataframes(self, source) -> Iterator[pd.DataFrame]:
+        """Get points dataframes by reading the document incrementally
+        gx:Track points pair `when` and `gx:coord` values by position (when values come first in exports),
+        LineString points have no time. Processed elements are freed.
+        """
+        points_data = defaultdict(list)
+        points_count = 0
+        track_no = 0
+        whens: List[str] = []
+        coord_no = 0
+        for event, elem in lxml.etree.iterparse(
+                source, events=('start', 'end'), tag=self.__track_tags + self.__value_tags):
+            name = self.__local_name(elem.tag)
+            if name in ('Track', 'LineString'):
+                if event == 'start':
+                    track_no += 1
+                    whens = []
+                    coord_no = 0
+                continue
+            if event == 'start':
+                continue
+
+            if name == 'when':
+                # TimeStamp and TimeSpan of placemarks also have `when` elements, not times of track points
+                if self.__local_name(elem.getparent().tag) == 'Track':
+                    whens.append(elem.text)
+                coords = []
+            elif name == 'coord':
+                # gx:coord is `longitude latitude altitude`
+                coords = [((elem.text or '').split(), whens[coord_no] if coord_no < len(whens) else None)]
+                coord_no += 1
+            elif self.__local_name(elem.getparent().tag) == 'LineString':
+                # coordinates is `longitude,latitude[,altitude]` tuples separated by white space
+                coords = [(value.split(','), None) for value in (elem.text or '').split()]
+            else:
+                # Point and Polygon coordinates are not part of a track
+                coords = []
+            self.__release(elem)
+
+            for values, time in coords:
+                if len(values) < 2:
+                    continue
+                points_data['longitude'].append(values[0])
+                points_data['latitude'].append(values[1])
+                points_data['elevation'].append(values[2] if len(values) > 2 else None)
+                points_data['time'].append(time)
+                points_data['track'].append(track_no)
+                points_count += 1
+                if points_count >= self.chunk_size:
+                    yield self.__points_dataframe(points_data)
+                    points_data = defaultdict(list)
+                    points_count = 0
+
+        yield self.__points_dataframe(points_data)
+
+    def get_dataframe_from_file(self, file_path):
+        """Get dataframe from file"""
+        return pd.concat([df for model, df in self.get_model_dataframes(file_path)], ignore_index=True)
+
+    def get_model_dataframes(self, file_path) -> Iterator[Tuple[type, pd.DataFrame]]:
+        """Get (model, dataframe) pairs from file
+        points are emitted in chunks of `chunk_size`, kmz documents are read from the zip stream
+        """
+        with ExitStack() as stack:
+            source = file_path
+            if zipfile.is_zipfile(file_path):
+                # kmz: the first kml in the archive is the document, others are linked resources
+                archive = stack.enter_context(zipfile.ZipFile(file_path))
+                name = next((name for name in archive.namelist() if name.lower().endswith('.kml')), None)
+                if name is None:
+                    raise ValueError('KMZ archive has no KML document')
+                source = stack.enter_context(archive.open(name))
+            elif not isinstance(file_path, str):
+                file_path.seek(0)
+            for df in self.__get_kml_dataframes(source):
+                yield Point, df
@@ -0,0 +1,93 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+
+def project(positions: np.ndarray) -> np.ndarray:
+    """Project (latitude, longitude) degrees to local planar meters, equirectangular around the mean latitude"""
+    latitude = np.radians(positions[:, 0].mean())
+    radians = np.radians(positions)
+    return np.column_stack([radians[:, 1] * np.cos(latitude), radians[:, 0]]) * EARTH_RADIUS
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker simplification of a planar line
+    returns a mask of the points kept, points closer than tolerance to the simplified line are dropped.
+    Iterative, each step measures a whole span with numpy.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    if not len(points):
+        return keep
+    keep[0] = keep[-1] = True
+    spans = [(0, len(points) - 1)]
+    while spans:
+        start, end = spans.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        index = int(distances.argmax())
+        if distances[index] > tolerance:
+            index += start + 1
+            keep[index] = True
+            spans.append((start, index))
+            spans.append((index, end))
+    return keep
+
+
+def simplify(positions: np.ndarray, tolerance: float) -> np.ndarray:
+    """Simplify (latitude, longitude) degrees with a tolerance in meters"""
+    if len(positions) < 3:
+        return positions
+    return positions[douglas_peucker(project(positions), tolerance)]
+
+
+def encode_polyline(positions: np.ndarray, precision: int = 5) -> str:
+    """Encode (latitude, longitude) degrees with the encoded polyline algorithm format"""
+    values = np.round(positions * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    chars = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+
+def decode_polyline(polyline: str, precision: int = 5) -> np.ndarray:
+    """Decode an encoded polyline to (latitude, longitude) degrees"""
+    deltas = []
+    value = shift = 0
+    for char in polyline:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            deltas.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return np.cumsum(np.array(deltas, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def encode_levels(positions: np.ndarray, levels: Dict[int, float], precision: int = 5) -> Dict[str, str]:
+    """Encoded polylines of the track for each level, keyed by min zoom, levels map min zoom to tolerance"""
+    return {str(zoom): encode_polyline(simplify(positions, tolerance), precision)
+            for zoom, tolerance in sorted(levels.items())}
+
+
+def get_level(levels: Dict[str, str], zoom: int) -> Tuple[int, str]:
+    """(min zoom, polyline) of the most detailed level shown at the zoom, the coarsest one below every level"""
+    zooms = sorted(int(key) for key in levels)
+    if not zooms:
+        return 0, ''
+    zoom = max([key for key in zooms if key <= zoom] or zooms[:1])
+    return zoom, levels[str(zoom)]
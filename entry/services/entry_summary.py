@@ -0,0 +1,168 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from entry.models import EntrySummary, Lap, Point
+from entry.services.entry_polyline import EARTH_RADIUS, encode_levels, simplify
+
+
+def haversine(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """Great-circle distances in meters between consecutive positions, given in radians"""
+    a = (np.sin(np.diff(latitudes) / 2) ** 2
+         + np.cos(latitudes[:-1]) * np.cos(latitudes[1:]) * np.sin(np.diff(longitudes) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def column(df: pd.DataFrame, name: str) -> np.ndarray:
+    """Non-null float values of a dataframe column, empty if the column is missing"""
+    if name not in df.columns:
+        return np.empty(0)
+    values = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    return values[~np.isnan(values)]
+
+
+class SummaryAccumulator:
+    """Entry summary accumulator
+    reduces point and lap dataframes (columns are model field names) chunk by chunk, keeping the last position and
+    altitude so distance and elevation gain continue over chunk boundaries.
+    Values from points are preferred, laps fill in what points do not have (e.g. csv has laps only),
+    except distance which is taken from laps when they have it, as measured by the device.
+    The track is simplified per chunk with the finest polyline tolerance, each level is simplified from it at the end.
+    """
+
+    def __init__(self, polyline_levels: Dict[int, float] = None):
+        self.polyline_levels = settings.ENTRY_POLYLINE_LEVELS if polyline_levels is None else polyline_levels
+        self.points_count = 0
+        self.laps_count = 0
+        self.__start_time: Optional[pd.Timestamp] = None
+        self.__end_time: Optional[pd.Timestamp] = None
+        self.__last_position: Optional[np.ndarray] = None
+        self.__points_distance = 0.0
+        self.__last_altitude: Optional[float] = None
+        self.__points_elevation_gain = 0.0
+        self.__hr_sum = 0.0
+        self.__hr_count = 0
+        self.__points_max_hr: Optional[float] = None
+        self.__bounds: Optional[np.ndarray] = None  # min lat, max lat, min lon, max lon
+        self.__laps_distance: Optional[float] = None
+        self.__laps_time: Optional[float] = None
+        self.__laps_elevation_gain: Optional[float] = None
+        self.__laps_max_hr: Optional[float] = None
+        self.__laps_hr_weighted: Optional[float] = None
+        self.__laps_hr_time = 0.0
+        self.__track: List[np.ndarray] = []
+
+    @staticmethod
+    def __add(total: Optional[float], values: np.ndarray) -> Optional[float]:
+        return total if not len(values) else (total or 0.0) + float(values.sum())
+
+    @staticmethod
+    def __max(current: Optional[float], values: np.ndarray) -> Optional[float]:
+        return current if not len(values) else max(current or -np.inf, float(values.max()))
+
+    def add(self, model, df: pd.DataFrame):
+        """Add a point or lap dataframe"""
+        if model is Point:
+            self.add_points(df)
+        elif model is Lap:
+            self.add_laps(df)
+
+    def add_points(self, df: pd.DataFrame):
+        self.points_count += len(df)
+
+        if 'timestamp' in df.columns:
+            timestamps = pd.to_datetime(df['timestamp'], utc=True).dropna()
+            if len(timestamps):
+                start, end = timestamps.min(), timestamps.max()
+                self.__start_time = start if self.__start_time is None else min(self.__start_time, start)
+                self.__end_time = end if self.__end_time is None else max(self.__end_time, end)
+
+        if {'latitude', 'longitude'} <= set(df.columns):
+            positions = df[['latitude', 'longitude']].astype(float).dropna().to_numpy()
+            if len(positions):
+                bounds = np.array([positions[:, 0].min(), positions[:, 0].max(),
+                                   positions[:, 1].min(), positions[:, 1].max()])
+                if self.__bounds is not None:
+                    bounds = np.array([min(self.__bounds[0], bounds[0]), max(self.__bounds[1], bounds[1]),
+                                       min(self.__bounds[2], bounds[2]), max(self.__bounds[3], bounds[3])])
+                self.__bounds = bounds
+                radians = np.radians(positions)
+                if self.__last_position is not None:
+                    radians = np.vstack([self.__last_position, radians])
+                self.__points_distance += float(haversine(radians[:, 0], radians[:, 1]).sum())
+                self.__last_position = radians[-1:]
+                self.__add_track(positions)
+
+        altitudes = column(df, 'altitude')
+        if len(altitudes):
+            if self.__last_altitude is not None:
+                altitudes = np.concatenate([[self.__last_altitude], altitudes])
+            self.__points_elevation_gain += float(np.clip(np.diff(altitudes), 0, None).sum())
+            self.__last_altitude = float(altitudes[-1])
+
+        heart_rates = column(df, 'heart_rate')
+        self.__hr_sum += float(heart_rates.sum())
+        self.__hr_count += len(heart_rates)
+        self.__points_max_hr = self.__max(self.__points_max_hr, heart_rates)
+
+    def __add_track(self, positions: np.ndarray):
+        """Keep simplified positions, continuing from the last kept one"""
+        if not self.polyline_levels:
+            return
+        tolerance = min(self.polyline_levels.values())
+        if self.__track:
+            self.__track.append(simplify(np.vstack([self.__track[-1][-1:], positions]), tolerance)[1:])
+        else:
+            self.__track.append(simplify(positions, tolerance))
+
+    def add_laps(self, df: pd.DataFrame):
+        self.laps_count += len(df)
+        if 'total_elapsed_time' in df.columns and pd.api.types.is_timedelta64_dtype(df['total_elapsed_time']):
+            df = df.assign(total_elapsed_time=df['total_elapsed_time'].dt.total_seconds())
+        self.__laps_distance = self.__add(self.__laps_distance, column(df, 'total_distance'))
+        self.__laps_time = self.__add(self.__laps_time, column(df, 'total_elapsed_time'))
+        self.__laps_elevation_gain = self.__add(self.__laps_elevation_gain, column(df, 'elevation_gain'))
+        self.__laps_max_hr = self.__max(self.__laps_max_hr, column(df, 'max_heart_rate'))
+        if {'avg_heart_rate', 'total_elapsed_time'} <= set(df.columns):
+            # lap averages weighted by lap time
+            laps = df[['avg_heart_rate', 'total_elapsed_time']].apply(pd.to_numeric, errors='coerce').dropna()
+            self.__laps_hr_weighted = self.__add(
+                self.__laps_hr_weighted, laps['avg_heart_rate'].to_numpy() * laps['total_elapsed_time'].to_numpy())
+            self.__laps_hr_time += float(laps['total_elapsed_time'].sum())
+
+    def get_values(self) -> Dict:
+        """EntrySummary field values"""
+        values = {
+            'points_count': self.points_count,
+            'laps_count': self.laps_count,
+            'start_time': self.__start_time.to_pydatetime() if self.__start_time is not None else None,
+            'end_time': self.__end_time.to_pydatetime() if self.__end_time is not None else None,
+            'duration': self.__laps_time,
+            'total_distance': self.__laps_distance,
+            'elevation_gain': self.__laps_elevation_gain,
+            'avg_heart_rate': None,
+            'max_heart_rate': self.__points_max_hr if self.__points_max_hr is not None else self.__laps_max_hr,
+        }
+        if self.__start_time is not None:
+            values['duration'] = (self.__end_time - self.__start_time).total_seconds()
+        if values['total_distance'] is None and self.__last_position is not None:
+            values['total_distance'] = self.__points_distance
+        if self.__last_altitude is not None:
+            values['elevation_gain'] = self.__points_elevation_gain
+        if self.__hr_count:
+            values['avg_heart_rate'] = self.__hr_sum / self.__hr_count
+        elif self.__laps_hr_time:
+            values['avg_heart_rate'] = self.__laps_hr_weighted / self.__laps_hr_time
+        bounds = self.__bounds.tolist() if self.__bounds is not None else [None] * 4
+        values.update(zip(('min_latitude', 'max_latitude', 'min_longitude', 'max_longitude'), bounds))
+        values['polylines'] = encode_levels(
+            np.vstack(self.__track), self.polyline_levels, settings.ENTRY_POLYLINE_PRECISION) if self.__track else {}
+        return values
+
+    def save(self, entry) -> EntrySummary:
+        """Create or replace the summary of the entry"""
+        summary, _ = EntrySummary.objects.update_or_create(
+            entry=entry, defaults=dict(user_id=entry.customer_id, **self.get_values()))
+        return summary
@@ -1,11 +1,8 @@
-from datetime import datetime, timedelta
-from typing import Dict, Union, Optional
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import lxml.etree
-import dateutil.parser as dp
 import pandas as pd
-from funcy import log_durations
-import logging
 
 from entry.models import Lap, Point
 from entry.services.entry_base import Entry
@@ -15,190 +12,158 @@ class EntryTcx(Entry):
     """Entry tcx class
     process .tcx files and store data in db
     """
-    __namespaces = {
-        'ns': 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2',
-        'ns2': 'http://www.garmin.com/xmlschemas/UserProfile/v2',
-        'ns3': 'http://www.garmin.com/xmlschemas/ActivityExtension/v2',
-        'ns4': 'http://www.garmin.com/xmlschemas/ProfileExtension/v1',
-        'ns5': 'http://www.garmin.com/xmlschemas/ActivityGoals/v1'
-    }
     __points_column_names = ['latitude', 'longitude', 'elevation', 'time', 'heart_rate', 'cadence', 'speed', 'lap']
     __laps_column_names = ['number', 'start_time', 'distance', 'total_time', 'max_speed', 'max_hr', 'avg_hr']
+    points_fields = {
+        'latitude': 'latitude', 'longitude': 'longitude', 'lap': 'lap_number', 'elevation': 'altitude',
+        'time': 'timestamp', 'heart_rate': 'heart_rate', 'cadence': 'cadence', 'speed': 'speed'
+    }
+    laps_fields = {
+        'number': 'number', 'start_time': 'start_time', 'distance': 'total_distance',
+        'total_time': 'total_elapsed_time', 'max_speed': 'max_speed',
+        'max_hr': 'max_heart_rate', 'avg_hr': 'avg_heart_rate'
+    }
+    copy_loader = True
+
+    # qualified tag names, as lxml reports them
+    __ns = '{http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2}'
+    __lap_tag = __ns + 'Lap'
+    __trackpoint_tag = __ns + 'Trackpoint'
+    __value_tag = __ns + 'Value'
+    __speed_tag = '{http://www.garmin.com/xmlschemas/ActivityExtension/v2}Speed'
+    # lap child element -> lap column
+    __lap_elements = {
+        __ns + 'DistanceMeters': 'distance',
+        __ns + 'TotalTimeSeconds': 'total_time',
+        __ns + 'MaximumSpeed': 'max_speed',
+    }
+    __lap_hr_elements = {
+        __ns + 'MaximumHeartRateBpm': 'max_hr',
+        __ns + 'AverageHeartRateBpm': 'avg_hr',
+    }
+    # track point child element -> point column
+    __point_elements = {
+        __ns + 'Time': 'time',
+        __ns + 'AltitudeMeters': 'elevation',
+        __ns + 'Cadence': 'cadence',
+    }
 
     def __init__(self, *args, **kwargs):
         super(EntryTcx, self).__init__(*args, **kwargs)
 
-    def __get_tcx_lap_data(self, lap: lxml.etree._Element) -> Dict[str, Union[float, datetime, timedelta, int]]:
-        """Extract some data from an XML element representing a lap and
-        return it as a dict.
-        """
-
-        data: Dict[str, Union[float, datetime, timedelta, int]] = {}
-
-        # Note that because each element's attributes and text are returned as strings, we need to convert those strings
-        # to the appropriate datatype (datetime, float, int, etc).
-
-        start_time_str = lap.attrib['StartTime']
-        data['start_time'] = dp.parse(start_time_str)
-
-        distance_elem = lap.find('ns:DistanceMeters', self.__namespaces)
-        if distance_elem is not None:
-            data['distance'] = float(distance_elem.text)
-
-        total_time_elem = lap.find('ns:TotalTimeSeconds', self.__namespaces)
-        if total_time_elem is not None:
-            data['total_time'] = timedelta(seconds=float(total_time_elem.text))
-
-        max_speed_elem = lap.find('ns:MaximumSpeed', self.__namespaces)
-        if max_speed_elem is not None:
-            data['max_speed'] = float(max_speed_elem.text)
-
-        max_hr_elem = lap.find('ns:MaximumHeartRateBpm', self.__namespaces)
-        if max_hr_elem is not None:
-            data['max_hr'] = float(max_hr_elem.find('ns:Value', self.__namespaces).text)
-
-        avg_hr_elem = lap.find('ns:AverageHeartRateBpm', self.__namespaces)
-        if avg_hr_elem is not None:
-            data['avg_hr'] = float(avg_hr_elem.find('ns:Value', self.__namespaces).text)
-
+    @staticmethod
+    def __release(elem: lxml.etree._Element):
+        """Free a processed element and its already processed siblings"""
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    def __get_tcx_lap_data(self, lap: lxml.etree._Element) -> Dict[str, Optional[str]]:
+        """Extract raw strings from an XML element representing a lap"""
+        data: Dict[str, Optional[str]] = {}
+        for child in lap:
+            if child.tag in self.__lap_elements:
+                data[self.__lap_elements[child.tag]] = child.text
+            elif child.tag in self.__lap_hr_elements:
+                value = child.find(self.__value_tag)
+                if value is not None:
+                    data[self.__lap_hr_elements[child.tag]] = value.text
         return data
 
-    def __get_tcx_point_data(self, point: lxml.etree._Element) -> Optional[Dict[str, Union[float, int, str, datetime]]]:
-        """Extract some data from an XML element representing a track point
-        and return it as a dict.
-        """
-
-        data: Dict[str, Union[float, int, str, datetime]] = {}
-
-        position = point.find('ns:Position', self.__namespaces)
-        if position is None:
+    def __get_tcx_point_data(self, point: lxml.etree._Element) -> Optional[Dict[str, Optional[str]]]:
+        """Extract raw strings from an XML element representing a track point"""
+        data: Dict[str, Optional[str]] = {}
+        for child in point:
+            tag = child.tag
+            if tag in self.__point_elements:
+                data[self.__point_elements[tag]] = child.text
+            elif tag == self.__ns + 'Position':
+                for coordinate in child:
+                    if coordinate.tag == self.__ns + 'LatitudeDegrees':
+                        data['latitude'] = coordinate.text
+                    elif coordinate.tag == self.__ns + 'LongitudeDegrees':
+                        data['longitude'] = coordinate.text
+            elif tag == self.__ns + 'HeartRateBpm':
+                value = child.find(self.__value_tag)
+                if value is not None:
+                    data['heart_rate'] = value.text
+            elif tag == self.__ns + 'Extensions':
+                for speed in child.iter(self.__speed_tag):
+                    data['speed'] = speed.text
+
+        if 'latitude' not in data or 'longitude' not in data:
             # This Track-point element has no latitude or longitude data.
             # For simplicity's sake, we will ignore such points.
             return None
-        else:
-            data['latitude'] = float(position.find('ns:LatitudeDegrees', self.__namespaces).text)
-            data['longitude'] = float(position.find('ns:LongitudeDegrees', self.__namespaces).text)
-
-        time_str = point.find('ns:Time', self.__namespaces).text
-        data['time'] = dp.parse(time_str)
-
-        elevation_elem = point.find('ns:AltitudeMeters', self.__namespaces)
-        if elevation_elem is not None:
-            data['elevation'] = float(elevation_elem.text)
-
-        hr_elem = point.find('ns:HeartRateBpm', self.__namespaces)
-        if hr_elem is not None:
-            data['heart_rate'] = int(hr_elem.find('ns:Value', self.__namespaces).text)
-
-        cad_elem = point.find('ns:Cadence', self.__namespaces)
-        if cad_elem is not None:
-            data['cadence'] = int(cad_elem.text)
-
-        # The ".//" here basically tells lxml to search recursively down the tree for the relevant tag, rather than
-        # just the immediate child elements of speed_elem. See https://lxml.de/tutorial.html#elementpath
-        speed_elem = point.find('.//ns3:Speed', self.__namespaces)
-        if speed_elem is not None:
-            data['speed'] = float(speed_elem.text)
-
         return data
 
-    def __points_to_model_objs(self, df: pd.DataFrame) -> list:
-        return [
-            Point(
-                user_id=self.entry.customer.id,
-                entry_id=self.entry.id,
-                latitude=row['latitude'],
-                longitude=row['longitude'],
-                lap_number=row['lap'],
-                altitude=row['elevation'],
-                timestamp=row['time'],
-                heart_rate=row['heart_rate'],
-                cadence=row['cadence'],
-                speed=row['speed']
-            ) for index, row in df.iterrows()
-        ]
-
-    def __laps_to_model_objs(self, df: pd.DataFrame) -> list:
-        return [
-            Lap(
-                user_id=self.entry.customer.id,
-                entry_id=self.entry.id,
-                number=row['number'],
-                start_time=row['start_time'],
-                total_distance=row['distance'],
-                total_elapsed_time=row['total_time'].total_seconds(),
-                max_speed=row['max_speed'],
-                max_heart_rate=row['max_hr'],
-                avg_heart_rate=row['avg_hr']
-            ) for index, row in df.iterrows()
-        ]
-
-    @staticmethod
-    def __bulk_insert_points(points: list):
-        """Bulk insert points"""
-        Point.objects.bulk_create(points)
-
-    @staticmethod
-    def __bulk_insert_laps(laps: list):
-        """Bulk insert laps"""
-        Lap.objects.bulk_create(laps)
-
-    @log_durations(logging.info)
-    def get_dataframe_from_file(self, file_path: str):
+    def __points_dataframe(self, points_data: Dict[str, List]) -> pd.DataFrame:
+        """Convert collected raw point strings to a dataframe, one vectorized conversion per column"""
+        df = pd.DataFrame({
+            column: pd.to_numeric(pd.Series(points_data[column], dtype=object))
+            for column in ('latitude', 'longitude', 'elevation', 'heart_rate', 'cadence', 'speed', 'lap')
+        })
+        df['time'] = pd.to_datetime(pd.Series(points_data['time'], dtype=object), utc=True)
+        return df[self.__points_column_names]
+
+    def __laps_dataframe(self, laps_data: Dict[str, List]) -> pd.DataFrame:
+        """Convert collected raw lap strings to a dataframe, one vectorized conversion per column"""
+        df = pd.DataFrame({
+            column: pd.to_numeric(pd.Series(laps_data[column], dtype=object))
+            for column in ('number', 'distance', 'max_speed', 'max_hr', 'avg_hr')
+        })
+        df['start_time'] = pd.to_datetime(pd.Series(laps_data['start_time'], dtype=object), utc=True)
+        df['total_time'] = pd.to_timedelta(
+            pd.to_numeric(pd.Series(laps_data['total_time'], dtype=object)), unit='s')
+        return df[self.__laps_column_names]
+
+    def get_dataframe_from_file(self, file_path: str) -> (pd.DataFrame, pd.DataFrame):
         """Get dataframe from file"""
-        tree = lxml.etree.parse(file_path)
-        root = tree.getroot()
-        activity = root.find('ns:Activities', self.__namespaces)[
-            0]  # Assuming we know there is only one Activity in the TCX file
-        # (or we are only interested in the first one)
-        points_data = []
-        laps_data = []
-        lap_no = 1
-        for lap in activity.findall('ns:Lap', self.__namespaces):
-            # Get data about the lap itself
-            single_lap_data = self.__get_tcx_lap_data(lap)
-            single_lap_data['number'] = lap_no
-            laps_data.append(single_lap_data)
-
-            # Get data about the track points in the lap
-            track = lap.find('ns:Track', self.__namespaces)
-            for point in track.findall('ns:Trackpoint', self.__namespaces):
-                single_point_data = self.__get_tcx_point_data(point)
-                if single_point_data:
-                    single_point_data['lap'] = lap_no
-                    points_data.append(single_point_data)
-            lap_no += 1
-
-        # Create DataFrames from the data we have collected. If any information is missing from a particular lap or
-        # track point, it will show up as a null value or "NaN" in the DataFrame.
-
-        laps_df = pd.DataFrame(laps_data, columns=self.__laps_column_names)
-        points_df = pd.DataFrame(points_data, columns=self.__points_column_names)
-
+        points_dfs = []
+        laps_dfs = []
+        for model, df in self.get_model_dataframes(file_path):
+            (points_dfs if model is Point else laps_dfs).append(df)
+        laps_df = pd.concat(laps_dfs, ignore_index=True)
+        points_df = pd.concat(points_dfs, ignore_index=True)
         return laps_df, points_df
 
-    @log_durations(logging.info)
-    def dataframe_to_model_objs(self, df: pd.DataFrame) -> list:
-        """Dataframe to model objs"""
-        if df.columns.tolist() == self.__points_column_names:
-            return self.__points_to_model_objs(df)
-        else:
-            return self.__laps_to_model_objs(df)
-
-    @log_durations(logging.info)
-    def submit_model_objs_to_db(self, model_objs: list):
-        """Submit model objs to db"""
-        if isinstance(model_objs[0], Point):
-            self.__bulk_insert_points(model_objs)
-        elif isinstance(model_objs[0], Lap):
-            self.__bulk_insert_laps(model_objs)
-        else:
-            raise TypeError('model_objs must be a list of Point or Lap objects')
-
-    def run(self):
-        """Run"""
-        laps_df, points_df = self.get_dataframe_from_file(self.entry.file.path)
-        points_objs = self.dataframe_to_model_objs(points_df)
-        laps_objs = self.dataframe_to_model_objs(laps_df)
-        self.submit_model_objs_to_db(points_objs)
-        self.submit_model_objs_to_db(laps_objs)
+    def get_model_dataframes(self, file_path: str) -> Iterator[Tuple[type, pd.DataFrame]]:
+        """Get (model, dataframe) pairs from file
+        the document is read incrementally and processed elements are freed, laps of every Activity are included,
+        points are emitted in chunks of `chunk_size`
+        """
+        points_data = defaultdict(list)
+        laps_data = defaultdict(list)
+        points_count = 0
+        lap_no = 0
+        for event, elem in lxml.etree.iterparse(
+                file_path, events=('start', 'end'), tag=(self.__lap_tag, self.__trackpoint_tag)):
+            if elem.tag == self.__lap_tag:
+                if event == 'start':
+                    lap_no += 1
+                    continue
+                single_lap_data = self.__get_tcx_lap_data(elem)
+                laps_data['number'].append(lap_no)
+                laps_data['start_time'].append(elem.get('StartTime'))
+                for column in self.__laps_column_names[2:]:
+                    laps_data[column].append(single_lap_data.get(column))
+                self.__release(elem)
+            elif event == 'end':
+                single_point_data = self.__get_tcx_point_data(elem)
+                self.__release(elem)
+                if single_point_data is None:
+                    continue
+                single_point_data['lap'] = lap_no
+                for column in self.__points_column_names:
+                    points_data[column].append(single_point_data.get(column))
+                points_count += 1
+                if points_count >= self.chunk_size:
+                    yield Point, self.__points_dataframe(points_data)
+                    points_data = defaultdict(list)
+                    points_count = 0
+
+        # If any information is missing from a particular lap or track point, it will show up as a null value or
+        # "NaN" in the DataFrame.
+
+        yield Point, self.__points_dataframe(points_data)
+        yield Lap, self.__laps_dataframe(laps_data)
@@ -0,0 +1,108 @@
+import io
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+TRACK_FORMAT_VERSION = 1
+# degrees -> garmin semicircles, the int32 position unit of fit files
+SEMICIRCLES = 2 ** 31 / 180
+# point field -> packed dtype, timestamps are stored separately as int64 millisecond deltas
+CHANNELS = {
+    'latitude': np.int32,
+    'longitude': np.int32,
+    'lap_number': np.uint16,
+    'altitude': np.float32,
+    'heart_rate': np.uint8,
+    'cadence': np.uint16,
+    'speed': np.float32,
+}
+COLUMNS = ['latitude', 'longitude', 'lap_number', 'altitude', 'timestamp', 'heart_rate', 'cadence', 'speed']
+
+
+def to_channel(series: pd.Series, field: str) -> np.ndarray:
+    """Point column to its packed channel, missing values are NaN floats until packing"""
+    if field == 'timestamp':
+        timestamps = pd.to_datetime(series, utc=True)
+        values = timestamps.dt.tz_localize(None).to_numpy(dtype='datetime64[ms]').astype(np.int64).astype(float)
+        values[timestamps.isna().to_numpy()] = np.nan
+        return values
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    if field in ('latitude', 'longitude'):
+        values = values * SEMICIRCLES
+    return values
+
+
+def pack(channels: Dict[str, np.ndarray]) -> bytes:
+    """Pack channel arrays into a compressed npz payload
+    each channel is stored in its small dtype, missing values as a bit mask (only if there are any),
+    with gaps filled by the previous value so timestamp deltas stay small. Channels without values are left out.
+    """
+    size = len(next(iter(channels.values()))) if channels else 0
+    arrays = {'version': np.array([TRACK_FORMAT_VERSION]), 'size': np.array([size])}
+    for field, values in channels.items():
+        missing = np.isnan(values)
+        if missing.all():
+            continue
+        if missing.any():
+            arrays[field + '_mask'] = np.packbits(missing)
+            values = pd.Series(values).ffill().bfill().to_numpy()
+        if field == 'timestamp':
+            values = values.astype(np.int64)
+            arrays['timestamp_start'] = values[:1]
+            arrays['timestamp'] = np.diff(values)
+        else:
+            dtype = CHANNELS[field]
+            if np.issubdtype(dtype, np.integer):
+                limits = np.iinfo(dtype)
+                values = np.clip(np.round(values), limits.min, limits.max)
+            arrays[field] = values.astype(dtype)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def unpack(data: bytes) -> pd.DataFrame:
+    """Unpack a track payload to a points dataframe, columns are Point field names"""
+    with np.load(io.BytesIO(bytes(data))) as arrays:
+        size = int(arrays['size'][0])
+        df = pd.DataFrame(index=range(size))
+        for field in COLUMNS:
+            if field == 'timestamp' and 'timestamp_start' in arrays:
+                values = np.concatenate([arrays['timestamp_start'], arrays['timestamp_start'][0]
+                                         + np.cumsum(arrays['timestamp'])]).astype('datetime64[ms]')
+                values = pd.Series(pd.to_datetime(values, utc=True))
+            elif field in arrays:
+                values = pd.Series(arrays[field].astype(float))
+                if field in ('latitude', 'longitude'):
+                    values = values / SEMICIRCLES
+            else:
+                df[field] = pd.Series([None] * size, dtype=float if field != 'timestamp' else 'datetime64[ns, UTC]')
+                continue
+            mask = field + '_mask'
+            if mask in arrays:
+                missing = np.unpackbits(arrays[mask], count=size).astype(bool)
+                values = values.mask(missing)
+            df[field] = values
+    return df
+
+
+class TrackWriter:
+    """Collects point dataframes (columns are Point field names) chunk by chunk as float channels"""
+
+    def __init__(self):
+        self.__chunks: Dict[str, List[np.ndarray]] = {field: [] for field in COLUMNS}
+        self.size = 0
+
+    def add(self, df: pd.DataFrame):
+        self.size += len(df)
+        for field in COLUMNS:
+            if field in df.columns:
+                values = to_channel(df[field], field)
+            else:
+                values = np.full(len(df), np.nan)
+            self.__chunks[field].append(values)
+
+    def pack(self) -> bytes:
+        """Packed payload of all added points"""
+        return pack({field: np.concatenate(chunks) if chunks else np.empty(0) for field, chunks in self.__chunks.items()})
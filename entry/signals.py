@@ -1,28 +1,61 @@
+from django.core.exceptions import ValidationError
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.utils.translation import ugettext_lazy as _
 
-from entry.models import Entry
-from entry.services.entry_csv import EntryCsv
-from entry.services.entry_fit import EntryFit
-from entry.services.entry_gpx import EntryGpx
-from entry.services.entry_tcx import EntryTcx
+from entry.cache import invalidate_entry
+from entry.models import Entry, ImportJob
+from entry.tasks import enqueue_entry, is_supported
+
+# statuses of the import of an earlier entry of a file that new uploads of it are linked to, a failed import (or an
+# entry without a job, e.g. left by a stopped bulk import) has no data to share
+LINKED_STATUSES = (ImportJob.STATUS_PENDING, ImportJob.STATUS_RUNNING, ImportJob.STATUS_DONE)
 
 
 @receiver(post_save, sender=Entry)
 def entry_post_save(sender, instance, created, **kwargs):
     if created:
-        file_extension = instance.file.name.split('.')[-1]
-        if file_extension == 'csv':
-            entry_csv = EntryCsv(instance)
-            entry_csv.run()
-        elif file_extension == 'fit':
-            entry_fit = EntryFit(instance)
-            entry_fit.run()
-        elif file_extension == 'gpx':
-            entry_gpx = EntryGpx(instance)
-            entry_gpx.run()
-        elif file_extension == 'tcx':
-            entry_tcx = EntryTcx(instance)
-            entry_tcx.run()
-        else:
-            raise Exception('File extension not supported')
+        if not is_supported(instance):
+            # forms reject these files with validate_entry_file_extension, entries created in code get here
+            raise ValidationError(_('File extension not supported'), code='invalid_extension')
+        source = instance.sha256 and Entry.objects.filter(
+            customer_id=instance.customer_id, sha256=instance.sha256, source__isnull=True,
+            job__status__in=LINKED_STATUSES,
+        ).exclude(pk=instance.pk).order_by('created').first()
+        if source:
+            # the same file was already imported for the customer, link to its data instead of importing it again
+            instance.source = source
+            Entry.objects.filter(pk=instance.pk).update(source=source)
+            return
+        if getattr(instance, 'skip_enqueue', False):
+            # the creator processes the entry itself, e.g. bulk imports
+            return
+        ImportJob.objects.create(entry=instance)
+        # processing happens in a worker, only after the entry row is committed and visible to it
+        transaction.on_commit(lambda: enqueue_entry(instance))
+
+
+@receiver(pre_delete, sender=Entry)
+def entry_pre_delete(sender, instance, **kwargs):
+    # duplicates lose their source with the entry, they are linked again once it is deleted
+    instance.duplicate_ids = list(instance.duplicates.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Entry)
+def entry_post_delete(sender, instance, **kwargs):
+    invalidate_entry(instance.pk)
+    promote_duplicates(getattr(instance, 'duplicate_ids', ()))
+
+
+def promote_duplicates(duplicate_ids):
+    """Import the earliest duplicate of a deleted entry, and link the other duplicates to it"""
+    duplicates = list(Entry.objects.filter(pk__in=duplicate_ids).order_by('created'))
+    if not duplicates:
+        return
+    source = duplicates[0]
+    Entry.objects.filter(pk__in=[duplicate.pk for duplicate in duplicates[1:]]).update(source=source)
+    for duplicate in duplicates:
+        invalidate_entry(duplicate.pk)
+    ImportJob.objects.get_or_create(entry=source)
+    transaction.on_commit(lambda: enqueue_entry(source))
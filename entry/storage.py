@@ -0,0 +1,27 @@
+import hashlib
+
+from django.core.files.storage import FileSystemStorage
+
+
+def file_sha256(file) -> str:
+    """Content hash of a django File, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """Content-addressed file system storage
+    names are derived from the content hash, so a name that already exists holds the same content
+    and is reused instead of written again
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        return super(HashedFileSystemStorage, self)._save(name, content)
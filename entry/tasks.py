@@ -0,0 +1,136 @@
+import logging
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.db import connection, DatabaseError, InterfaceError, OperationalError
+from django.utils import timezone
+
+from entry.archives import ARCHIVE_EXTENSIONS, create_member_entries, get_name_extension
+from entry.formats import detect_format, get_extensions
+from entry.locks import entry_lock
+from entry.models import Entry, ImportJob
+from entry.partitions import ensure_partitions
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_extension(entry: Entry) -> str:
+    """Get lower-cased file extension of the entry file, or of its archive member, ignoring a `.gz` suffix"""
+    return get_name_extension(entry.member or entry.file.name)
+
+
+def is_supported(entry: Entry) -> bool:
+    extension = get_file_extension(entry)
+    return extension in get_extensions() or extension in ARCHIVE_EXTENSIONS
+
+
+def get_entry_queue(entry: Entry) -> str:
+    """Each file format is processed in its own queue"""
+    return 'entry.{}'.format(get_file_extension(entry))
+
+
+def enqueue_entry(entry: Entry):
+    """Send entry to its format queue, keyed by entry id"""
+    process_entry.apply_async(args=(entry.id,), queue=get_entry_queue(entry))
+
+
+@shared_task(
+    bind=True,
+    autoretry_for=(OperationalError, InterfaceError),
+    retry_backoff=True,
+    retry_jitter=True,
+    max_retries=settings.ENTRY_TASK_MAX_RETRIES,
+)
+def process_entry(self, entry_id: int):
+    """Parse entry file and store its points and laps in db
+    rows are committed in chunks, each with a checkpoint of the entry import job, so a retried (or sent again) task
+    resumes the import after the last committed rows
+    """
+    try:
+        entry = Entry.objects.select_related('customer').get(pk=entry_id)
+    except Entry.DoesNotExist:
+        logger.warning('Entry %s does not exist anymore, skipped', entry_id)
+        return
+
+    import_entry(entry)
+
+
+def import_entry(entry: Entry) -> bool:
+    """Import the entry under its advisory lock, resuming its job
+    returns False if another worker holds the lock
+    """
+    with entry_lock(entry.pk) as locked:
+        if not locked:
+            logger.info('Entry %s is imported by another worker, skipped', entry.pk)
+            return False
+        job, _ = ImportJob.objects.get_or_create(entry=entry)
+        if job.status == ImportJob.STATUS_DONE:
+            return True
+        if job.rows_committed:
+            logger.info('Entry %s import resumes after %s points and %s laps',
+                        entry.pk, job.points_committed, job.laps_committed)
+        job.start(settings.ENTRY_CHUNK_SIZE)
+        try:
+            if get_file_extension(entry) in ARCHIVE_EXTENSIONS:
+                process_archive(entry)
+                job.finish()
+            else:
+                # the content is checked before the parser is loaded, a file of another format is rejected here
+                entry_format = detect_format(entry)
+                service = entry_format.get_service()(entry, format_name=entry_format.name, chunk_size=job.chunk_size)
+                service.run(job)
+        except Exception as e:
+            save_failure(job, e)
+            raise
+    return True
+
+
+def save_failure(job: ImportJob, error: Exception):
+    try:
+        job.fail(error)
+    except DatabaseError:
+        logger.warning('Failure of entry %s import could not be saved', job.entry_id, exc_info=True)
+
+
+def process_archive(entry: Entry):
+    """Import the members of an archive entry as one batch
+    each member is imported as an entry with its own job, so a broken member does not stop the others,
+    and a retried archive skips members already imported
+    """
+    for child, created in create_member_entries(entry, get_extensions()):
+        if child.source_id:
+            continue
+        try:
+            import_entry(child)
+        except (OperationalError, InterfaceError):
+            raise
+        except Exception:
+            logger.exception('Member %s of archive %s could not be imported', child.member, entry.file.name)
+
+
+@shared_task
+def resume_import_jobs():
+    """Send entries of import jobs that stopped making progress to their queue again
+    e.g. their worker was killed or restarted, or the task was lost. A job still processed by a worker is skipped by
+    its lock, a job that did not finish in ENTRY_IMPORT_JOB_MAX_ATTEMPTS attempts is failed.
+    """
+    stale = ImportJob.objects.filter(
+        status__in=(ImportJob.STATUS_PENDING, ImportJob.STATUS_RUNNING),
+        modified__lt=timezone.now() - timedelta(seconds=settings.ENTRY_IMPORT_JOB_STALE_AFTER),
+    ).select_related('entry')
+    for job in stale.iterator():
+        if job.attempts >= settings.ENTRY_IMPORT_JOB_MAX_ATTEMPTS:
+            save_failure(job, RuntimeError('Import stopped {} times'.format(job.attempts)))
+            continue
+        logger.info('Entry %s import stopped at %s rows, sent again', job.entry_id, job.rows_committed)
+        # touched, so the job is sent again only if it is still stale after another period
+        ImportJob.objects.filter(pk=job.pk).update(modified=timezone.now())
+        enqueue_entry(job.entry)
+
+
+@shared_task
+def create_point_partitions():
+    """Keep monthly point partitions created ahead of time"""
+    if connection.vendor == 'postgresql':
+        ensure_partitions(settings.ENTRY_POINT_PARTITIONS_AHEAD)
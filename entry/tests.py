@@ -1,3 +1,1342 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import zipfile
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import F, Q, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+import numpy as np
+import pandas as pd
+
+from entry.admin import PointAdmin
+from entry.archives import get_name_extension
+from entry.benchmarks.generators import START_POSITION, START_TIME, generate_file
+from entry.benchmarks.runner import STAGES, benchmark_file, compare
+from entry.cache import invalidate_entry, pack as pack_value, unpack as unpack_value
+from entry.changelists import get_keyset_condition
+from entry.locks import LOCK_NAMESPACE, entry_lock
+from entry.metrics import EntryMetrics, render_histogram
+from entry.partitions import get_partition_months, is_partitioned, partition_table
+from entry.models import (
+    Entry, EntryMetric, EntrySummary, ImportJob, Point, Lap, TrackBlob, validate_entry_file_extension, validate_entry_file_format,
+)
+from entry.services.entry_base import MalformedFile
+from entry.services.entry_cache import FrameCache, pyarrow
+from entry.services.entry_copy import ON_CONFLICT_IGNORE, ON_CONFLICT_UPDATE, CsvStream, copy_dataframe_to_db
+from entry.exports import POINT_FIELDS
+from entry.formats import UnsupportedFormat, get_formats, get_xml_root, sniff_format
+from entry.services.entry_kml import EntryKml
+from entry.services.entry_polyline import decode_polyline, encode_polyline, get_level, simplify
+from entry.services.entry_summary import SummaryAccumulator
+from entry.services.entry_track import TrackWriter, unpack
+from entry.tasks import import_entry, process_entry
+from entry.uploads import EntryFileUploadHandler
+
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@skipUnless(connection.vendor == 'postgresql', 'query plans are checked on PostgreSQL')
+class QueryPlanTestCase(TestCase):
+    """Common admin and per-entry queries use the point and lap indexes
+    tables are tiny in tests, so sequential scans are disabled to see which index the planner picks
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='runner')
+        cls.entry = Entry.objects.create(customer=cls.user, file='entry/files/run.fit')
+        start = datetime(2020, 10, 10, tzinfo=timezone.utc)
+        Point.objects.bulk_create(
+            Point(user=cls.user, entry=cls.entry, lap_number=1 + i // 50, timestamp=start + timedelta(seconds=i))
+            for i in range(100)
+        )
+        Lap.objects.bulk_create(
+            Lap(user=cls.user, entry=cls.entry, number=i, start_time=start + timedelta(minutes=i))
+            for i in range(1, 3)
+        )
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+
+    @staticmethod
+    def index_names(index: str) -> set:
+        """Name of the index and of its partition indexes"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = %s::regclass', [index])
+            return {index} | {name for (name,) in cursor.fetchall()}
+
+    def assertUsesIndex(self, queryset, index: str):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in self.index_names(index)), plan)
+
+    def test_entry_points(self):
+        queryset = Point.objects.filter(entry=self.entry).order_by('lap_number', 'timestamp')
+        self.assertUsesIndex(queryset, 'entry_point_entry_lap_ts_idx')
+
+    def test_entry_lap_points(self):
+        queryset = Point.objects.filter(entry=self.entry, lap_number=2)
+        self.assertUsesIndex(queryset, 'entry_point_entry_lap_ts_idx')
+
+    def test_timestamp_filter(self):
+        since = datetime(2020, 10, 10, 0, 1, tzinfo=timezone.utc)
+        queryset = Point.objects.filter(timestamp__gte=since, timestamp__lt=since + timedelta(days=1))
+        with connection.cursor() as cursor:
+            # BRIN is only read through bitmap scans
+            cursor.execute('SET enable_indexscan = off')
+        # the (timestamp, id) B-tree of the admin keyset pages serves ranges as well, the planner picks either
+        plan = queryset.explain()
+        names = self.index_names('entry_point_timestamp_brin') | self.index_names('entry_point_timestamp_id_idx')
+        self.assertTrue(any(name in plan for name in names), plan)
+
+    def test_keyset_page(self):
+        point = Point.objects.order_by('timestamp')[50]
+        queryset = Point.objects.filter(get_keyset_condition('timestamp', point.timestamp, point.pk)).order_by(
+            F('timestamp').desc(nulls_first=True), '-pk')[:10]
+        self.assertUsesIndex(queryset, 'entry_point_timestamp_id_idx')
+
+    def test_user_laps(self):
+        queryset = Lap.objects.filter(user=self.user).order_by('-start_time')
+        self.assertUsesIndex(queryset, 'entry_lap_user_start_idx')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'partitioning needs PostgreSQL')
+class PartitionTableTestCase(TransactionTestCase):
+    """Conversion of a table in use, outside a transaction as indexes are built concurrently"""
+    table = 'entry_partition_test'
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE {0}_ref (id integer PRIMARY KEY); INSERT INTO {0}_ref VALUES (1), (2)'.format(
+                self.table))
+            cursor.execute(
+                'CREATE TABLE {0} (id serial PRIMARY KEY, ref_id integer NOT NULL REFERENCES {0}_ref '
+                'DEFERRABLE INITIALLY DEFERRED, "timestamp" timestamptz, value integer, UNIQUE (ref_id, "timestamp"))'
+                .format(self.table))
+            cursor.execute('CREATE INDEX {0}_value_idx ON {0} (value)'.format(self.table))
+            # ids 5, 15, ... are missing
+            cursor.execute(
+                'INSERT INTO {} SELECT i, 1, %s::timestamptz + i * interval \'1 hour\', i '
+                'FROM generate_series(1, 250) i WHERE i %% 10 <> 5'.format(self.table),
+                [datetime(2020, 1, 1, tzinfo=timezone.utc)])
+            cursor.execute("SELECT setval('{}_id_seq', 250)".format(self.table))
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {0}, {0}_old, {0}_partitioned, {0}_changes, {0}_ref CASCADE'.format(
+                self.table))
+            cursor.execute('DROP FUNCTION IF EXISTS {}_log_change()'.format(self.table))
+
+    def get_rows(self, table: str) -> dict:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id, value FROM {} ORDER BY id'.format(table))
+            return dict(cursor.fetchall())
+
+    def test_rows_changed_during_copy(self):
+        table = self.table
+
+        class Output:
+            @staticmethod
+            def write(message):
+                with connection.cursor() as cursor:
+                    if message.startswith('Copied rows up to id 250 '):
+                        # after the last batch: a new row above the max id, a row of an id allocated before its
+                        # batch was copied but committed after it, a row without timestamp, a deleted row, an
+                        # updated row and a row taking the timestamp of a deleted one
+                        cursor.execute('INSERT INTO {} (ref_id, "timestamp", value) VALUES (1, now(), 0)'.format(table))
+                        cursor.execute('INSERT INTO {} VALUES (15, 1, now(), 0), (25, 1, NULL, 0)'.format(table))
+                        cursor.execute('DELETE FROM {} WHERE id IN (4, 8)'.format(table))
+                        cursor.execute('UPDATE {} SET value = -6 WHERE id = 6'.format(table))
+                        cursor.execute("UPDATE {} SET \"timestamp\" = %s::timestamptz + interval '8 hours' "
+                                       "WHERE id = 9".format(table), [datetime(2020, 1, 1, tzinfo=timezone.utc)])
+                    elif message.startswith('Built indexes'):
+                        cursor.execute('UPDATE {} SET value = -10 WHERE id = 10'.format(table))
+                    elif message.startswith('Validated constraints'):
+                        cursor.execute('DELETE FROM {} WHERE id = 11'.format(table))
+                        cursor.execute('INSERT INTO {} VALUES (252, 2, now(), 0)'.format(table))
+
+        expected = self.get_rows(table)
+        for id in (4, 8, 11):
+            expected.pop(id)
+        expected.update({6: -6, 10: -10, 15: 0, 25: 0, 251: 0, 252: 0})
+        with CaptureQueriesContext(connection) as queries:
+            partition_table(months_ahead=0, batch_size=100, table=table, stdout=Output())
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor, table))
+            self.assertEqual(self.get_rows(table), expected)
+            self.assertEqual(self.get_rows(table + '_old'), expected)
+            self.assertEqual(list(self.get_rows(table + '_default')), [25])
+
+            cursor.execute("SELECT conname, convalidated FROM pg_constraint WHERE conrelid = %s::regclass", [table])
+            self.assertEqual(dict(cursor.fetchall()), {
+                '{}_ref_id_fkey'.format(table): True, '{}_ref_id_timestamp_key'.format(table): True})
+            cursor.execute("SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass", [table])
+            self.assertEqual(sorted(name for (name,) in cursor.fetchall()), [
+                '{}_id_idx'.format(table), '{}_ref_id_timestamp_key'.format(table), '{}_value_idx'.format(table)])
+            cursor.execute("SELECT to_regclass(%s)", [table + '_changes'])
+            self.assertIsNone(cursor.fetchone()[0])
+
+            # only the changes since the last replay are applied under the lock
+            statements = [query['sql'] for query in queries.captured_queries]
+            locked = statements.index('LOCK TABLE "{}" IN ACCESS EXCLUSIVE MODE'.format(table))
+            for sql in statements[locked:]:
+                self.assertFalse(any(word in sql for word in ('CREATE INDEX', 'ADD CONSTRAINT', 'VALIDATE')), sql)
+
+            # nothing but the sequence keeps ids unique
+            cursor.execute('INSERT INTO {} (id, ref_id, "timestamp") VALUES (1, 2, now())'.format(table))
+            cursor.execute('SELECT COUNT(*) FROM {} WHERE id = 1'.format(table))
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'partitioning needs PostgreSQL')
+class PartitionTestCase(TestCase):
+
+    def test_import_months(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(MEDIA_ROOT=directory.name, ENTRY_FRAME_CACHE_DIR=''):
+            # points of the generated files are of 2020-10
+            path = generate_file('gpx', 100, directory.name)
+            entry = Entry(customer=get_user_model().objects.create(username='partitions'), file=os.path.basename(path))
+            entry.skip_enqueue = True
+            entry.save()
+            get_formats()['gpx'].get_service()(entry).run()
+        with connection.cursor() as cursor:
+            self.assertIn(datetime(2020, 10, 1, tzinfo=timezone.utc), get_partition_months(cursor))
+            cursor.execute('SELECT COUNT(*) FROM entry_point_y2020m10 WHERE entry_id = %s', [entry.pk])
+            self.assertEqual(cursor.fetchone()[0], 100)
+
+
+class SummaryAccumulatorTestCase(SimpleTestCase):
+    """Summary values do not depend on how points are chunked"""
+
+    def setUp(self):
+        self.points = pd.DataFrame({
+            'latitude': [0.0, 0.0, None, 0.0, 0.001],
+            'longitude': [0.0, 0.001, None, 0.002, 0.002],
+            'altitude': [10.0, 12.0, 11.0, 15.0, 14.0],
+            'timestamp': pd.date_range('2020-10-10', periods=5, freq='10s', tz='UTC'),
+            'heart_rate': [100.0, 110.0, None, 130.0, 140.0],
+        })
+
+    def get_values(self, *chunks) -> dict:
+        summary = SummaryAccumulator()
+        for chunk in chunks:
+            summary.add(Point, chunk)
+        return summary.get_values()
+
+    def test_points(self):
+        values = self.get_values(self.points)
+        self.assertAlmostEqual(values['total_distance'], 3 * 111.195, delta=0.1)
+        self.assertEqual(values['elevation_gain'], 6.0)
+        self.assertEqual(values['duration'], 40.0)
+        self.assertEqual(values['avg_heart_rate'], 120.0)
+        self.assertEqual(values['max_heart_rate'], 140.0)
+        self.assertEqual(values['max_latitude'], 0.001)
+        self.assertEqual(values['points_count'], 5)
+
+    def test_chunks(self):
+        self.assertEqual(self.get_values(self.points.iloc[:2], self.points.iloc[2:4], self.points.iloc[4:]),
+                         self.get_values(self.points))
+
+    def test_dataset_formats(self):
+        """Summaries of the same activity agree whatever its format"""
+        dataset = os.path.join(settings.BASE_DIR, 'docs', 'dataset', 'TrailRun20201010112721')
+        distances = {}
+        for extension in ('csv', 'fit'):
+            service = get_formats()[extension].get_service()(None)
+            summary = SummaryAccumulator()
+            for model, df in service.get_model_dataframes('{}.{}'.format(dataset, extension)):
+                summary.add(model, service.get_summary_dataframe(df, model))
+            distances[extension] = summary.get_values()['total_distance']
+        self.assertAlmostEqual(distances['fit'], 21943.0)
+        self.assertAlmostEqual(distances['csv'], distances['fit'], delta=0.001 * distances['fit'])
+
+    def test_laps(self):
+        summary = SummaryAccumulator()
+        summary.add(Lap, pd.DataFrame({
+            'total_distance': [1000.0, 500.0], 'total_elapsed_time': [300.0, 100.0],
+            'avg_heart_rate': [120.0, 160.0], 'max_heart_rate': [150.0, 170.0],
+        }))
+        values = summary.get_values()
+        self.assertEqual(values['total_distance'], 1500.0)
+        self.assertEqual(values['duration'], 400.0)
+        self.assertEqual(values['avg_heart_rate'], 130.0)
+        self.assertEqual(values['max_heart_rate'], 170.0)
+
+
+class PolylineTestCase(SimpleTestCase):
+
+    def test_encode(self):
+        positions = np.array([(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)])
+        polyline = encode_polyline(positions)
+        self.assertEqual(polyline, '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        np.testing.assert_allclose(decode_polyline(polyline), positions)
+
+    def test_simplify(self):
+        # about 1 m of noise along a 1 km straight line, with a 100 m detour in the middle
+        latitudes = np.linspace(0, 0.009, 101)
+        longitudes = np.where(np.arange(101) == 50, 0.0009, np.tile([0.0, 0.00001], 51)[:101])
+        simplified = simplify(np.column_stack([latitudes, longitudes]), 5.0)
+        self.assertEqual(simplified[:, 0].tolist(), [0.0, latitudes[49], latitudes[50], latitudes[51], 0.009])
+
+    def test_level(self):
+        levels = {'0': 'a', '11': 'b', '14': 'c'}
+        self.assertEqual(get_level(levels, 3), (0, 'a'))
+        self.assertEqual(get_level(levels, 12), (11, 'b'))
+        self.assertEqual(get_level(levels, 18), (14, 'c'))
+
+
+class TrackTestCase(SimpleTestCase):
+    """Points survive packing, within the precision of their packed types"""
+
+    def test_round_trip(self):
+        points = pd.DataFrame({
+            'latitude': [37.2469829, None, 37.2470012],
+            'longitude': [-122.2232619, None, -122.2232012],
+            'lap_number': [1, 1, 2],
+            'altitude': [100.5, 101.0, None],
+            'timestamp': pd.to_datetime(['2020-10-10 18:27:24.250', None, '2020-10-10 18:27:26'], utc=True),
+            'heart_rate': [None, None, None],
+            'cadence': [80.0, 81.0, 82.0],
+        })
+        track = TrackWriter()
+        track.add(points.iloc[:2])
+        track.add(points.iloc[2:])
+        df = unpack(track.pack())
+
+        self.assertEqual(track.size, 3)
+        np.testing.assert_allclose(df['latitude'], points['latitude'], atol=1e-7)
+        np.testing.assert_allclose(df['longitude'], points['longitude'], atol=1e-7)
+        np.testing.assert_allclose(df['altitude'], points['altitude'])
+        pd.testing.assert_series_equal(df['timestamp'], points['timestamp'], check_dtype=False)
+        self.assertTrue(df['heart_rate'].isna().all())
+        self.assertTrue(df['speed'].isna().all())
+        self.assertEqual(df['cadence'].tolist(), [80.0, 81.0, 82.0])
+        self.assertEqual(df['lap_number'].tolist(), [1.0, 1.0, 2.0])
+
+
+@skipIf(pyarrow is None, 'the frame cache needs pyarrow')
+class FrameCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = FrameCache(directory.name, max_size=10 ** 9)
+        self.frames = [
+            (Point, pd.DataFrame({'timestamp': pd.date_range('2020-10-10', periods=3, tz='UTC'), 'lap': [1, 1, 2]})),
+            (Lap, pd.DataFrame({'number': [1, 2], 'total_time': pd.to_timedelta([60, 30], unit='s')})),
+        ]
+
+    def store(self, key: str):
+        for _ in self.cache.write(key, self.frames):
+            pass
+
+    def test_read(self):
+        self.assertIsNone(self.cache.read('a'))
+        self.store('a')
+        for (model, df), (cached_model, cached_df) in zip(self.frames, self.cache.read('a')):
+            self.assertIs(cached_model, model)
+            pd.testing.assert_frame_equal(cached_df, df)
+
+    def test_incomplete_write(self):
+        frames = self.cache.write('a', self.frames)
+        next(frames)
+        frames.close()
+        self.assertIsNone(self.cache.read('a'))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+    def test_evict_least_recently_used(self):
+        for age, key in enumerate(('c', 'b', 'a'), start=1):
+            self.store(key)
+            os.utime(self.cache.get_path(key), (time.time() - age, time.time() - age))
+        self.cache.read('a')
+        self.cache.max_size = self.cache.get_size(self.cache.get_path('a')) * 2
+        self.cache.evict()
+        self.assertEqual(sorted(os.listdir(self.cache.directory)), ['a', 'c'])
+
+
+class ArchiveNameTestCase(SimpleTestCase):
+
+    def test_extension(self):
+        self.assertEqual(get_name_extension('Run.FIT'), 'fit')
+        self.assertEqual(get_name_extension('activities/1234.fit.gz'), 'fit')
+        self.assertEqual(get_name_extension('export.zip'), 'zip')
+        self.assertEqual(get_name_extension('dump.gz'), 'gz')
+        self.assertEqual(get_name_extension('v1.2/run.gpx'), 'gpx')
+
+    def test_validate_extension(self):
+        for name in ('run.fit', 'Run.GPX', 'export.zip', 'run.fit.gz', 'run.tcx.gz'):
+            validate_entry_file_extension(SimpleUploadedFile(name, b''))
+        for name, extension in (('dump.gz', 'gz'), ('notes.txt.gz', 'txt.gz'), ('export.zip.gz', 'zip.gz'),
+                                ('notes.txt', 'txt')):
+            with self.assertRaises(ValidationError) as context:
+                validate_entry_file_extension(SimpleUploadedFile(name, b''))
+            self.assertEqual(context.exception.params['extension'], extension)
+
+
+class EntryKmlTestCase(SimpleTestCase):
+    kml = b"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2"><Document>
+  <Placemark><Point><coordinates>1,2,3</coordinates></Point></Placemark>
+  <Placemark><gx:Track>
+    <when>2020-10-10T18:27:23Z</when><when>2020-10-10T18:27:24Z</when><when>2020-10-10T18:27:25Z</when>
+    <gx:coord>-122.1 37.1 10</gx:coord><gx:coord>-122.2 37.2 11</gx:coord><gx:coord>-122.3 37.3 12</gx:coord>
+  </gx:Track></Placemark>
+  <Placemark><LineString><coordinates>-122.4,37.4,13 -122.5,37.5</coordinates></LineString></Placemark>
+</Document></kml>"""
+
+    def get_points(self, source) -> pd.DataFrame:
+        frames = list(EntryKml(None, chunk_size=2).get_model_dataframes(source))
+        self.assertEqual({model for model, df in frames}, {Point})
+        self.assertEqual([len(df) for model, df in frames], [2, 2, 1])
+        return pd.concat([df for model, df in frames], ignore_index=True)
+
+    def test_kml(self):
+        df = self.get_points(io.BytesIO(self.kml))
+        self.assertEqual(df['latitude'].tolist(), [37.1, 37.2, 37.3, 37.4, 37.5])
+        self.assertEqual(df['longitude'].tolist(), [-122.1, -122.2, -122.3, -122.4, -122.5])
+        self.assertEqual(df['track'].tolist(), [1, 1, 1, 2, 2])
+        self.assertEqual(df['time'].iloc[2], pd.Timestamp('2020-10-10T18:27:25Z'))
+        self.assertTrue(df['time'].iloc[3:].isna().all())
+        self.assertTrue(np.isnan(df['elevation'].iloc[4]))
+
+    def test_placemark_times(self):
+        kml = b"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2"><Document>
+  <Placemark><TimeStamp><when>2020-10-10</when></TimeStamp><gx:Track>
+    <when>2020-10-10T18:27:23Z</when><gx:coord>-122.1 37.1 10</gx:coord>
+  </gx:Track><TimeSpan><begin>2020-10-10</begin><end>2020-10-11</end></TimeSpan></Placemark>
+  <Placemark><gx:Track>
+    <TimeStamp><when>2020-10-11</when></TimeStamp>
+    <when>2020-10-10T18:27:24Z</when><when>2020-10-10T18:27:25Z</when>
+    <gx:coord>-122.2 37.2 11</gx:coord><gx:coord>-122.3 37.3 12</gx:coord>
+  </gx:Track></Placemark>
+  <Placemark><TimeSpan><when>2020-10-12</when></TimeSpan><Point><coordinates>1,2,3</coordinates></Point></Placemark>
+</Document></kml>"""
+        frames = list(EntryKml(None).get_model_dataframes(io.BytesIO(kml)))
+        df = pd.concat([df for model, df in frames], ignore_index=True)
+        self.assertEqual(df['latitude'].tolist(), [37.1, 37.2, 37.3])
+        self.assertEqual(df['time'].tolist(), [pd.Timestamp('2020-10-10T18:27:{}Z'.format(second))
+                                               for second in (23, 24, 25)])
+        self.assertEqual(df['track'].tolist(), [1, 2, 2])
+
+    def test_kmz(self):
+        kmz = io.BytesIO()
+        with zipfile.ZipFile(kmz, 'w') as archive:
+            archive.writestr('files/icon.png', b'')
+            archive.writestr('doc.kml', self.kml)
+        self.assertEqual(len(self.get_points(kmz)), 5)
+
+
+class FormatTestCase(SimpleTestCase):
+    dataset = os.path.join(settings.BASE_DIR, 'docs', 'dataset', 'TrailRun20201010112721')
+
+    def get_head(self, extension: str) -> bytes:
+        with open('{}.{}'.format(self.dataset, extension), 'rb') as f:
+            return f.read(4096)
+
+    def test_dataset(self):
+        for extension in ('csv', 'fit', 'gpx'):
+            self.assertEqual(sniff_format(extension, self.get_head(extension)).name, extension)
+
+    def test_content_over_extension(self):
+        self.assertEqual(sniff_format('csv', self.get_head('gpx')).name, 'gpx')
+        self.assertEqual(sniff_format('gpx', self.get_head('fit')).name, 'fit')
+
+    def test_unsupported(self):
+        for head in (b'', b'\x00\x01\x02binary', b'<?xml version="1.0"?><html></html>'):
+            with self.assertRaises(UnsupportedFormat):
+                sniff_format('fit', head)
+
+    def test_xml_root(self):
+        head = (b'\xef\xbb\xbf<?xml version="1.0"?>\n<!-- export -->\n<!DOCTYPE x>\n'
+                b'<ns:TrainingCenterDatabase xmlns:ns="">')
+        self.assertEqual(get_xml_root(head), 'TrainingCenterDatabase')
+        self.assertIsNone(get_xml_root(b'Split,Time'))
+
+
+class ParserTestCase(SimpleTestCase):
+    """Streaming parsers against the whole file parsers they replaced, value by value"""
+    dataset = FormatTestCase.dataset
+
+    def get_dataframes(self, extension: str, file_path: str, chunk_size: int = 1000) -> dict:
+        service = get_formats()[extension].get_service()(None, chunk_size=chunk_size)
+        frames = list(service.get_model_dataframes(file_path))
+        return {model: pd.concat([df for frame_model, df in frames if frame_model is model], ignore_index=True)
+                for model in {model for model, df in frames}}
+
+    def assertFramesEqual(self, df: pd.DataFrame, expected: pd.DataFrame, times=()):
+        for column in times:
+            expected[column] = pd.to_datetime(expected[column], utc=True)
+        pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+    @staticmethod
+    def read_fit(file_path: str) -> (pd.DataFrame, pd.DataFrame):
+        """Points and laps of the file as read by fitdecode in one pass"""
+        import fitdecode
+
+        points, laps, lap_no = [], [], 1
+        with fitdecode.FitReader(file_path) as fit_file:
+            for frame in fit_file:
+                if not isinstance(frame, fitdecode.records.FitDataMessage):
+                    continue
+                if frame.name == 'record' and frame.has_field('position_lat') and frame.has_field('position_long'):
+                    point = {'lap': lap_no}
+                    if frame.get_value('position_lat') and frame.get_value('position_long'):
+                        point['latitude'] = frame.get_value('position_lat') / ((2 ** 32) / 360)
+                        point['longitude'] = frame.get_value('position_long') / ((2 ** 32) / 360)
+                    for field in ('altitude', 'timestamp', 'heart_rate', 'cadence', 'speed'):
+                        if frame.has_field(field):
+                            point[field] = frame.get_value(field)
+                    points.append(point)
+                elif frame.name == 'lap':
+                    lap = {field: frame.get_value(field) if frame.has_field(field) else None
+                           for field in ('start_time', 'total_distance', 'total_elapsed_time', 'max_speed',
+                                         'max_heart_rate', 'avg_heart_rate')}
+                    lap['number'] = lap_no
+                    laps.append(lap)
+                    lap_no += 1
+        return (pd.DataFrame(points, columns=['latitude', 'longitude', 'lap', 'altitude', 'timestamp', 'heart_rate',
+                                              'cadence', 'speed']),
+                pd.DataFrame(laps, columns=['number', 'start_time', 'total_distance', 'total_elapsed_time',
+                                            'max_speed', 'max_heart_rate', 'avg_heart_rate']))
+
+    @staticmethod
+    def read_tcx(file_path: str) -> (pd.DataFrame, pd.DataFrame):
+        """Points and laps of the first activity of the file as read from the whole lxml tree"""
+        import dateutil.parser as dp
+        import lxml.etree
+
+        ns = {'ns': 'http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2',
+              'ns3': 'http://www.garmin.com/xmlschemas/ActivityExtension/v2'}
+        activity = lxml.etree.parse(file_path).getroot().find('ns:Activities', ns)[0]
+        points, laps = [], []
+        for lap_no, lap in enumerate(activity.findall('ns:Lap', ns), 1):
+            laps.append({
+                'number': lap_no, 'start_time': dp.parse(lap.attrib['StartTime']),
+                'distance': float(lap.find('ns:DistanceMeters', ns).text),
+                'total_time': timedelta(seconds=float(lap.find('ns:TotalTimeSeconds', ns).text)),
+                'max_speed': float(lap.find('ns:MaximumSpeed', ns).text),
+                'max_hr': float(lap.find('ns:MaximumHeartRateBpm/ns:Value', ns).text),
+                'avg_hr': float(lap.find('ns:AverageHeartRateBpm/ns:Value', ns).text),
+            })
+            for point in lap.find('ns:Track', ns).findall('ns:Trackpoint', ns):
+                position = point.find('ns:Position', ns)
+                if position is None:
+                    continue
+                points.append({
+                    'latitude': float(position.find('ns:LatitudeDegrees', ns).text),
+                    'longitude': float(position.find('ns:LongitudeDegrees', ns).text),
+                    'elevation': float(point.find('ns:AltitudeMeters', ns).text),
+                    'time': dp.parse(point.find('ns:Time', ns).text),
+                    'heart_rate': int(point.find('ns:HeartRateBpm/ns:Value', ns).text),
+                    'cadence': int(point.find('ns:Cadence', ns).text),
+                    'speed': float(point.find('.//ns3:Speed', ns).text),
+                    'lap': lap_no,
+                })
+        return pd.DataFrame(points), pd.DataFrame(laps)
+
+    @staticmethod
+    def read_gpx(file_path: str) -> pd.DataFrame:
+        """Points of the file as read by gpxpy, segments numbered from 1 over all tracks"""
+        import gpxpy
+
+        ns = {'garmin_tpe': 'http://www.garmin.com/xmlschemas/TrackPointExtension/v1'}
+        with open(file_path) as f:
+            gpx = gpxpy.parse(f)
+        points = []
+        segments = [segment for track in gpx.tracks for segment in track.segments]
+        for segment_no, segment in enumerate(segments, 1):
+            for point in segment.points:
+                data = {'latitude': point.latitude, 'longitude': point.longitude, 'elevation': point.elevation,
+                        'time': point.time, 'heart_rate': None, 'cadence': None, 'segment': segment_no}
+                if point.extensions:
+                    for field, tag in (('heart_rate', 'garmin_tpe:hr'), ('cadence', 'garmin_tpe:cad')):
+                        elem = point.extensions[0].find(tag, ns)
+                        if elem is not None:
+                            data[field] = int(elem.text)
+                points.append(data)
+        df = pd.DataFrame(points)
+        df[['heart_rate', 'cadence']] = df[['heart_rate', 'cadence']].astype(float)
+        return df
+
+    def test_fit(self):
+        file_path = self.dataset + '.fit'
+        points, laps = self.read_fit(file_path)
+        dataframes = self.get_dataframes('fit', file_path)
+        self.assertEqual(len(dataframes[Point]), 10431)
+        self.assertFramesEqual(dataframes[Point], points, times=('timestamp',))
+        self.assertFramesEqual(dataframes[Lap], laps, times=('start_time',))
+
+    def test_tcx(self):
+        # the dataset has no tcx file, a generated one has every field and several laps
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_path = generate_file('tcx', 2500, directory.name)
+        points, laps = self.read_tcx(file_path)
+        dataframes = self.get_dataframes('tcx', file_path, chunk_size=400)
+        self.assertEqual(dataframes[Lap]['number'].tolist(), [1, 2, 3])
+        self.assertFramesEqual(dataframes[Point], points, times=('time',))
+        self.assertFramesEqual(dataframes[Lap], laps, times=('start_time',))
+
+    def test_gpx(self):
+        file_path = self.dataset + '.gpx'
+        dataframes = self.get_dataframes('gpx', file_path)
+        self.assertEqual(set(dataframes), {Point})
+        self.assertEqual(len(dataframes[Point]), 9719)
+        self.assertFramesEqual(dataframes[Point], self.read_gpx(file_path), times=('time',))
+
+    def test_gpx_segments(self):
+        """Segments are numbered over all tracks and stored as the lap number"""
+        point = ('<trkpt lat="37.{0}" lon="-122.2"><ele>10.5</ele><time>2020-10-10T18:27:2{0}Z</time>'
+                 '<extensions><gpxtpx:TrackPointExtension><gpxtpx:hr>14{0}</gpxtpx:hr>'
+                 '</gpxtpx:TrackPointExtension></extensions></trkpt>')
+        gpx = ('<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="test" '
+               'xmlns="http://www.topografix.com/GPX/1/1" '
+               'xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">'
+               '<trk><trkseg>{}{}</trkseg></trk><trk><trkseg>{}</trkseg><trkseg>{}{}</trkseg></trk></gpx>'
+               ).format(*(point.format(i) for i in range(5)))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_path = os.path.join(directory.name, 'segments.gpx')
+        with open(file_path, 'w') as f:
+            f.write(gpx)
+        df = self.get_dataframes('gpx', file_path, chunk_size=2)[Point]
+        self.assertEqual(df['segment'].tolist(), [1, 1, 2, 3, 3])
+        self.assertEqual(get_formats()['gpx'].get_service().points_fields['segment'], 'lap_number')
+        self.assertFramesEqual(df, self.read_gpx(file_path), times=('time',))
+
+
+class BenchmarkTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_generators(self):
+        for extension, rows in (('csv', {Lap: 1501}), ('fit', {Point: 1500, Lap: 2}), ('gpx', {Point: 1500}),
+                                ('tcx', {Point: 1500, Lap: 2})):
+            path = generate_file(extension, 1500, self.directory)
+            frames = list(get_formats()[extension].get_service()(None).get_model_dataframes(path))
+            counts = {}
+            for model, df in frames:
+                counts[model] = counts.get(model, 0) + len(df)
+            self.assertEqual({model: count for model, count in counts.items() if count}, rows, extension)
+            if Point in rows:
+                df = pd.concat([df for model, df in frames if model is Point])
+                self.assertAlmostEqual(df['latitude'].iloc[0], START_POSITION[0], places=3)
+                self.assertEqual(df.iloc[:, 2].isna().sum(), 0)
+
+    def test_benchmark_file(self):
+        with override_settings(MEDIA_ROOT=self.directory, ENTRY_FRAME_CACHE_DIR=''):
+            results = benchmark_file('gpx', generate_file('gpx', 200, self.directory), trace_memory=False)
+        self.assertEqual([result['stage'] for result in results], list(STAGES))
+        self.assertTrue(all(result['rows'] == 200 for result in results))
+        self.assertFalse(Entry.objects.exists())
+
+    def test_compare(self):
+        baseline = {'results': [{'format': 'fit', 'points': 1000, 'stage': 'run', 'seconds': 1.0, 'queries': 10,
+                                 'peak_memory': 100}]}
+        results = {'results': [dict(baseline['results'][0], seconds=1.2, peak_memory=110)]}
+        self.assertEqual(compare(results, baseline), [])
+        results['results'][0].update(seconds=1.5, queries=11, peak_memory=200)
+        self.assertEqual(len(compare(results, baseline)), 3)
+
+
+class MetricsTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(MEDIA_ROOT=directory.name, ENTRY_FRAME_CACHE_DIR='', ENTRY_METRICS_TOKEN='')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        user = get_user_model().objects.create(username='metrics')
+        path = generate_file('gpx', 300, directory.name)
+        self.entry = Entry(customer=user, file=os.path.basename(path))
+        self.entry.skip_enqueue = True
+        self.entry.save()
+
+    def test_entry_metrics(self):
+        get_formats()['gpx'].get_service()(self.entry, format_name='gpx').run()
+        metrics = {(metric.stage, metric.model): metric for metric in self.entry.metrics.all()}
+        self.assertEqual(metrics['parse', 'point'].rows, 300)
+        self.assertEqual(metrics['submit', 'point'].rows, 300)
+        self.assertEqual(metrics['parse', ''].bytes, os.path.getsize(self.entry.file.path))
+        self.assertEqual({metric.format for metric in metrics.values()}, {'gpx'})
+
+        # processing again replaces them
+        get_formats()['gpx'].get_service()(self.entry, format_name='gpx').run()
+        self.assertEqual(EntryMetric.objects.filter(entry=self.entry).count(), len(metrics))
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('entry_stage_duration_seconds_count{format="gpx",stage="submit",model="point"} 1\n', text)
+        self.assertIn('entry_stage_rows_bucket{format="gpx",stage="parse",model="point",le="1000.0"} 1\n', text)
+        self.assertIn('entry_stage_bytes_count{format="gpx",stage="parse",model=""} 1\n', text)
+        with override_settings(ENTRY_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    def test_histogram_labels(self):
+        other = Entry(customer=self.entry.customer, file=self.entry.file.name)
+        other.skip_enqueue = True
+        other.save()
+        EntryMetric.objects.bulk_create([
+            EntryMetric(entry=self.entry, format='gpx', stage='parse', model='point', calls=1, rows=50),
+            EntryMetric(entry=self.entry, format='fit', stage='submit', model='lap', calls=1, rows=5),
+            EntryMetric(entry=other, format='fit', stage='submit', model='lap', calls=1, rows=500),
+        ])
+        text = render_histogram('rows', 'Rows', 'rows', (10, 100), Q(calls__gt=0))
+        self.assertEqual(text.splitlines()[2:], [
+            'rows_bucket{format="fit",stage="submit",model="lap",le="10.0"} 1',
+            'rows_bucket{format="fit",stage="submit",model="lap",le="100.0"} 1',
+            'rows_bucket{format="fit",stage="submit",model="lap",le="+Inf"} 2',
+            'rows_sum{format="fit",stage="submit",model="lap"} 505',
+            'rows_count{format="fit",stage="submit",model="lap"} 2',
+            'rows_bucket{format="gpx",stage="parse",model="point",le="10.0"} 0',
+            'rows_bucket{format="gpx",stage="parse",model="point",le="100.0"} 1',
+            'rows_bucket{format="gpx",stage="parse",model="point",le="+Inf"} 1',
+            'rows_sum{format="gpx",stage="parse",model="point"} 50',
+            'rows_count{format="gpx",stage="parse",model="point"} 1',
+        ])
+
+    def test_merge(self):
+        parsed = EntryMetrics('fit')
+        parsed.record('parse', Point, seconds=1.5, rows=10)
+        metrics = EntryMetrics('fit')
+        metrics.record('parse', Point, seconds=0.5, rows=5)
+        metrics.merge(pickle.loads(pickle.dumps(parsed)))
+        self.assertEqual(metrics.stages['parse', 'point'], {'calls': 2, 'seconds': 2.0, 'rows': 15, 'bytes': 0,
+                                                             'queries': 0})
+
+
+class ImportJobTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(MEDIA_ROOT=directory.name, ENTRY_FRAME_CACHE_DIR='')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        user = get_user_model().objects.create(username='job')
+        path = generate_file('gpx', 300, directory.name)
+        self.entry = Entry(customer=user, file=os.path.basename(path))
+        self.entry.skip_enqueue = True
+        self.entry.save()
+        self.job = ImportJob.objects.create(entry=self.entry)
+        self.job.start(100)
+
+    def get_service(self):
+        return get_formats()['gpx'].get_service()(self.entry, format_name='gpx', chunk_size=self.job.chunk_size)
+
+    @staticmethod
+    def interrupted(frames):
+        for index, frame in enumerate(frames):
+            if index == 2:
+                raise RuntimeError('worker lost')
+            yield frame
+
+    def test_resume(self):
+        service = self.get_service()
+        with self.assertRaises(RuntimeError):
+            service.store(self.interrupted(service.get_model_dataframes(self.entry.file.path)), job=self.job)
+        self.job.fail(RuntimeError('worker lost'))
+        self.assertEqual(Point.objects.filter(entry=self.entry).count(), 200)
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.chunks_committed, self.job.rows_committed), ('failed', 2, 200))
+        self.assertEqual(self.job.errors[0]['error'], 'RuntimeError: worker lost')
+        self.job.start(500)
+        self.get_service().run(self.job)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.chunks_committed, self.job.rows_committed), ('done', 3, 300))
+        self.assertEqual(self.job.attempts, 2)
+        self.assertEqual(Point.objects.filter(entry=self.entry).count(), 300)
+        self.assertEqual(self.entry.metrics.get(stage='submit', model='point').rows, 100)
+        self.assertEqual(self.entry.summary.points_count, 300)
+
+    @skipIf(pyarrow is None, 'the frame cache needs pyarrow')
+    def test_resume_cached_frames(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # files are cached by their hash
+        self.entry.sha256 = hashlib.sha256(b'job').hexdigest()
+        with override_settings(ENTRY_FRAME_CACHE_DIR=directory.name):
+            # an earlier run cached the file parsed in dataframes of another size
+            other = get_formats()['gpx'].get_service()(self.entry, format_name='gpx', chunk_size=70)
+            self.assertEqual([len(df) for model, df in other.iter_model_dataframes(self.entry.file.path)],
+                             [70, 70, 70, 70, 20])
+            service = self.get_service()
+            self.assertNotEqual(service.get_cache_key(), other.get_cache_key())
+            with self.assertRaises(RuntimeError):
+                service.store(self.interrupted(service.iter_model_dataframes(self.entry.file.path)), job=self.job)
+            self.job.fail(RuntimeError('worker lost'))
+            self.job.start(100)
+
+            with self.assertLogs('entry.services.entry_cache', 'INFO'):
+                other.run(self.job)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.points_committed, self.job.rows_committed), ('done', 300, 300))
+        # only the points after the first 200 were stored again
+        self.assertEqual(self.entry.metrics.get(stage='submit', model='point').rows, 100)
+        self.assertEqual(sorted(Point.objects.filter(entry=self.entry).values_list('timestamp', flat=True)),
+                         [START_TIME + timedelta(seconds=i) for i in range(300)])
+
+    def test_malformed_file(self):
+        with open(self.entry.file.path) as f:
+            content = f.read()
+        # broken after the first chunk of points was stored
+        position = [match.start() for match in re.finditer('<trkpt ', content)][150]
+        with open(self.entry.file.path, 'w') as f:
+            f.write(content[:position] + '<trkpt lat="1" lon="2"><ele>1</trkpt>' + content[position:])
+        with self.assertRaises(MalformedFile):
+            import_entry(self.entry)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.chunks_committed, self.job.rows_committed), ('failed', 0, 0))
+        self.assertTrue(self.job.errors[0]['error'].startswith('MalformedFile: Malformed GPX file: '))
+        self.assertFalse(Point.objects.filter(entry=self.entry).exists())
+
+    @skipUnless(connection.vendor == 'postgresql', 'advisory locks need PostgreSQL')
+    def test_lock(self):
+        other = connection.copy()
+        self.addCleanup(other.close)
+        with entry_lock(self.entry.pk) as locked:
+            self.assertTrue(locked)
+            with other.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', (LOCK_NAMESPACE, self.entry.pk))
+                self.assertFalse(cursor.fetchone()[0])
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', (LOCK_NAMESPACE, self.entry.pk))
+            self.assertTrue(cursor.fetchone()[0])
+        with entry_lock(self.entry.pk) as locked:
+            self.assertFalse(locked)
+
+
+class EntryTaskTestCase(TestCase):
+    """Entries are sent to the queue of their format once committed, and imported by the task"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(MEDIA_ROOT=directory.name, ENTRY_FRAME_CACHE_DIR='')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.user = get_user_model().objects.create(username='task')
+        self.name = os.path.basename(generate_file('fit', 300, directory.name))
+
+    def test_enqueue_on_commit(self):
+        with mock.patch.object(process_entry, 'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks() as callbacks:
+                entry = Entry.objects.create(customer=self.user, file=self.name)
+                # not sent before the entry is committed, workers would not find it
+                apply_async.assert_not_called()
+            self.assertEqual(len(callbacks), 1)
+            apply_async.assert_not_called()
+            callbacks[0]()
+        apply_async.assert_called_once_with(args=(entry.pk,), queue='entry.fit')
+        self.assertEqual(entry.job.status, ImportJob.STATUS_PENDING)
+
+    def test_skip_enqueue(self):
+        with mock.patch.object(process_entry, 'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                entry = Entry(customer=self.user, file=self.name)
+                entry.skip_enqueue = True
+                entry.save()
+        self.assertEqual(callbacks, [])
+        apply_async.assert_not_called()
+        self.assertFalse(ImportJob.objects.filter(entry=entry).exists())
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_import(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            entry = Entry.objects.create(customer=self.user, file=self.name)
+        entry.job.refresh_from_db()
+        self.assertEqual((entry.job.status, entry.job.attempts), (ImportJob.STATUS_DONE, 1))
+        self.assertEqual(Point.objects.filter(entry=entry).count(), 300)
+
+    # eager retries are only run when errors are not propagated, the first retry would be raised
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=False)
+    def test_retries_exhausted(self):
+        error = OperationalError('server closed the connection unexpectedly')
+        with mock.patch('entry.tasks.detect_format', side_effect=error) as detect_format:
+            with self.captureOnCommitCallbacks(execute=True):
+                Entry.objects.create(customer=self.user, file=self.name)
+        attempts = settings.ENTRY_TASK_MAX_RETRIES + 1
+        self.assertEqual(detect_format.call_count, attempts)
+        job = ImportJob.objects.get(entry__file=self.name)
+        self.assertEqual((job.status, job.attempts), (ImportJob.STATUS_FAILED, attempts))
+        self.assertEqual(job.errors[-1]['error'], 'OperationalError: server closed the connection unexpectedly')
+        self.assertFalse(Point.objects.filter(entry=job.entry).exists())
+
+
+class CopyTestCase(TestCase):
+    """Rows stored with COPY are the rows bulk_create stores"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create(username='copy')
+        cls.entries = []
+        for name in ('copied.fit', 'created.fit'):
+            entry = Entry(customer=cls.user, file=name)
+            entry.skip_enqueue = True
+            entry.save()
+            cls.entries.append(entry)
+
+    def test_csv_stream(self):
+        df = pd.DataFrame({'text': ['', None, 'a,"b"\nc', 'd\r\ne'], 'value': [1.5, np.nan, None, 2.0]})
+        stream = CsvStream(df, chunk_size=3)
+        data = ''.join(iter(lambda: stream.read(5), ''))
+        self.assertEqual(list(csv.reader(io.StringIO(data))), [
+            ['', '1.5'], ['\\N', '\\N'], ['a,"b"\nc', '\\N'], ['d\r\ne', '2.0']])
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL')
+    def test_strings(self):
+        members = ['', 'a,"b"\nc', 'd\r\ne', 'back\\slash', ' spaced ', '""']
+        copy_dataframe_to_db(Entry, pd.DataFrame({'file': 'copied.zip', 'member': members}), customer_id=self.user.pk)
+        Entry.objects.bulk_create(Entry(customer=self.user, file='created.zip', member=member) for member in members)
+        rows = list(Entry.objects.filter(file__endswith='.zip').order_by('pk').values_list(
+            'member', 'sha256', 'source', 'parent'))
+        self.assertEqual(rows[:len(members)], rows[len(members):])
+        self.assertEqual([row[0] for row in rows[:len(members)]], members)
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL')
+    def test_missing_values(self):
+        df = pd.DataFrame({
+            'latitude': [37.1, np.nan, None], 'lap_number': [1, np.nan, 2], 'heart_rate': [np.nan, 120.0, None],
+            'timestamp': [START_TIME, None, START_TIME + timedelta(seconds=1)],
+        })
+        copy_dataframe_to_db(Point, df, user_id=self.user.pk, entry_id=self.entries[0].pk)
+        Point.objects.bulk_create(
+            Point(user=self.user, entry=self.entries[1], **{name: None if pd.isna(value) else value
+                                                            for name, value in row.items()})
+            for row in df.astype(object).to_dict('records'))
+        fields = ('latitude', 'longitude', 'lap_number', 'heart_rate', 'timestamp')
+        copied, created = [list(Point.objects.filter(entry=entry).order_by('pk').values_list(*fields))
+                           for entry in self.entries]
+        self.assertEqual(copied, created)
+        self.assertEqual(copied[1], (None, None, None, 120.0, None))
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL')
+    def test_on_conflict(self):
+        entry = self.entries[0]
+        copy_dataframe_to_db(Lap, pd.DataFrame({'number': [1, 2], 'total_distance': [1000.0, 2000.0]}),
+                             user_id=self.user.pk, entry_id=entry.pk)
+        created = dict(Lap.objects.values_list('number', 'created'))
+        stored = copy_dataframe_to_db(Lap, pd.DataFrame({'number': [2, 3], 'total_distance': [2500.0, 3000.0]}),
+                                      on_conflict=ON_CONFLICT_UPDATE, user_id=self.user.pk, entry_id=entry.pk)
+        self.assertEqual(stored, 2)
+        stored = copy_dataframe_to_db(Lap, pd.DataFrame({'number': [3], 'total_distance': [0.0]}),
+                                      on_conflict=ON_CONFLICT_IGNORE, user_id=self.user.pk, entry_id=entry.pk)
+        self.assertEqual(stored, 0)
+        self.assertEqual(dict(Lap.objects.values_list('number', 'total_distance')), {1: 1000.0, 2: 2500.0, 3: 3000.0})
+        self.assertEqual(Lap.objects.get(number=2).created, created[2])
+
+    def test_bulk_create_batch_size(self):
+        service = get_formats()['gpx'].get_service()(self.entries[0])
+        service.bulk_create_batch_size = 5
+        df = pd.DataFrame({'latitude': np.arange(12.0), 'longitude': np.arange(12.0), 'elevation': np.nan,
+                           'time': pd.date_range(START_TIME, periods=12, freq='s'), 'heart_rate': np.nan,
+                           'cadence': np.nan, 'segment': 1})
+        # other databases get objs in batches of the service
+        with mock.patch.object(connection, 'vendor', 'sqlite'), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(service.submit_dataframe_to_db(df, Point), 12)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('INSERT')]), 3)
+        self.assertEqual(Point.objects.filter(entry=self.entries[0]).count(), 12)
+
+
+class TrackBlobImportTestCase(TestCase):
+    """Imports in the blob point storage mode store the points of the entry in its track, no point rows"""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(MEDIA_ROOT=directory.name, ENTRY_FRAME_CACHE_DIR='')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.user = get_user_model().objects.create(username='blob')
+        self.entry = Entry(customer=self.user, file=os.path.basename(generate_file('fit', 300, directory.name)))
+        self.entry.skip_enqueue = True
+        self.entry.save()
+        self.service = get_formats()['fit'].get_service()(self.entry, format_name='fit', point_storage='blob')
+
+    def test_import(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.run()
+        self.assertEqual(Point.objects.count(), 0)
+        self.assertEqual(Lap.objects.filter(entry=self.entry).count(), 1)
+        self.assertEqual(self.entry.track.points_count, 300)
+        self.assertEqual(self.entry.summary.points_count, 300)
+
+        fields = self.service.get_model_fields(Point)
+        points = pd.concat([df for model, df in self.service.get_model_dataframes(self.entry.file.path)
+                            if model is Point], ignore_index=True)[list(fields)].rename(columns=fields)
+        df = self.entry.track.to_dataframe()
+        np.testing.assert_allclose(df['latitude'], points['latitude'], atol=1e-7)
+        np.testing.assert_allclose(df['longitude'], points['longitude'], atol=1e-7)
+        pd.testing.assert_series_equal(df['timestamp'], points['timestamp'], check_dtype=False)
+        self.assertEqual(df['heart_rate'].tolist(), points['heart_rate'].tolist())
+        self.assertEqual(df['lap_number'].tolist(), [1.0] * 300)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('entry:entry-points', args=(self.entry.pk,)),
+                                   {'fields': 'id,timestamp,heart_rate'})
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(range(300)))
+        self.assertEqual(rows[1], {'id': 1, 'timestamp': '2020-10-10T18:27:24Z', 'heart_rate': df['heart_rate'][1]})
+
+    def test_reimport_without_points(self):
+        self.service.run()
+        self.assertTrue(TrackBlob.objects.filter(entry=self.entry).exists())
+        # e.g. the file was replaced by one without records
+        self.service.store([])
+        self.assertFalse(TrackBlob.objects.filter(entry=self.entry).exists())
+        self.assertEqual(Lap.objects.filter(entry=self.entry).count(), 0)
+
+
+class ReimportTestCase(TestCase):
+    gpx = b"""<?xml version="1.0"?><gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>
+  <trkpt lat="37.1" lon="-122.1"/><trkpt lat="37.2" lon="-122.2"/>
+  <trkpt lat="37.3" lon="-122.3"><time>2020-10-10T18:27:23Z</time></trkpt>
+  <trkpt lat="37.4" lon="-122.4"><time>2020-10-10T18:27:23Z</time></trkpt>
+</trkseg></trk></gpx>"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(MEDIA_ROOT=directory.name, ENTRY_FRAME_CACHE_DIR='')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        with open(os.path.join(directory.name, 'run.gpx'), 'wb') as f:
+            f.write(self.gpx)
+        self.entry = Entry(customer=get_user_model().objects.create(username='reimport'), file='run.gpx')
+        self.entry.skip_enqueue = True
+        self.entry.save()
+
+    def run_service(self, job=None):
+        get_formats()['gpx'].get_service()(self.entry, format_name='gpx').run(job)
+
+    def test_reimport(self):
+        with self.assertLogs('entry.services.entry_base', 'WARNING') as logs:
+            self.run_service()
+        # the second sample of the same time is skipped
+        self.assertIn('1 of 4 point rows conflict', logs.output[0])
+        self.assertEqual(Point.objects.filter(entry=self.entry).count(), 3)
+
+        # points without timestamp are not stored twice
+        self.run_service()
+        job = ImportJob.objects.create(entry=self.entry)
+        job.start(100)
+        self.run_service(job)
+        self.assertEqual(Point.objects.filter(entry=self.entry).count(), 3)
+        self.assertEqual(Point.objects.filter(entry=self.entry, timestamp__isnull=True).count(), 2)
+
+
+class DuplicateEntryTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='duplicates')
+
+    def create_entry(self) -> Entry:
+        entry = Entry(customer=self.user, file='run.gpx', sha256=hashlib.sha256(b'run').hexdigest())
+        entry.skip_enqueue = True
+        entry.save()
+        return entry
+
+    def test_unsupported_extension(self):
+        with self.assertRaises(ValidationError):
+            Entry.objects.create(customer=self.user, file='dump.gz')
+
+    def test_failed_source(self):
+        failed = self.create_entry()
+        ImportJob.objects.create(entry=failed, status=ImportJob.STATUS_FAILED)
+        # an entry without a job has no data either
+        self.create_entry()
+        entry = self.create_entry()
+        self.assertIsNone(entry.source)
+        ImportJob.objects.create(entry=entry)
+        self.assertEqual(self.create_entry().source, entry)
+
+    def test_delete_source(self):
+        source = self.create_entry()
+        ImportJob.objects.create(entry=source, status=ImportJob.STATUS_DONE)
+        first, second = self.create_entry(), self.create_entry()
+        self.assertEqual((first.source, second.source), (source, source))
+        with self.captureOnCommitCallbacks() as callbacks:
+            source.delete()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertIsNone(first.source)
+        self.assertEqual(second.source, first)
+        self.assertEqual(first.job.status, ImportJob.STATUS_PENDING)
+        with mock.patch('entry.signals.enqueue_entry') as enqueue_entry:
+            for callback in callbacks:
+                callback()
+        enqueue_entry.assert_called_once_with(first)
+
+
+class ImportEntriesTestCase(TransactionTestCase):
+    """Bulk import command, its db writer threads need committed entries"""
+
+    def test_import(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        files = os.path.join(directory.name, 'files')
+        media = os.path.join(directory.name, 'media')
+        for extension in ('fit', 'gpx', 'tcx'):
+            path = generate_file(extension, 300, files)
+        shutil.copy(path, os.path.join(files, 'copy.tcx'))
+        with open(os.path.join(files, 'broken.fit'), 'wb') as f:
+            f.write(b'not a fit file')
+        get_user_model().objects.create(username='bulk')
+
+        stdout = io.StringIO()
+        # parser processes are spawned, they read the settings from the environment
+        with mock.patch.dict(os.environ, {'MEDIA_UPLOAD_DIR': media, 'ENTRY_FRAME_CACHE_DIR': ''}), \
+                override_settings(MEDIA_ROOT=media, ENTRY_FRAME_CACHE_DIR=''):
+            call_command('import_entries', files, user='bulk', workers=2, stdout=stdout, stderr=io.StringIO())
+        self.assertIn('Imported 3 files (900 points), 1 duplicates, 1 errors', stdout.getvalue())
+
+        self.assertEqual(Entry.objects.count(), 5)
+        self.assertEqual(Point.objects.count(), 900)
+        # the duplicate has no job of its own
+        self.assertEqual(ImportJob.objects.count(), 4)
+        self.assertFalse(ImportJob.objects.filter(entry__source__isnull=False).exists())
+        self.assertEqual(ImportJob.objects.filter(status='done').count(), 3)
+        self.assertEqual(ImportJob.objects.filter(status='done').aggregate(Sum('points_committed')),
+                         {'points_committed__sum': 900})
+        failed = ImportJob.objects.get(status='failed')
+        self.assertEqual(failed.entry.sha256, hashlib.sha256(b'not a fit file').hexdigest())
+        self.assertTrue(failed.errors[0]['error'].startswith('ParseError'))
+
+
+@override_settings(MAX_UPLOAD_SIZE=2 ** 20)
+class UploadHandlerTestCase(SimpleTestCase):
+
+    def upload(self, name: str, content: bytes):
+        request = RequestFactory().post('/', {'file': SimpleUploadedFile(name, content)})
+        request.upload_handlers = [EntryFileUploadHandler(request)]
+        return request.FILES.get('file')
+
+    def test_upload(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(generate_file('gpx', 100, directory.name), 'rb') as f:
+            content = f.read()
+        for name, data in (('run.gpx', content), ('run.gpx.gz', gzip.compress(content))):
+            upload = self.upload(name, data)
+            self.assertEqual(upload.sha256, hashlib.sha256(data).hexdigest())
+            self.assertEqual(upload.format, 'gpx')
+            self.assertTrue(os.path.exists(upload.temporary_file_path()))
+            upload.close()
+
+        # detected from the content, not the name
+        self.assertEqual(self.upload('run.fit', content).format, 'gpx')
+        self.assertIsNone(self.upload('run.fit', b'\0' * 100).format)
+        self.assertIsNone(self.upload('run.gpx.gz', content).format)
+
+        entry = Entry(file=self.upload('run.fit', b'\0' * 100))
+        with self.assertRaises(ValidationError):
+            validate_entry_file_format(entry.file)
+
+    def test_max_upload_size(self):
+        with override_settings(MAX_UPLOAD_SIZE=1000):
+            self.assertIsNone(self.upload('run.gpx', b'<gpx>' + b' ' * 2000))
+
+
+class AdminChangelistTestCase(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.force_login(self.user)
+        entries = []
+        for name in ('run.gpx', 'ride.gpx'):
+            entry = Entry(customer=self.user, file=name)
+            entry.skip_enqueue = True
+            entry.save()
+            entries.append(entry)
+        start = datetime(2022, 7, 1, tzinfo=timezone.utc)
+        # equal timestamps (of two entries) and one without timestamp, pages have to split them by id
+        points = [(entries[0], start), (entries[1], start), (entries[0], start + timedelta(seconds=1)),
+                  (entries[0], None), (entries[1], start + timedelta(seconds=2))]
+        Point.objects.bulk_create(
+            Point(user=self.user, entry=entry, timestamp=timestamp) for entry, timestamp in points)
+        self.addCleanup(setattr, PointAdmin, 'list_per_page', PointAdmin.list_per_page)
+        PointAdmin.list_per_page = 2
+
+    def test_keyset_pages(self):
+        url, ids = reverse('admin:entry_point_changelist'), []
+        query_string = '?user__id__exact={}'.format(self.user.pk)
+        while True:
+            response = self.client.get(url + query_string)
+            self.assertEqual(response.status_code, 200)
+            cl = response.context['cl']
+            self.assertEqual(cl.result_count, 5)
+            ids += [point.pk for point in cl.result_list]
+            if not cl.next_cursor:
+                break
+            query_string = cl.get_next_page_url()
+        expected = Point.objects.order_by(F('timestamp').desc(nulls_first=True), '-id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+        self.assertContains(response, 'admin-autocomplete')
+
+        self.assertEqual(self.client.get(url + '?after=broken').status_code, 302)
+
+    def test_lap_changelist(self):
+        url = reverse('admin:entry_lap_changelist')
+        self.client.get(url)
+        entry = Entry.objects.first()
+        Lap.objects.bulk_create(Lap(user=self.user, entry=entry, number=number) for number in range(3))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.context['cl'].result_list), 3)
+        # entries of the laps are joined, not queried per row
+        self.assertFalse([query for query in queries if 'FROM "entry_entry"' in query['sql']])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create(username='export')
+        self.entry = Entry(customer=self.user, file='run.gpx')
+        self.entry.skip_enqueue = True
+        self.entry.save()
+        self.start = datetime(2022, 7, 1, tzinfo=timezone.utc)
+        Point.objects.bulk_create(
+            Point(user=self.user, entry=self.entry, timestamp=self.start + timedelta(seconds=i), heart_rate=100 + i)
+            for i in range(5))
+        Lap.objects.bulk_create(Lap(user=self.user, entry=self.entry, number=number) for number in (2, 1))
+        self.url = reverse('entry:entry-points', args=(self.entry.pk,))
+        self.client.force_login(self.user)
+
+    def get_content(self, url, **extra) -> str:
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        return (gzip.decompress(content) if response.get('Content-Encoding') == 'gzip' else content).decode()
+
+    def test_points(self):
+        point = Point.objects.get(entry=self.entry, timestamp=self.start + timedelta(seconds=1))
+        after = '{}:{}'.format(point.pk, point.timestamp.isoformat())
+        lines = self.get_content(self.url, data={'fields': 'timestamp,heart_rate', 'after': after,
+                                                 'limit': 2}).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'timestamp': '2022-07-01T00:00:02Z', 'heart_rate': 102.0},
+            {'timestamp': '2022-07-01T00:00:03Z', 'heart_rate': 103.0},
+        ])
+
+        content = self.get_content(self.url + '?format=csv&fields=heart_rate', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(content.splitlines(), ['heart_rate'] + ['{:.1f}'.format(100 + i) for i in range(5)])
+
+        laps = self.get_content(reverse('entry:entry-laps', args=(self.entry.pk,)) + '?fields=number')
+        self.assertEqual(laps.splitlines(), ['{"number":1}', '{"number":2}'])
+
+        self.assertEqual(self.client.get(self.url + '?fields=password').status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'after': '1:yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'after': '1'}).status_code, 400)
+        self.client.force_login(get_user_model().objects.create(username='other'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def get_pages(self, url) -> list:
+        """All points, read in pages of 2 following the cursor"""
+        rows = []
+        params = {'fields': 'id,timestamp,heart_rate', 'limit': 2}
+        while True:
+            page = [json.loads(line) for line in self.get_content(url, data=params).splitlines()]
+            rows.extend(page)
+            if len(page) < 2:
+                return rows
+            params['after'] = '{}:{}'.format(page[-1]['id'], page[-1]['timestamp'] or '')
+
+    def test_points_without_timestamp(self):
+        Point.objects.bulk_create(Point(user=self.user, entry=self.entry, heart_rate=200 + i) for i in range(3))
+        heart_rates = [100.0 + i for i in range(5)] + [200.0 + i for i in range(3)]
+        self.assertEqual([row['heart_rate'] for row in self.get_pages(self.url)], heart_rates)
+
+        # blob points are numbered by their position in the track
+        track = TrackWriter()
+        track.add(pd.DataFrame(Point.objects.filter(entry=self.entry).order_by('-id').values(*POINT_FIELDS[1:])))
+        TrackBlob.objects.create(user=self.user, entry=self.entry, data=track.pack(), points_count=track.size)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_entry(self.entry.pk)
+        rows = self.get_pages(self.url)
+        self.assertEqual([row['heart_rate'] for row in rows], heart_rates[:5] + heart_rates[:4:-1])
+        self.assertEqual([row['id'] for row in rows], [7, 6, 5, 4, 3, 0, 1, 2])
+
+
+@override_settings(CACHES=LOCMEM_CACHES, ENTRY_API_TOKEN='secret')
+class CacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create(username='cache')
+        self.entry = Entry(customer=user, file='run.gpx')
+        self.entry.skip_enqueue = True
+        self.entry.save()
+        self.pk = self.entry.pk
+        EntrySummary.objects.create(user=user, entry=self.entry, points_count=2, polylines={'0': 'abc', '12': 'abcdef'})
+        start = datetime(2022, 7, 1, tzinfo=timezone.utc)
+        Point.objects.bulk_create(Point(user=user, entry=self.entry, timestamp=start + timedelta(seconds=i))
+                                  for i in range(2))
+
+    def get(self, name: str, **params):
+        return self.client.get(reverse(name, args=(self.pk,)), params, HTTP_AUTHORIZATION='Bearer secret')
+
+    def test_cached_reads(self):
+        self.assertEqual(self.get('entry:entry-summary', zoom=13).json()['polyline'], 'abcdef')
+        page = b''.join(self.get('entry:entry-points', limit=10).streaming_content)
+        with self.assertNumQueries(0):
+            summary = self.get('entry:entry-summary', zoom=13).json()
+            self.assertEqual(self.get('entry:entry-points', limit=10).content, page)
+        self.assertEqual((summary['points_count'], summary['polyline']), (2, 'abcdef'))
+        response = self.client.get(reverse('entry:entry-points', args=(self.pk,)), {'limit': 10},
+                                   HTTP_AUTHORIZATION='Bearer secret', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), page)
+
+        # imported again
+        EntrySummary.objects.filter(entry=self.entry).update(points_count=1)
+        Point.objects.filter(entry=self.entry, timestamp__gt=datetime(2022, 7, 1, tzinfo=timezone.utc)).delete()
+        self.assertEqual(self.get('entry:entry-summary').json()['points_count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_entry(self.entry.pk)
+        self.assertEqual(self.get('entry:entry-summary').json()['points_count'], 1)
+        self.assertEqual(len(b''.join(self.get('entry:entry-points', limit=10).streaming_content).splitlines()), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.entry.delete()
+        self.assertEqual(self.get('entry:entry-summary').status_code, 404)
+
+    def test_pack(self):
+        value = {'time': '2022-07-01T00:00:00Z', 'distance': 1234.5, 'polyline': 'a' * 1000}
+        self.assertEqual(unpack_value(pack_value(value)), value)
+        self.assertLess(len(pack_value(value)), 100)
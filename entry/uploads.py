@@ -0,0 +1,99 @@
+"""Entry file uploads
+
+Uploaded files are streamed chunk by chunk to FILE_UPLOAD_TEMP_DIR, never held in memory. Each chunk is hashed and
+the start of the file is kept to detect its format as it arrives (decompressed for `.gz` files), so the upload
+carries its `sha256` and `format` when it completes: the entry file is stored under its hash without reading it
+again, and a file of an unsupported format is rejected by the form. Requests larger than MAX_UPLOAD_SIZE are
+stopped before their body is read, or as soon as their files pass it when the length is not sent.
+"""
+import hashlib
+import logging
+import zlib
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+
+from entry.archives import ARCHIVE_EXTENSIONS, get_name_extension, is_compressed
+from entry.formats import HEAD_SIZE, UnsupportedFormat, is_zip, sniff_format
+
+logger = logging.getLogger(__name__)
+
+
+class HeadSniffer:
+    """Collect the first HEAD_SIZE bytes of the data of a file, fed chunk by chunk, and detect its format"""
+
+    def __init__(self, name: str):
+        self.extension = get_name_extension(name)
+        self.head = b''
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if is_compressed(name) else None
+        self.broken = False
+
+    @property
+    def complete(self) -> bool:
+        return self.broken or len(self.head) >= HEAD_SIZE
+
+    def feed(self, chunk: bytes):
+        if self.complete:
+            return
+        if self.decompressor is not None:
+            try:
+                chunk = self.decompressor.decompress(chunk, HEAD_SIZE - len(self.head))
+            except zlib.error:
+                # not gzip data
+                self.broken = True
+                return
+        self.head += chunk[:HEAD_SIZE - len(self.head)]
+
+    def get_format(self) -> Optional[str]:
+        """Name of the detected format, the extension of archives, None if the content is not supported"""
+        if self.broken:
+            return None
+        if self.extension in ARCHIVE_EXTENSIONS:
+            return self.extension if is_zip(self.head) else None
+        try:
+            return sniff_format(self.extension, self.head).name
+        except UnsupportedFormat:
+            return None
+
+
+class EntryFileUploadHandler(TemporaryFileUploadHandler):
+    """Stream uploads to temporary files, hashing them and detecting their format while they are written
+    the uploaded file gets `sha256` (hex digest) and `format` (see `HeadSniffer.get_format`)
+    """
+    chunk_size = settings.UPLOAD_CHUNK_SIZE
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_size = settings.MAX_UPLOAD_SIZE
+        self.received = 0
+        self.too_large = False
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # raising here would break the request, the upload is stopped when its first file starts
+        self.too_large = content_length > self.max_size
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        if self.too_large or (content_length or 0) > self.max_size:
+            self.stop()
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.digest = hashlib.sha256()
+        self.sniffer = HeadSniffer(self.file_name)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.stop()
+        self.digest.update(raw_data)
+        self.sniffer.feed(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        file.format = self.sniffer.get_format()
+        return file
+
+    def stop(self):
+        logger.warning('Upload of %s stopped, larger than %s bytes', self.request.path, self.max_size)
+        raise StopUpload(connection_reset=True)
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from entry import views
+
+app_name = 'entry'
+
+urlpatterns = [
+    path('metrics', views.metrics, name='metrics'),
+    path('entries/<int:pk>/summary', views.entry_summary, name='entry-summary'),
+    path('entries/<int:pk>/points', views.entry_points, name='entry-points'),
+    path('entries/<int:pk>/laps', views.entry_laps, name='entry-laps'),
+]
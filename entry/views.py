@@ -0,0 +1,159 @@
+import gzip
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.forms import DateTimeField
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+
+from entry.cache import cache_page_chunks, get_or_set, get_page, make_key
+from entry.exports import CONTENT_TYPES, LAP_FIELDS, POINT_FIELDS, WRITERS, get_lap_rows, get_point_rows
+from entry.metrics import CONTENT_TYPE, render_metrics
+from entry.models import Entry, EntrySummary
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+SUMMARY_FIELDS = (
+    'start_time', 'end_time', 'duration', 'total_distance', 'elevation_gain', 'avg_heart_rate', 'max_heart_rate',
+    'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude', 'points_count', 'laps_count',
+)
+
+
+@require_GET
+def metrics(request):
+    """Import metrics of all entries in the Prometheus text format
+    with ENTRY_METRICS_TOKEN set, scrapers have to send it as a bearer token
+    """
+    token = settings.ENTRY_METRICS_TOKEN
+    if token and request.headers.get('Authorization') != 'Bearer {}'.format(token):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+def is_authorized(request, customer_id: int) -> bool:
+    """Bearer ENTRY_API_TOKEN, or a session of the customer of the entry or of staff"""
+    token = settings.ENTRY_API_TOKEN
+    if token and request.headers.get('Authorization') == 'Bearer {}'.format(token):
+        return True
+    return request.user.is_authenticated and (request.user.is_staff or request.user.pk == customer_id)
+
+
+def get_entry_access(pk: int) -> dict:
+    """Customer of the entry and the entry holding its data, cached until the entry is deleted"""
+    def load():
+        entry = Entry.objects.filter(pk=pk).values('customer_id', 'source_id').first()
+        return entry and {'customer': entry['customer_id'], 'data_entry': entry['source_id'] or pk}
+
+    access = get_or_set(make_key(pk, 'access'), load)
+    if access is None:
+        raise Http404
+    return access
+
+
+def page_response(request, body: bytes, content_type: str) -> HttpResponse:
+    """Response of a cached gzipped page body, sent as it is to clients accepting gzip"""
+    if ACCEPTS_GZIP.search(request.headers.get('Accept-Encoding', '')):
+        response = HttpResponse(body, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(gzip.decompress(body), content_type=content_type)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def stream_rows(request, pk: int, kind: str, fields, get_rows, parse_after):
+    """Stream rows of the entry in the requested format (`ndjson` or `csv`), with the requested fields
+    `after` and `limit` page through them, the response is gzipped if the client accepts it.
+    Pages up to ENTRY_CACHE_PAGE_ROWS rows are cached.
+    """
+    access = get_entry_access(pk)
+    if not is_authorized(request, access['customer']):
+        return HttpResponseForbidden()
+    output = request.GET.get('format', 'ndjson')
+    if output not in WRITERS:
+        return HttpResponseBadRequest('format has to be one of {}'.format(', '.join(WRITERS)))
+    selected = [field for field in request.GET.get('fields', '').split(',') if field] or list(fields)
+    unknown = set(selected) - set(fields)
+    if unknown:
+        return HttpResponseBadRequest('Unknown fields {}, available: {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(fields)))
+    try:
+        after = parse_after(request.GET)
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+        if limit is not None and limit < 1:
+            raise ValueError('limit has to be positive')
+    except (ValueError, ValidationError) as e:
+        return HttpResponseBadRequest(str(e))
+
+    key = None
+    if limit is not None and limit <= settings.ENTRY_CACHE_PAGE_ROWS:
+        key = make_key(access['data_entry'], kind, output, selected, after, limit)
+        body = get_page(key)
+        if body is not None:
+            return page_response(request, body, CONTENT_TYPES[output])
+    entry = get_object_or_404(Entry.objects.select_related('source'), pk=pk)
+    chunks = WRITERS[output](selected, get_rows(entry, selected, after=after, limit=limit))
+    if key is not None:
+        chunks = cache_page_chunks(key, chunks)
+    return StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[output])
+
+
+def parse_after_point(params):
+    """`after` cursor of points, `<id>:<timestamp>` of the last point read, the timestamp empty if it has none"""
+    value = params.get('after')
+    if not value:
+        return None
+    pk, separator, timestamp = value.partition(':')
+    if not separator:
+        raise ValueError('after has to be <id>:<timestamp>')
+    return DateTimeField().clean(timestamp) if timestamp else None, int(pk)
+
+
+def parse_after_number(params):
+    value = params.get('after_number')
+    return int(value) if value else None
+
+
+@require_GET
+@gzip_page
+def entry_points(request, pk: int):
+    """Points of an entry in (timestamp, id) order, pages follow the `after` cursor of the last point read"""
+    return stream_rows(request, pk, 'points', POINT_FIELDS, get_point_rows, parse_after_point)
+
+
+@require_GET
+@gzip_page
+def entry_laps(request, pk: int):
+    """Laps of an entry by number, pages follow `after_number` of the last lap read"""
+    return stream_rows(request, pk, 'laps', LAP_FIELDS, get_lap_rows, parse_after_number)
+
+
+@require_GET
+@gzip_page
+def entry_summary(request, pk: int):
+    """Summary of an entry, with its simplified track (encoded polyline) for the map `zoom` if given"""
+    access = get_entry_access(pk)
+    if not is_authorized(request, access['customer']):
+        return HttpResponseForbidden()
+    try:
+        zoom = int(request.GET['zoom']) if request.GET.get('zoom') else None
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    data_entry = access['data_entry']
+
+    summary = get_or_set(make_key(data_entry, 'summary'), lambda: EntrySummary.objects.filter(
+        entry_id=data_entry).values(*SUMMARY_FIELDS).first())
+    if summary is None:
+        raise Http404
+    if zoom is not None:
+        def load_track():
+            polylines = EntrySummary.objects.filter(entry_id=data_entry).values_list('polylines', flat=True).first()
+            return EntrySummary(polylines=polylines or {}).polyline_for_zoom(zoom)
+
+        summary['polyline'] = get_or_set(make_key(data_entry, 'track', zoom), load_track)
+    return JsonResponse(summary)
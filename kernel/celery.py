@@ -0,0 +1,19 @@
+"""
+Celery config for kernel project.
+
+It exposes the Celery app as a module-level variable named ``app``.
+Start a worker with:
+    celery -A kernel worker -l info -Q entry,entry.csv,entry.fit,entry.gpx,entry.tcx
+and periodic tasks with:
+    celery -A kernel beat -l info
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kernel.settings.development')
+
+app = Celery('kernel')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
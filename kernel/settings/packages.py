@@ -1,13 +1,14 @@
 import os
 from datetime import timedelta
 
-from decouple import config
+from decouple import Csv, config
 from django.conf import settings
 
 from .base import (
     INSTALLED_APPS, MIDDLEWARE,
     STATIC_ROOT, BASE_DIR, STATICFILES_DIRS
 )
+from .secure import CACHE_TTL
 
 # ############## #
 #   EXTENSIONS   #
@@ -31,10 +32,88 @@ INSTALLED_APPS.append('entry')
 # ########### #
 #   UPLOAD    #
 # ########### #
-# FILE_UPLOAD_HANDLERS = [
-#     'painless.utils.handlers.upload.ChunkFileUploadHandler'
-# ]
-# UPLOAD_CHUNK_SIZE = 2500 * 2 ** 10  # 2500 KB
+# uploads are streamed to FILE_UPLOAD_TEMP_DIR, hashed and sniffed while written, FILE_UPLOAD_MAX_MEMORY_SIZE is unused
+FILE_UPLOAD_HANDLERS = [
+    'entry.uploads.EntryFileUploadHandler'
+]
+UPLOAD_CHUNK_SIZE = config('UPLOAD_CHUNK_SIZE', default=2 ** 20, cast=int)  # 1 MB
+
+# ########### #
+#   CELERY    #
+# ########### #
+CELERY_BROKER_URL = config('REDIS_HOST')
+CELERY_TASK_DEFAULT_QUEUE = 'entry'
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TIMEZONE = 'UTC'
+CELERY_BEAT_SCHEDULE = {
+    'create-point-partitions': {
+        'task': 'entry.tasks.create_point_partitions',
+        'schedule': timedelta(days=1),
+    },
+    'resume-import-jobs': {
+        'task': 'entry.tasks.resume_import_jobs',
+        'schedule': timedelta(minutes=5),
+    },
+}
+
+# ########### #
+#    CACHE    #
+# ########### #
+# redis db 1 by default, the broker uses db 0. Failures of the cache are logged and reads fall back to the db
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': config('REDIS_CACHE_URL', default=CELERY_BROKER_URL.rstrip('/') + '/1'),
+        'TIMEOUT': CACHE_TTL,
+        'KEY_PREFIX': 'entry',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+            'IGNORE_EXCEPTIONS': True,
+        },
+    },
+}
+DJANGO_REDIS_LOG_IGNORED_EXCEPTIONS = True
+
+# each file format is processed in its own queue (`entry.<extension>`), so workers can be scaled per format
+ENTRY_TASK_MAX_RETRIES = config('ENTRY_TASK_MAX_RETRIES', default=5, cast=int)
+# import jobs without progress for this many seconds are sent to their queue again, up to max attempts
+ENTRY_IMPORT_JOB_STALE_AFTER = config('ENTRY_IMPORT_JOB_STALE_AFTER', default=600, cast=int)
+ENTRY_IMPORT_JOB_MAX_ATTEMPTS = config('ENTRY_IMPORT_JOB_MAX_ATTEMPTS', default=5, cast=int)
+# points parsed, converted and inserted at a time by streaming services
+ENTRY_CHUNK_SIZE = config('ENTRY_CHUNK_SIZE', default=5000, cast=int)
+# monthly point partitions kept created ahead of the current month
+ENTRY_POINT_PARTITIONS_AHEAD = config('ENTRY_POINT_PARTITIONS_AHEAD', default=3, cast=int)
+# dotted paths of entry.formats.Format objs of more file formats
+ENTRY_FORMATS = config('ENTRY_FORMATS', default='', cast=Csv())
+# how parsed points are stored: `rows` (a Point row each) or `blob` (one compressed TrackBlob per entry)
+ENTRY_POINT_STORAGE = config('ENTRY_POINT_STORAGE', default='rows')
+# parsed dataframes cached as parquet (needs pyarrow) by file hash and parser version, empty to disable
+ENTRY_FRAME_CACHE_DIR = config('ENTRY_FRAME_CACHE_DIR', default=os.path.join(BASE_DIR, 'cache', 'frames'))
+# least recently used files are evicted above this size in bytes
+ENTRY_FRAME_CACHE_SIZE = config('ENTRY_FRAME_CACHE_SIZE', default=2 * 2 ** 30, cast=int)
+# simplified track polylines stored in the entry summary, min map zoom -> Douglas-Peucker tolerance in meters
+ENTRY_POLYLINE_LEVELS = {
+    0: 100.0,
+    11: 25.0,
+    14: 5.0,
+}
+# decimal digits of encoded polyline coordinates
+ENTRY_POLYLINE_PRECISION = 5
+# bearer token the /metrics endpoint requires, empty leaves it open (e.g. only reachable by the scraper)
+ENTRY_METRICS_TOKEN = config('ENTRY_METRICS_TOKEN', default='')
+# bearer token of the points and laps endpoints for internal consumers, without it only sessions of the customer
+# of the entry or of staff are accepted
+ENTRY_API_TOKEN = config('ENTRY_API_TOKEN', default='')
+# rows read through the server-side cursor and written to the response at a time
+ENTRY_API_CHUNK_SIZE = config('ENTRY_API_CHUNK_SIZE', default=2000, cast=int)
+# pages of the points and laps endpoints up to this `limit` are cached, larger ones are only streamed
+ENTRY_CACHE_PAGE_ROWS = config('ENTRY_CACHE_PAGE_ROWS', default=10000, cast=int)
 
 # ######################### #
 #       AdminInterface      #
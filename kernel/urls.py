@@ -27,6 +27,9 @@ urlpatterns = [
     path('secure/docs/', include('django.contrib.admindocs.urls')),
     path('secure/', admin.site.urls, name='admin'),
 
+    # prometheus scrape endpoint, points and laps read endpoints
+    path('', include('entry.urls')),
+
 ] + static(
     settings.STATIC_URL, document_root=settings.STATIC_ROOT
 ) + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)